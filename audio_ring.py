@@ -0,0 +1,65 @@
+"""
+Кольцевой буфер отсчетов между аудиопотоком PyAudio и потоком обработки.
+
+Один писатель и один читатель: позицию записи меняет только писатель,
+позицию чтения - только читатель, поэтому блокировки не нужны. Писатель
+сначала копирует отсчеты и только потом публикует новую позицию, так что
+читатель никогда не видит недописанных данных. Колбэк звуковой карты не
+ждет читателя: при переполнении лишние отсчеты отбрасываются и считаются.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class SampleRing:
+    """Кольцо отсчетов int16 без блокировок (один писатель, один читатель)"""
+
+    def __init__(self, capacity):
+        if np is None:
+            raise RuntimeError("Для аудиобуфера требуется NumPy")
+        size = 1 << max(0, capacity - 1).bit_length()
+        self.buffer = np.zeros(size, dtype=np.int16)
+        self.size = size
+        self.mask = size - 1
+        self.write_pos = 0
+        self.read_pos = 0
+        self.overruns = 0  # отброшено отсчетов при переполнении
+
+    def __len__(self):
+        return self.write_pos - self.read_pos
+
+    def write(self, samples):
+        """Запись отсчетов; вызывается только писателем"""
+        free = self.size - (self.write_pos - self.read_pos)
+        count = len(samples)
+        if count > free:
+            self.overruns += count - free
+            count = free
+        if not count:
+            return 0
+        start = self.write_pos & self.mask
+        first = min(count, self.size - start)
+        self.buffer[start:start + first] = samples[:first]
+        if first < count:
+            self.buffer[:count - first] = samples[first:count]
+        self.write_pos += count
+        return count
+
+    def read(self, limit=None):
+        """Копия доступных отсчетов (не больше limit) или None; только читатель"""
+        available = self.write_pos - self.read_pos
+        if limit is not None and available > limit:
+            available = limit
+        if not available:
+            return None
+        start = self.read_pos & self.mask
+        first = min(available, self.size - start)
+        if first == available:
+            samples = self.buffer[start:start + available].copy()
+        else:
+            samples = np.concatenate((self.buffer[start:], self.buffer[:available - first]))
+        self.read_pos += available
+        return samples
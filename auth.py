@@ -0,0 +1,183 @@
+"""
+Хеширование и проверка паролей вне потока обработки сообщений.
+
+Пароли хранятся в виде строки с параметрами функции растяжения ключа и
+собственной солью пользователя:
+
+    scrypt$<n>$<r>$<p>$<соль hex>$<хеш hex>
+    pbkdf2_sha256$<итераций>$<соль hex>$<хеш hex>
+
+scrypt используется, если он есть в hashlib (OpenSSL 1.1+), иначе PBKDF2.
+Старые записи - sha256 без соли (64 hex-символа) - по-прежнему
+принимаются; после успешного входа такой хеш, а также хеш с параметрами
+слабее текущих AUTH_CONFIG, пересчитывается и возвращается для замены.
+
+Проверка одного пароля занимает десятки миллисекунд процессора, поэтому
+AuthPool выполняет ее в пуле процессов: цикл событий и потоки клиентов не
+стоят, пока считается хеш, а волна переподключений после перезапуска
+сервера обрабатывается всеми ядрами. Очередь ограничена max_pending - при
+переполнении запрос сразу отклоняется, а не копится без конца.
+"""
+
+import concurrent.futures
+import hashlib
+import hmac
+import logging
+import multiprocessing
+import os
+import threading
+
+from config import AUTH_CONFIG
+
+SALT_BYTES = 16
+KEY_BYTES = 32
+LEGACY_LENGTH = 64  # sha256 hexdigest
+
+
+def default_params():
+    """Параметры KDF для новых хешей из AUTH_CONFIG"""
+    kdf = AUTH_CONFIG['kdf']
+    if kdf == 'scrypt' and not hasattr(hashlib, 'scrypt'):
+        kdf = 'pbkdf2_sha256'
+    if kdf == 'scrypt':
+        return ('scrypt', AUTH_CONFIG['scrypt_n'], AUTH_CONFIG['scrypt_r'], AUTH_CONFIG['scrypt_p'])
+    if kdf == 'pbkdf2_sha256':
+        return ('pbkdf2_sha256', AUTH_CONFIG['pbkdf2_iterations'])
+    raise ValueError(f"Неизвестная функция хеширования паролей: {kdf}")
+
+
+def _derive(password, salt, params):
+    secret = password.encode()
+    if params[0] == 'scrypt':
+        _, n, r, p = params
+        # maxmem с запасом: scrypt требует 128 * r * n байт
+        return hashlib.scrypt(secret, salt=salt, n=n, r=r, p=p,
+                              maxmem=256 * r * n, dklen=KEY_BYTES)
+    return hashlib.pbkdf2_hmac('sha256', secret, salt, params[1], dklen=KEY_BYTES)
+
+
+def hash_password(password, params=None):
+    """Новый хеш пароля со случайной солью"""
+    params = params or default_params()
+    salt = os.urandom(SALT_BYTES)
+    key = _derive(password, salt, params)
+    return '$'.join([str(part) for part in params] + [salt.hex(), key.hex()])
+
+
+def is_legacy(stored):
+    return len(stored) == LEGACY_LENGTH and '$' not in stored
+
+
+def _parse(stored):
+    """(параметры, соль, хеш) или None для нераспознанной записи"""
+    parts = stored.split('$')
+    try:
+        if parts[0] == 'scrypt' and len(parts) == 6:
+            params = ('scrypt', int(parts[1]), int(parts[2]), int(parts[3]))
+        elif parts[0] == 'pbkdf2_sha256' and len(parts) == 4:
+            params = ('pbkdf2_sha256', int(parts[1]))
+        else:
+            return None
+        return params, bytes.fromhex(parts[-2]), bytes.fromhex(parts[-1])
+    except ValueError:
+        return None
+
+
+def verify_password(password, stored):
+    """Проверка пароля: (совпал ли, новый хеш для замены или None)"""
+    current = default_params()
+    if is_legacy(stored):
+        legacy = hashlib.sha256(password.encode()).hexdigest()
+        if not hmac.compare_digest(legacy, stored):
+            return False, None
+        return True, hash_password(password, current)
+
+    parsed = _parse(stored)
+    if parsed is None:
+        return False, None
+    params, salt, key = parsed
+    if not hmac.compare_digest(_derive(password, salt, params), key):
+        return False, None
+    return True, (hash_password(password, current) if params != current else None)
+
+
+class AuthPool:
+    """Ограниченный пул процессов для хеширования и проверки паролей.
+
+    Результат передается в callback(result, error) из служебного потока
+    пула; сервер сам переносит его в нужный поток (text_loop.call_soon).
+    """
+
+    def __init__(self, workers=AUTH_CONFIG['workers'], max_pending=AUTH_CONFIG['max_pending']):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_pending = max_pending
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.failed = 0
+        # Хеш для несуществующих пользователей: их проверка занимает
+        # столько же времени, и по задержке нельзя узнать, есть ли имя
+        self.dummy_hash = hash_password(os.urandom(8).hex())
+        # spawn: сервер к этому моменту уже многопоточный
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+
+    def hash(self, password, callback):
+        """Хеш нового пароля; False - очередь заполнена"""
+        return self._submit(callback, hash_password, password)
+
+    def verify(self, password, stored, callback):
+        """Проверка пароля по записи из базы (None - нет пользователя).
+
+        Результат - (совпал ли, новый хеш или None); False - очередь заполнена.
+        """
+        if stored is None:
+            return self._submit(lambda result, error: callback((False, None), error),
+                                verify_password, password, self.dummy_hash)
+        return self._submit(callback, verify_password, password, stored)
+
+    def _submit(self, callback, function, *args):
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            self.pending += 1
+        try:
+            future = self.executor.submit(function, *args)
+        except RuntimeError:
+            # Пул уже остановлен
+            with self.lock:
+                self.pending -= 1
+            return False
+        future.add_done_callback(lambda done: self._done(done, callback))
+        return True
+
+    def _done(self, future, callback):
+        with self.lock:
+            self.pending -= 1
+            self.completed += 1
+        try:
+            result = future.result()
+        except Exception as error:
+            with self.lock:
+                self.failed += 1
+            logging.error(f"Ошибка проверки пароля: {error}")
+            callback(None, error)
+            return
+        callback(result, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'workers': self.workers,
+                'pending': self.pending,
+                'completed': self.completed,
+                'rejected': self.rejected,
+                'failed': self.failed,
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
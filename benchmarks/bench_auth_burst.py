@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Волна входов после перезапуска сервера: N клиентов логинятся одновременно.
+
+Запускает server.py в отдельном процессе с базой из N пользователей со
+старыми хешами sha256 и выполняет два раунда входа всех пользователей
+сразу:
+
+    1. переход   старый хеш проверяется и пересчитывается в scrypt
+    2. повтор    проверка уже нового хеша (типичный вход после перезапуска)
+
+Для каждого раунда выводятся входов в секунду, задержка входа
+(p50/p95/p99/макс) и отклик цикла событий во время волны: отдельный
+клиент каждые 20 мс шлет get_rooms и замеряет время ответа. Пароли
+проверяются в пуле процессов, поэтому отклик остается на уровне простоя;
+для сравнения выводится, на сколько цикл стоял бы при проверке на месте.
+
+Пример:
+    python benchmarks/bench_auth_burst.py --users 2000 --auth-workers 1 2 4
+"""
+
+import argparse
+import hashlib
+import os
+import selectors
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from auth import hash_password, verify_password  # noqa: E402
+from protocol import FrameDecoder, encode_payload, frame_message, hello_message  # noqa: E402
+
+from common import free_port, percentile, wait_port  # noqa: E402
+
+PROBE_INTERVAL = 0.02
+
+
+def wait_responsive(port, timeout=600.0):
+    """Ожидание, пока сервер разошлет уведомления об уходе и снова ответит"""
+    with socket.create_connection(('127.0.0.1', port), timeout=timeout) as s:
+        s.sendall(encode_payload({'type': 'get_rooms'}))
+        s.recv(65536)
+
+
+def create_database(workdir, users):
+    """База с пользователями user0..userN-1 (пароль = имя) в старом формате"""
+    os.makedirs(os.path.join(workdir, 'server_data'))
+    db = sqlite3.connect(os.path.join(workdir, 'server_data', 'users.db'))
+    db.execute('''
+        CREATE TABLE users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            is_admin BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    db.executemany(
+        'INSERT INTO users (username, password_hash) VALUES (?, ?)',
+        [(f'user{i}', hashlib.sha256(f'user{i}'.encode()).hexdigest()) for i in range(users)]
+    )
+    db.commit()
+    db.close()
+
+
+class Client:
+    """Неблокирующий клиент: рукопожатие hello и разбор ответов"""
+
+    def __init__(self, port, index):
+        self.sock = socket.create_connection(('127.0.0.1', port))
+        self.sock.setblocking(False)
+        self.index = index
+        self.decoder = FrameDecoder()
+        self.framed = False  # hello отправлен
+        self.hello_done = False  # ответ hello получен, дальше только кадры
+        self.sent_at = None
+        self.last = 0.0
+        self.latency = None
+        self.error = None
+
+    def send(self, message):
+        data = frame_message(message)
+        if not self.framed:
+            # hello и первый кадр одной записью: сервер разберет остаток как кадры
+            data = encode_payload(hello_message()) + data
+            self.framed = True
+        self.sock.sendall(data)
+
+    def receive(self):
+        data = self.sock.recv(65536)
+        if not data:
+            raise ConnectionError('сервер закрыл подключение')
+        if not self.hello_done:
+            messages = self.decoder.feed_legacy(data)
+            if any(message.get('type') == 'hello' for message in messages):
+                self.hello_done = True
+                messages += self.decoder.feed_frames(b'')
+            return messages
+        return self.decoder.feed_frames(data)
+
+
+def burst(port, users, timeout):
+    """Одновременный вход всех пользователей; задержки входа и отклик цикла"""
+    selector = selectors.DefaultSelector()
+    clients = [Client(port, i) for i in range(users)]
+    probe = Client(port, -1)
+    for client in clients + [probe]:
+        selector.register(client.sock, selectors.EVENT_READ, client)
+    time.sleep(0.5)  # сервер принимает подключения до начала волны
+
+    probe_times = []
+    probe.send({'type': 'get_rooms'})
+    probe.sent_at = time.perf_counter()
+    started = time.perf_counter()
+    for client in clients:
+        name = f'user{client.index}'
+        client.send({'type': 'login', 'username': name, 'password': name})
+        client.sent_at = time.perf_counter()
+
+    done = 0
+    deadline = started + timeout
+    while done < users and time.perf_counter() < deadline:
+        now = time.perf_counter()
+        if probe.sent_at is None and now - probe.last >= PROBE_INTERVAL:
+            probe.send({'type': 'get_rooms'})
+            probe.sent_at = now
+        for key, _ in selector.select(PROBE_INTERVAL / 4):
+            client = key.data
+            for message in client.receive():
+                now = time.perf_counter()
+                if client is probe and message.get('type') == 'rooms_list':
+                    probe_times.append(now - probe.sent_at)
+                    probe.sent_at = None
+                    probe.last = now
+                elif message.get('type') == 'login_success' and client.latency is None:
+                    client.latency = now - client.sent_at
+                    done += 1
+                elif message.get('type') == 'error' and client.latency is None:
+                    client.error = message.get('message')
+                    client.latency = now - client.sent_at
+                    done += 1
+    elapsed = time.perf_counter() - started
+
+    for client in clients + [probe]:
+        selector.unregister(client.sock)
+        client.sock.close()
+    ok = [c.latency for c in clients if c.latency is not None and c.error is None]
+    return {
+        'ok': len(ok),
+        'errors': sum(1 for c in clients if c.error),
+        'elapsed': elapsed,
+        'rate': len(ok) / elapsed if elapsed else 0.0,
+        'p50': percentile(ok, 50), 'p95': percentile(ok, 95), 'p99': percentile(ok, 99),
+        'max': max(ok, default=0.0),
+        'probe_p50': percentile(probe_times, 50), 'probe_p99': percentile(probe_times, 99),
+        'probe_max': max(probe_times, default=0.0),
+        'probes': len(probe_times),
+    }
+
+
+def run(engine, users, workers, timeout):
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix='voicechat-bench-')
+    create_database(workdir, users)
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), '--engine', engine,
+         '--host', '127.0.0.1', '--text-port', str(port), '--voice-port', str(free_port()),
+         '--auth-workers', str(workers)],
+        cwd=workdir, stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_port(port)
+        time.sleep(0.5)
+        upgrade = burst(port, users, timeout)
+        # Уход N пользователей - N рассылок user_left всем оставшимся
+        wait_responsive(port, timeout)
+        repeat = burst(port, users, timeout)
+        return upgrade, repeat
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def inline_cost(samples=20):
+    """Время одной проверки пароля на месте: старый sha256 и новый хеш"""
+    stored = hash_password('password')
+    start = time.perf_counter()
+    for _ in range(samples):
+        hashlib.sha256(b'password').hexdigest()
+    legacy = (time.perf_counter() - start) / samples
+    start = time.perf_counter()
+    for _ in range(samples):
+        verify_password('password', stored)
+    return legacy, (time.perf_counter() - start) / samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--engine', choices=('threaded', 'selector'), default='selector')
+    parser.add_argument('--auth-workers', nargs='+', type=int, default=[0],
+                        help='размеры пула проверки паролей, 0 - по числу ядер')
+    parser.add_argument('--timeout', type=float, default=600.0)
+    args = parser.parse_args()
+
+    legacy, kdf = inline_cost()
+    print(f"проверка на месте: sha256 {legacy * 1e6:.1f} мкс, новый хеш {kdf * 1000:.1f} мс - "
+          f"волна из {args.users} остановила бы цикл событий на {args.users * kdf:.1f} с")
+    print(f"ядер: {os.cpu_count()}, режим: {args.engine}, опрос цикла каждые "
+          f"{PROBE_INTERVAL * 1000:.0f} мс")
+    print(f"{'пул':>4}{'раунд':>10}{'вход/с':>9}{'ошибок':>8}{'всего, с':>10}"
+          f"{'p50, мс':>9}{'p95, мс':>9}{'p99, мс':>9}{'макс, мс':>10}"
+          f"{'цикл p50':>10}{'p99':>7}{'макс':>7}")
+    for workers in args.auth_workers:
+        for name, r in zip(('переход', 'повтор'), run(args.engine, args.users, workers, args.timeout)):
+            print(f"{workers or os.cpu_count():>4}{name:>10}{r['rate']:>9.1f}{r['errors']:>8}"
+                  f"{r['elapsed']:>10.1f}{r['p50'] * 1000:>9.0f}{r['p95'] * 1000:>9.0f}"
+                  f"{r['p99'] * 1000:>9.0f}{r['max'] * 1000:>10.0f}"
+                  f"{r['probe_p50'] * 1000:>10.1f}{r['probe_p99'] * 1000:>7.1f}"
+                  f"{r['probe_max'] * 1000:>7.1f}")
+
+
+if __name__ == '__main__':
+    main()
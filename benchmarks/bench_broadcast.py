@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Скорость рассылки сообщения в комнату в зависимости от ее размера.
+
+Сравнивает прежний путь (send_message для каждого получателя, то есть
+сериализация на каждого) с broadcast_to_room, который сериализует
+сообщение один раз, в режимах сервера из --engines. Сокеты:
+
+    null   заглушки - замеряется только работа сервера, без системных
+           вызовов
+    real   socketpair на каждого клиента; другие концы читает отдельный
+           поток, в режиме selector работает цикл событий сервера
+
+Пример:
+    python benchmarks/bench_broadcast.py --sizes 10 50 200 1000 --sockets null real
+"""
+
+import argparse
+import logging
+import os
+import selectors
+import socket
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from server import VoiceChatServer  # noqa: E402
+
+from common import NullSocket, add_clients  # noqa: E402
+
+
+class Drain:
+    """Поток, читающий клиентские концы socketpair, чтобы буферы не копились"""
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def socket(self):
+        """Серверный конец новой пары; клиентский читается здесь"""
+        server_end, client_end = socket.socketpair()
+        client_end.setblocking(False)
+        self.selector.register(client_end, selectors.EVENT_READ)
+        return server_end
+
+    def run(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=0.1):
+                try:
+                    while key.fileobj.recv(262144):
+                        pass
+                except (BlockingIOError, InterruptedError):
+                    pass
+                except OSError:
+                    self.selector.unregister(key.fileobj)
+
+    def close(self):
+        self.running = False
+        self.thread.join()
+        for key in list(self.selector.get_map().values()):
+            key.fileobj.close()
+        self.selector.close()
+
+
+def populate(server, size, make_socket):
+    """Заполнение комнаты general клиентами (до запуска цикла событий)"""
+    sockets = add_clients(server, size, make_socket=make_socket)
+    if server.text_loop is not None and make_socket is not NullSocket:
+        for sock in sockets:
+            sock.setblocking(False)
+            server.text_loop.selector.register(sock, selectors.EVENT_READ, server.connections[sock])
+
+
+def chat_message(i):
+    return {
+        'type': 'chat_message',
+        'username': 'user0',
+        'message': f'Сообщение номер {i} для проверки скорости рассылки',
+        'room': 'general',
+        'timestamp': datetime.now().strftime('%H:%M:%S')
+    }
+
+
+def per_recipient(server, message):
+    """Прежняя рассылка: сериализация для каждого получателя"""
+    for sock in tuple(server.room_members['general']):
+        server.send_message(sock, message)
+
+
+def measure(func, server, duration):
+    count = 0
+    start = time.perf_counter()
+    deadline = start + duration
+    while time.perf_counter() < deadline:
+        func(server, chat_message(count))
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def run(engine, kind, size, duration):
+    """Сообщений в секунду прежним и новым путем; клиентов в сети после замера"""
+    server = VoiceChatServer('127.0.0.1', 0, 0, engine=engine)
+    drain = Drain() if kind == 'real' else None
+    populate(server, size, drain.socket if drain is not None else NullSocket)
+    loop = None
+    if server.text_loop is not None and drain is not None:
+        server.text_socket.bind(('127.0.0.1', 0))
+        server.text_socket.listen()
+        loop = threading.Thread(target=server.text_loop.run, daemon=True)
+        loop.start()
+    try:
+        old = measure(per_recipient, server, duration)
+        new = measure(lambda srv, msg: srv.broadcast_to_room('general', msg), server, duration)
+        # Отключенные как медленные за время замера
+        alive = len(server.room_members['general'])
+    finally:
+        server.running = False
+        if loop is not None:
+            loop.join()
+        server.stop_server()
+        if drain is not None:
+            drain.close()
+    return old, new, alive
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', nargs='+', type=int, default=[10, 50, 200, 1000])
+    parser.add_argument('--duration', type=float, default=2.0)
+    parser.add_argument('--engines', nargs='+', choices=('threaded', 'selector'),
+                        default=['threaded', 'selector'])
+    parser.add_argument('--sockets', nargs='+', choices=('null', 'real'), default=['null'],
+                        help='null - заглушки, real - socketpair')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    os.chdir(tempfile.mkdtemp(prefix='voicechat-bench-'))
+    print(f"{'режим':<10}{'сокеты':<7}{'участников':>10}{'по одному, сообщ./с':>22}"
+          f"{'один раз, сообщ./с':>21}{'ускорение':>11}{'в сети':>9}")
+    for kind in args.sockets:
+        for engine in args.engines:
+            for size in args.sizes:
+                old, new, alive = run(engine, kind, size, args.duration)
+                print(f"{engine:<10}{kind:<7}{size:>10}{old:>22.0f}{new:>21.0f}"
+                      f"{new / old:>10.1f}x{alive:>9}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Цена сохранения истории чата для рассылки сообщений.
+
+--threads потоков (как потоки клиентов сервера) отправляют --messages
+сообщений в --rooms комнат с общей скоростью --rate сообщений в секунду
+(0 - как можно быстрее). Сравниваются:
+
+    sync      запись каждого сообщения в базу с ожиданием commit перед
+              рассылкой (storage.Storage, INSERT на сообщение)
+    history   chat_history.ChatHistory.append: буфер комнаты и очередь,
+              запись пачками в потоке БД
+
+Для каждого способа: сообщений в секунду, задержка, добавленная к
+обработке сообщения (p50/p99/макс, мкс), время до записи последнего
+сообщения в базу, число пачек и отброшенных сообщений. Затем для
+history - время подготовки истории для room_joined и чтения старой
+страницы из базы.
+
+Без ограничения скорости 16 потоков, не делающих ничего, кроме отправки,
+почти не отдают GIL потоку БД, и очередь history переполняется - так
+видно, где срабатывает ограничение history_queue_limit.
+
+Пример:
+    python benchmarks/bench_chat_history.py --threads 16 --messages 50000
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chat_history import INSERT_MESSAGE, ChatHistory  # noqa: E402
+from storage import Storage  # noqa: E402
+
+from common import percentile  # noqa: E402
+
+
+def sender(send, index, count, rooms, interval, latencies):
+    due = time.perf_counter()
+    for i in range(count):
+        if interval:
+            due += interval
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        room = f'room{(index + i) % rooms}'
+        start = time.perf_counter()
+        send(room, f'user{index}', f'Сообщение {i} от потока {index}')
+        latencies.append(time.perf_counter() - start)
+
+
+def run(mode, threads, messages, rooms, rate):
+    path = os.path.join(tempfile.mkdtemp(prefix='voicechat-history-'), 'chat.db')
+    storage = Storage(path)
+    history = ChatHistory(storage)
+    next_id = iter(range(1, messages + 1))
+
+    def sync_send(room, username, text):
+        message_id = next(next_id)
+        storage.submit(
+            lambda conn: conn.execute(INSERT_MESSAGE, (message_id, room, username, text, time.time()))
+        ).result()
+
+    send = history.append if mode == 'history' else sync_send
+    per_thread = messages // threads
+    interval = threads / rate if rate else 0.0
+    latencies = [[] for _ in range(threads)]
+    pool = [
+        threading.Thread(target=sender, args=(send, i, per_thread, rooms, interval, latencies[i]))
+        for i in range(threads)
+    ]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    sent = time.perf_counter() - started
+    storage.flush()
+    stored = time.perf_counter() - started
+    flat = [value for values in latencies for value in values]
+
+    result = {
+        'mode': mode,
+        'rate': len(flat) / sent,
+        'p50': percentile(flat, 50), 'p99': percentile(flat, 99), 'max': max(flat),
+        'stored': stored,
+        'batches': history.stats()['batches'] if mode == 'history' else storage.stats()['commits'],
+        'dropped': history.stats()['dropped'],
+    }
+    if mode == 'history':
+        start = time.perf_counter()
+        for _ in range(1000):
+            history.recent('room0')
+        result['recent'] = (time.perf_counter() - start) / 1000
+        oldest = history.recent('room0', history.ring_size)[0]['id']
+        start = time.perf_counter()
+        for _ in range(200):
+            history.page('room0', oldest)
+        result['page'] = (time.perf_counter() - start) / 200
+    storage.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--messages', type=int, default=50000)
+    parser.add_argument('--rooms', type=int, default=20)
+    parser.add_argument('--rate', type=float, default=5000,
+                        help='сообщений в секунду на все потоки, 0 - без ограничения')
+    args = parser.parse_args()
+
+    rate = f"{args.rate:.0f}/с" if args.rate else "без ограничения"
+    print(f"потоков: {args.threads}, сообщений: {args.messages}, комнат: {args.rooms}, "
+          f"скорость: {rate}")
+    print(f"{'способ':<9}{'сообщ./с':>10}{'p50, мкс':>10}{'p99, мкс':>10}{'макс, мкс':>11}"
+          f"{'в базе за, с':>14}{'пачек':>8}{'отброшено':>11}")
+    for mode in ('sync', 'history'):
+        r = run(mode, args.threads, args.messages, args.rooms, args.rate)
+        print(f"{r['mode']:<9}{r['rate']:>10.0f}{r['p50'] * 1e6:>10.1f}{r['p99'] * 1e6:>10.1f}"
+              f"{r['max'] * 1e6:>11.0f}{r['stored']:>14.2f}{r['batches']:>8}{r['dropped']:>11}")
+    print(f"история для room_joined: {r['recent'] * 1e6:.1f} мкс, "
+          f"страница из базы: {r['page'] * 1e6:.0f} мкс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Задержка поиска по истории чата на большом корпусе сообщений.
+
+Строит базу из --messages сообщений (словарь с частотами по закону Ципфа,
+--rooms комнат, --users авторов с такой же неравномерной активностью,
+время сообщений равномерно за --days дней) через storage.Storage, пачками
+по --batch - полнотекстовый индекс обновляется триггером при каждой
+записи, как на работающем сервере. Выводится скорость записи в начале и в
+конце заполнения.
+
+Затем выполняет запросы ChatHistory.search разных видов, каждый для
+--samples разных слов, и выводит p50/p95/макс в миллисекундах и среднее
+число найденных сообщений (на странице не больше SEARCH_LIMIT):
+
+    редкое слово, среднее, частое, два частых, фраза, начало слова*,
+    частое слово в комнате, частое слово у малоактивного автора, среднее
+    слово у самого активного, частое за последнюю неделю, среднее за день
+    месяц назад, 20-я страница частого слова, комната без текста
+
+Построение корпуса из миллионов сообщений занимает минуты; --database
+сохраняет базу и при повторном запуске использует готовую.
+
+Пример:
+    python benchmarks/bench_chat_search.py --messages 2000000 --database /tmp/search.db
+"""
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from chat_history import INSERT_MESSAGE, ChatHistory  # noqa: E402
+from storage import Storage  # noqa: E402
+
+from common import percentile  # noqa: E402
+
+SYLLABLES = ['ка', 'ро', 'ми', 'на', 'ту', 'ле', 'зо', 'па', 'ви', 'сы',
+             'до', 'ге', 'лю', 'фа', 'ше', 'бр', 'ст', 'кр', 'мо', 'ни']
+
+
+def vocabulary(size, rng):
+    words = {}
+    while len(words) < size:
+        words[''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4)))] = None
+    return list(words)
+
+
+def zipf_weights(size, exponent):
+    """Накопленные веса: частота k-го ~ 1 / (k + 1) ** exponent"""
+    total = 0.0
+    weights = []
+    for k in range(size):
+        total += 1.0 / (k + 1) ** exponent
+        weights.append(total)
+    return weights
+
+
+def build(path, messages, rooms, users, days, batch):
+    """Корпус через Storage; скорость записи на первых и последних 10%"""
+    rng = random.Random(1)
+    words = vocabulary(20000, rng)
+    word_weights = zipf_weights(len(words), 1.1)
+    authors = [f'user{i}' for i in range(users)]
+    author_weights = zipf_weights(users, 1.1)
+    storage = Storage(path)
+    start = time.time() - days * 86400
+    step = days * 86400 / messages
+    tenth = max(1, messages // 10)
+    spent = {'first': 0.0, 'last': 0.0}
+    message_id = 0
+    while message_id < messages:
+        rows = []
+        for _ in range(min(batch, messages - message_id)):
+            message_id += 1
+            text = ' '.join(rng.choices(words, cum_weights=word_weights, k=rng.randint(3, 15)))
+            author = rng.choices(authors, cum_weights=author_weights)[0]
+            rows.append((message_id, f'room{rng.randrange(rooms)}', author, text,
+                         start + message_id * step))
+        began = time.perf_counter()
+        storage.submit(lambda conn, rows=rows: conn.executemany(INSERT_MESSAGE, rows)).result()
+        elapsed = time.perf_counter() - began
+        if message_id <= tenth:
+            spent['first'] += elapsed
+        elif message_id > messages - tenth:
+            spent['last'] += elapsed
+        if message_id % (tenth * 2) < batch:
+            print(f"  записано {message_id}", flush=True)
+    storage.close()
+    return tenth / spent['first'], tenth / max(spent['last'], 1e-9)
+
+
+def term_ranks(path):
+    """Слова индекса от частых к редким (fts5vocab)"""
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE VIRTUAL TABLE temp.vocab USING fts5vocab(main, messages_fts, row)')
+    terms = [term for term, in conn.execute('SELECT term FROM temp.vocab ORDER BY doc DESC')]
+    authors = [name for name, in conn.execute(
+        'SELECT username FROM messages GROUP BY username ORDER BY COUNT(*) DESC'
+    )]
+    conn.close()
+    return terms, authors
+
+
+def cases(terms, authors, now, samples, rng):
+    """[(название, [аргументы search, ...])]"""
+    common = terms[:samples]
+    middle = terms[500:500 + samples]
+    rare = terms[-samples:]
+    quiet = authors[len(authors) // 2:][:samples]
+    return [
+        ('редкое слово', [{'query': w} for w in rare]),
+        ('среднее слово', [{'query': w} for w in middle]),
+        ('частое слово', [{'query': w} for w in common]),
+        ('два частых', [{'query': f'{a} {b}'} for a, b in zip(common, reversed(common))]),
+        ('фраза', [{'query': f'"{a} {b}"'} for a, b in zip(common, reversed(common))]),
+        ('начало слова*', [{'query': w[:3] + '*'} for w in middle]),
+        ('частое + комната', [{'query': w, 'room': f'room{i}'} for i, w in enumerate(common)]),
+        ('частое + редкий автор', [{'query': w, 'username': a} for w, a in zip(common, quiet)]),
+        ('среднее + активный автор', [{'query': w, 'username': authors[0]} for w in middle]),
+        ('частое за неделю', [{'query': w, 'since': now - 7 * 86400} for w in common]),
+        ('среднее за день месяц назад', [
+            {'query': w, 'since': now - 29 * 86400, 'until': now - 28 * 86400} for w in middle
+        ]),
+        ('частое, 20-я страница', [{'query': w, 'page': 20} for w in common]),
+        ('комната без текста', [{'room': f'room{rng.randrange(10)}'} for _ in common]),
+    ]
+
+
+def measure(history, variants):
+    timings = []
+    found = 0
+    for kwargs in variants:
+        kwargs = dict(kwargs)
+        pages = kwargs.pop('page', 1)
+        before = None
+        for _ in range(pages):
+            began = time.perf_counter()
+            results, more = history.search(before=before, **kwargs)
+            elapsed = time.perf_counter() - began
+            if not more:
+                break
+            before = results[-1]['id']
+        timings.append(elapsed)
+        found += len(results)
+    return timings, found / len(variants)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=2000000)
+    parser.add_argument('--rooms', type=int, default=50)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--days', type=float, default=30)
+    parser.add_argument('--batch', type=int, default=5000,
+                        help='сообщений в одной записи при построении корпуса')
+    parser.add_argument('--samples', type=int, default=20, help='слов на каждый вид запроса')
+    parser.add_argument('--database', help='файл базы корпуса (используется повторно)')
+    args = parser.parse_args()
+
+    path = args.database or os.path.join(tempfile.mkdtemp(prefix='voicechat-search-'), 'chat.db')
+    if os.path.exists(path):
+        print(f"корпус: {path}")
+    else:
+        print(f"построение корпуса: {args.messages} сообщений, {args.rooms} комнат, "
+              f"{args.users} авторов, {args.days:.0f} дней")
+        began = time.perf_counter()
+        first, last = build(path, args.messages, args.rooms, args.users, args.days, args.batch)
+        print(f"построен за {time.perf_counter() - began:.0f} с, запись с индексом: "
+              f"{first:.0f} сообщ./с в начале, {last:.0f} сообщ./с в конце")
+
+    storage = Storage(path)
+    history = ChatHistory(storage)
+    total = storage.query_one('SELECT COUNT(*) FROM messages')[0]
+    now = storage.query_one('SELECT MAX(created) FROM messages')[0]
+    terms, authors = term_ranks(path)
+    print(f"сообщений: {total}, слов в индексе: {len(terms)}, "
+          f"база: {os.path.getsize(path) / 1e6:.0f} МБ, FTS5: {'да' if storage.fulltext else 'нет'}")
+    print(f"{'запрос':<30}{'p50, мс':>9}{'p95, мс':>9}{'макс, мс':>10}{'найдено':>9}")
+    for name, variants in cases(terms, authors, now, args.samples, random.Random(2)):
+        timings, found = measure(history, variants)
+        print(f"{name:<30}{percentile(timings, 50) * 1000:>9.2f}{percentile(timings, 95) * 1000:>9.2f}"
+              f"{max(timings) * 1000:>10.2f}{found:>9.0f}")
+    storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Выбор активных говорящих: сокращение пересылки и стоимость на пакет.
+
+Модель комнаты: часть участников держит открытый микрофон с собственным
+фоновым уровнем 20-35 дБ (+-3 дБ от пакета к пакету), в каждый момент двое из них говорят (55-65 дБ) и
+сменяются каждые --turn секунд. Пакеты идут с частотой rate / chunk.
+
+Первая часть прогоняет DominantSpeakers в модельном времени и сравнивает
+число пересылок без лимита и с лимитом, число смен активных говорящих и
+долю пакетов настоящих говорящих, которые дошли до слушателей.
+Вторая часть замеряет время VoiceRelay.handle_packet на пакет (сокет -
+заглушка), с лимитом и без.
+
+Пример:
+    python benchmarks/bench_dominant_speakers.py --rooms 30 50 100 --limit 3
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import AUDIO_CONFIG  # noqa: E402
+from voice_relay import PACKET_AUDIO_LEVEL, VoiceRelay  # noqa: E402
+from voice_speakers import DominantSpeakers  # noqa: E402
+
+from common import NullSocket  # noqa: E402
+
+TALKERS = 2
+
+
+def levels(background, talkers, rng):
+    """Уровни одного пакета от каждого открытого микрофона"""
+    return [
+        rng.uniform(55, 65) if mic in talkers else base + rng.uniform(-3, 3)
+        for mic, base in enumerate(background)
+    ]
+
+
+def simulate(members, open_mics, limit, duration, turn, rng):
+    """Политика в модельном времени: пересылки, смены, доля речи говорящих"""
+    period = AUDIO_CONFIG['chunk'] / AUDIO_CONFIG['rate']
+    selector = DominantSpeakers(limit)
+    background = [rng.uniform(20, 35) for _ in range(open_mics)]
+    talkers = set(rng.sample(range(open_mics), TALKERS))
+    next_turn = turn
+    active = set()
+    switches = 0
+    forwarded = 0
+    talker_packets = 0
+    talker_forwarded = 0
+
+    ticks = int(duration / period)
+    for tick in range(ticks):
+        now = tick * period
+        if now >= next_turn:
+            talkers = set(rng.sample(range(open_mics), TALKERS))
+            next_turn += turn
+        for mic, level in enumerate(levels(background, talkers, rng)):
+            admitted = selector.admit(mic, level, now)
+            if admitted:
+                forwarded += members - 1
+            if mic in talkers:
+                talker_packets += 1
+                talker_forwarded += admitted
+        current = set(selector.active)
+        switches += len(current - active)
+        active = current
+
+    unlimited = ticks * open_mics * (members - 1)
+    return {
+        'unlimited_pps': unlimited / duration,
+        'limited_pps': forwarded / duration,
+        'switches_per_s': switches / duration,
+        'talker_share': talker_forwarded / talker_packets if talker_packets else 1.0,
+    }
+
+
+def relay_cost(members, open_mics, limit, packets, rng):
+    """Среднее время handle_packet на входящий пакет, мкс"""
+    sock = NullSocket()
+    relay = VoiceRelay(sock, max_speakers=limit)
+    addresses = []
+    for i in range(members):
+        token = relay.issue_token(f'user{i}', 'room')
+        address = ('127.0.0.1', 20000 + i)
+        relay.register_address(token, address)
+        addresses.append(address)
+
+    payload = bytes(AUDIO_CONFIG['chunk'] * 2)
+    background = [rng.uniform(20, 35) for _ in range(open_mics)]
+    talkers = set(rng.sample(range(open_mics), TALKERS))
+    frames = [
+        bytes([PACKET_AUDIO_LEVEL, int(level)]) + payload
+        for level in levels(background, talkers, rng)
+    ]
+
+    start = time.perf_counter()
+    for i in range(packets):
+        mic = i % open_mics
+        relay.handle_packet(frames[mic], addresses[mic])
+    elapsed = time.perf_counter() - start
+    return elapsed / packets * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rooms', nargs='+', type=int, default=[30, 50, 100])
+    parser.add_argument('--open-mics', type=float, default=0.5,
+                        help='доля участников с открытым микрофоном')
+    parser.add_argument('--limit', type=int, default=3)
+    parser.add_argument('--duration', type=float, default=60.0, help='модельных секунд')
+    parser.add_argument('--turn', type=float, default=3.0, help='секунд между сменами говорящих')
+    parser.add_argument('--packets', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"лимит: {args.limit}, открытых микрофонов: {args.open_mics:.0%}, "
+          f"говорящих одновременно: {TALKERS}")
+    print(f"{'участников':>10}{'пересылок/с':>13}{'с лимитом':>11}{'сокращение':>12}"
+          f"{'смен/с':>8}{'речь дошла':>12}{'мкс/пакет':>11}{'с лимитом':>11}")
+    for members in args.rooms:
+        open_mics = max(TALKERS, int(members * args.open_mics))
+        rng = random.Random(args.seed)
+        result = simulate(members, open_mics, args.limit, args.duration, args.turn, rng)
+        cost_off = relay_cost(members, open_mics, 0, args.packets, random.Random(args.seed))
+        cost_on = relay_cost(
+            members, open_mics, args.limit, args.packets, random.Random(args.seed)
+        )
+        reduction = result['unlimited_pps'] / result['limited_pps'] if result['limited_pps'] else 0
+        print(f"{members:>10}{result['unlimited_pps']:>13.0f}{result['limited_pps']:>11.0f}"
+              f"{reduction:>11.1f}x{result['switches_per_s']:>8.2f}"
+              f"{result['talker_share']:>11.1%}{cost_off:>11.1f}{cost_on:>11.1f}")
+
+
+if __name__ == '__main__':
+    main()
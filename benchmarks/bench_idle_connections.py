@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Память и CPU сервера при большом числе подключенных клиентов.
+
+Запускает server.py в отдельном процессе в каждом режиме (threaded/selector),
+открывает N простаивающих TCP-подключений и снимает RSS, число потоков
+и потребление CPU в простое и при одном запросе get_rooms от каждого клиента.
+
+Пример:
+    python benchmarks/bench_idle_connections.py --counts 1000 5000 10000
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from common import free_port, proc_cpu, proc_status, wait_port  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+def run(engine, count, idle_window):
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix='voicechat-bench-')
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), '--engine', engine,
+         '--host', '127.0.0.1', '--text-port', str(port), '--voice-port', str(free_port())],
+        cwd=workdir, stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    sockets = []
+    try:
+        wait_port(port)
+        time.sleep(0.5)
+        base_rss, _ = proc_status(proc.pid)
+
+        for _ in range(count):
+            sockets.append(socket.create_connection(('127.0.0.1', port)))
+        time.sleep(2.0)
+        rss, threads = proc_status(proc.pid)
+
+        cpu_start = proc_cpu(proc.pid)
+        time.sleep(idle_window)
+        idle_cpu = (proc_cpu(proc.pid) - cpu_start) / idle_window * 100
+
+        request = json.dumps({'type': 'get_rooms'}).encode('utf-8')
+        cpu_start = proc_cpu(proc.pid)
+        for s in sockets:
+            s.send(request)
+        time.sleep(2.0)
+        sweep_cpu = proc_cpu(proc.pid) - cpu_start
+
+        return {
+            'engine': engine,
+            'clients': count,
+            'rss_mb': rss / 1024,
+            'kb_per_conn': (rss - base_rss) / count,
+            'threads': threads,
+            'idle_cpu_pct': idle_cpu,
+            'sweep_cpu_s': sweep_cpu,
+        }
+    finally:
+        for s in sockets:
+            s.close()
+        proc.terminate()
+        proc.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--engines', nargs='+', default=['threaded', 'selector'])
+    parser.add_argument('--counts', nargs='+', type=int, default=[1000, 5000, 10000])
+    parser.add_argument('--idle-window', type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'режим':<10}{'клиенты':>9}{'RSS, МБ':>10}{'КБ/подкл.':>11}"
+          f"{'потоки':>8}{'CPU простой, %':>16}{'CPU get_rooms, с':>18}")
+    for count in args.counts:
+        for engine in args.engines:
+            r = run(engine, count, args.idle_window)
+            print(f"{r['engine']:<10}{r['clients']:>9}{r['rss_mb']:>10.1f}"
+                  f"{r['kb_per_conn']:>11.1f}{r['threads']:>8}"
+                  f"{r['idle_cpu_pct']:>16.2f}{r['sweep_cpu_s']:>18.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+JitterBuffer на трассах с джиттером, потерями и перестановками пакетов.
+
+Трасса - список пакетов [номер, время отправки, время прихода или null]
+в миллисекундах. Пакеты отправляются раз в AUDIO_CONFIG['frame_ms'];
+воспроизведение забирает по кадру за такт, фаза тактов случайна. Для
+каждой трассы сравниваются адаптивный буфер и буферы фиксированной
+глубины: задержка в буфере (от отправки до воспроизведения кадра, без
+сети и звуковой карты), доля маскированных кадров и число опустошений.
+
+Встроенные сценарии генерируются; свою трассу можно передать через
+--trace file.json.
+
+Пример:
+    python benchmarks/bench_jitter_buffer.py --seconds 120
+    python benchmarks/bench_jitter_buffer.py --trace capture.json --fixed 2 4
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import AUDIO_CONFIG  # noqa: E402
+from voice_playback import LOST, JitterBuffer  # noqa: E402
+
+FRAME_MS = AUDIO_CONFIG['frame_ms']
+BASE_DELAY = 30.0  # мс сетевой задержки без джиттера
+
+
+def generate(scenario, seconds, rng):
+    """Трасса сценария: lan, wifi, mobile, spikes"""
+    count = int(seconds * 1000 / FRAME_MS)
+    trace = []
+    burst = 0
+    for seq in range(count):
+        sent = seq * FRAME_MS
+        if scenario == 'lan':
+            delay, loss = abs(rng.gauss(0, 1)), 0.0
+        elif scenario == 'wifi':
+            delay, loss = rng.expovariate(1 / 5), 0.01
+        elif scenario == 'mobile':
+            delay, loss = rng.expovariate(1 / 15), 0.02
+            if burst == 0 and rng.random() < 0.005:
+                burst = rng.randint(3, 8)  # пачка потерь подряд
+        elif scenario == 'spikes':
+            delay, loss = abs(rng.gauss(0, 2)), 0.0
+            # Раз в 10 с задержка подскакивает на 200 мс и спадает за 10 кадров
+            phase = seq % (10000 // FRAME_MS)
+            if phase < 10:
+                delay += 200 - phase * FRAME_MS
+        else:
+            raise ValueError(scenario)
+
+        if burst:
+            burst -= 1
+            arrival = None
+        elif rng.random() < loss:
+            arrival = None
+        else:
+            arrival = sent + BASE_DELAY + delay
+        trace.append([seq, sent, arrival])
+    return trace
+
+
+def simulate(trace, buffer, rng):
+    """Прогон трассы через буфер; возвращает метрики воспроизведения"""
+    sent_at = {seq: sent for seq, sent, _ in trace}
+    arrivals = sorted(
+        (arrival, seq, sent) for seq, sent, arrival in trace if arrival is not None
+    )
+    if not arrivals:
+        return None
+    now = arrivals[0][0] + rng.uniform(0, FRAME_MS)
+    end = arrivals[-1][0] + FRAME_MS * (buffer.max_depth + 2)
+    index = 0
+    latencies = []
+    concealed = 0
+    while now <= end:
+        while index < len(arrivals) and arrivals[index][0] <= now:
+            arrival, seq, sent = arrivals[index]
+            buffer.put(seq & 0xFFFF, int(sent) & 0xFFFFFFFF, seq, arrival)
+            index += 1
+        frame = buffer.get()
+        if frame is LOST:
+            concealed += 1
+        elif frame is not None:
+            latencies.append(now - sent_at[frame])
+        now += FRAME_MS
+
+    latencies.sort()
+    played = len(latencies)
+    return {
+        'mean': sum(latencies) / played - BASE_DELAY if played else 0,
+        'p95': latencies[int(played * 0.95)] - BASE_DELAY if played else 0,
+        'concealed': concealed / len(trace) * 100,
+        'underruns': buffer.underruns,
+        'late': buffer.late,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scenarios', nargs='+', default=['lan', 'wifi', 'mobile', 'spikes'])
+    parser.add_argument('--trace', help='JSON-файл трассы вместо сценариев')
+    parser.add_argument('--seconds', type=float, default=120.0)
+    parser.add_argument('--fixed', nargs='+', type=int, default=[1, 3, 6],
+                        help='глубины буферов фиксированного размера для сравнения')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.trace:
+        with open(args.trace) as f:
+            traces = {os.path.basename(args.trace): json.load(f)}
+    else:
+        traces = {
+            name: generate(name, args.seconds, random.Random(args.seed))
+            for name in args.scenarios
+        }
+
+    print(f"задержка в буфере сверх {BASE_DELAY:.0f} мс сети, кадр {FRAME_MS} мс")
+    print(f"{'трасса':>8}{'буфер':>12}{'средн, мс':>11}{'p95, мс':>9}"
+          f"{'маскировано':>13}{'опустошений':>13}{'опоздали':>10}")
+    for name, trace in traces.items():
+        buffers = [('адаптивный', JitterBuffer(FRAME_MS))]
+        buffers += [
+            (f'фикс. {depth}', JitterBuffer(FRAME_MS, min_depth=depth, max_depth=depth))
+            for depth in args.fixed
+        ]
+        for label, buffer in buffers:
+            result = simulate(trace, buffer, random.Random(args.seed))
+            if result is None:
+                continue
+            print(f"{name:>8}{label:>12}{result['mean']:>11.1f}{result['p95']:>9.1f}"
+                  f"{result['concealed']:>12.2f}%{result['underruns']:>13}{result['late']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Пропускная способность чата при включенном логировании.
+
+--threads потоков (как потоки клиентов сервера) в течение --duration
+секунд вызывают handle_chat_message для комнаты из --members участников с
+сокетами-заглушками: история, рассылка и запись строки чата в лог.
+Сравниваются:
+
+    без лога     логирование отключено - предел для остальных
+    синхронно    прежний basicConfig: FileHandler и StreamHandler в
+                 потоке обработки
+    очередь      server_logging.LogPipeline: QueueHandler, запись в
+                 отдельном потоке, ротация файла
+    без чата     LogPipeline с chat_content=False
+
+Для каждого способа: сообщений в секунду, задержка handle_chat_message
+(p50/p99, мкс), сколько после прогона дописывался лог и сколько записей
+отброшено при переполнении очереди. Консоль направлена в /dev/null, то
+есть вывод в терминал здесь ничего не стоит - на настоящей консоли
+синхронная запись обходится дороже.
+
+Пример:
+    python benchmarks/bench_logging.py --threads 1 8 --duration 3
+"""
+
+import argparse
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import LOG_CONFIG  # noqa: E402
+from server import VoiceChatServer  # noqa: E402
+from server_logging import TEXT_FORMAT, LogPipeline  # noqa: E402
+
+from common import add_clients, percentile  # noqa: E402
+
+MODES = ('без лога', 'синхронно', 'очередь', 'без чата')
+# LogPipeline.start отключает сбор лишних полей записи; прежний способ
+# собирал их
+RECORD_DEFAULTS = {
+    '_srcfile': logging._srcfile, 'logThreads': True,
+    'logProcesses': True, 'logMultiprocessing': True,
+}
+
+
+def reset_logging():
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    logging.getLogger('chat').setLevel(logging.NOTSET)
+    for name, value in RECORD_DEFAULTS.items():
+        setattr(logging, name, value)
+
+
+def configure(mode, path, devnull):
+    """Логирование для способа; возвращает LogPipeline или None"""
+    reset_logging()
+    root = logging.getLogger()
+    if mode == 'без лога':
+        root.setLevel(logging.CRITICAL + 1)
+        return None
+    if mode == 'синхронно':
+        logging.basicConfig(
+            level=logging.INFO, format=TEXT_FORMAT,
+            handlers=[logging.FileHandler(path), logging.StreamHandler(devnull)]
+        )
+        return None
+    with contextlib.redirect_stderr(devnull):
+        return LogPipeline(path, chat_content=mode != 'без чата').start()
+
+
+def sender(server, sock, deadline, latencies):
+    i = 0
+    while time.perf_counter() < deadline:
+        message = {'type': 'chat', 'message': f'Сообщение номер {i} для проверки логирования'}
+        start = time.perf_counter()
+        server.handle_chat_message(sock, message)
+        latencies.append(time.perf_counter() - start)
+        i += 1
+
+
+def run(server, senders, mode, threads, duration, workdir, devnull):
+    path = os.path.join(workdir, f'server-{threads}-{MODES.index(mode)}.log')
+    pipeline = configure(mode, path, devnull)
+    latencies = [[] for _ in range(threads)]
+    deadline = time.perf_counter() + duration
+    pool = [
+        threading.Thread(target=sender, args=(server, senders[i], deadline, latencies[i]))
+        for i in range(threads)
+    ]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    drain_started = time.perf_counter()
+    stats = {'dropped': 0}
+    if pipeline is not None:
+        stats = pipeline.stats()
+        pipeline.stop()
+    drain = time.perf_counter() - drain_started
+    reset_logging()
+    server.storage.flush()
+    flat = [value for values in latencies for value in values]
+    return {
+        'rate': len(flat) / elapsed,
+        'p50': percentile(flat, 50), 'p99': percentile(flat, 99),
+        'drain': drain, 'dropped': stats['dropped'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', nargs='+', type=int, default=[1, 8])
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--duration', type=float, default=3.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='voicechat-logging-')
+    os.chdir(workdir)
+    devnull = open(os.devnull, 'w')
+    server = VoiceChatServer('127.0.0.1', 0, 0, engine='threaded')
+    senders = add_clients(server, max(args.members, max(args.threads)))
+    print(f"участников: {len(senders)}, очередь лога: {LOG_CONFIG['queue_size']} записей")
+    print(f"{'потоков':>7}  {'способ':<11}{'сообщ./с':>10}{'p50, мкс':>10}{'p99, мкс':>10}"
+          f"{'дозапись, с':>13}{'отброшено':>11}")
+    for threads in args.threads:
+        for mode in MODES:
+            r = run(server, senders, mode, threads, args.duration, workdir, devnull)
+            print(f"{threads:>7}  {mode:<11}{r['rate']:>10.0f}{r['p50'] * 1e6:>10.1f}"
+                  f"{r['p99'] * 1e6:>10.1f}{r['drain']:>13.2f}{r['dropped']:>11}")
+    server.storage.close()
+    devnull.close()
+
+
+if __name__ == '__main__':
+    main()
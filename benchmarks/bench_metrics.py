@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Цена сбора метрик в диспетчере сообщений.
+
+Прогоняет через process_message смесь сообщений (chat, get_users,
+get_rooms, join_room туда и обратно) от клиентов комнаты из --members
+участников с сокетами-заглушками - с метриками (SERVER_CONFIG['metrics'])
+и без, --rounds раз попеременно, и выводит сообщений в секунду и разницу
+на одно сообщение. Разница обычно меньше разброса между раундами, поэтому
+отдельно выводится стоимость самих замеров (два perf_counter и запись в
+Metrics) и подготовки ответа /metrics.
+
+Пример:
+    python benchmarks/bench_metrics.py --members 50 --duration 2 --rounds 5
+"""
+
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from metrics import Metrics  # noqa: E402
+from server import VoiceChatServer  # noqa: E402
+
+from common import add_clients  # noqa: E402
+
+
+def populate(server, members):
+    senders = add_clients(server, members)
+    # Вторая комната для переходов - как через create_room
+    server.presence.create_room('lobby')
+    server.room_members.setdefault('lobby', set())
+    return senders
+
+
+def workload(i):
+    """Смесь сообщений: в основном чат, плюс запросы списков и переходы"""
+    kind = i % 10
+    if kind < 6:
+        return {'type': 'chat', 'message': f'Сообщение {i}'}
+    if kind == 6:
+        return {'type': 'get_users'}
+    if kind == 7:
+        return {'type': 'get_rooms'}
+    return {'type': 'join_room', 'room': 'lobby' if kind == 8 else 'general'}
+
+
+def measure(server, senders, duration):
+    count = 0
+    sender = senders[0]
+    start = time.perf_counter()
+    deadline = start + duration
+    while time.perf_counter() < deadline:
+        server.process_message(sender, workload(count))
+        count += 1
+    return count / (time.perf_counter() - start)
+
+
+def observe_cost(samples=200000):
+    """Замеры одного сообщения чата: время обработчика и рассылка (нс)"""
+    metrics = Metrics()
+    perf_counter = time.perf_counter
+    start = perf_counter()
+    for _ in range(samples):
+        started = perf_counter()
+        metrics.observe_message('chat', perf_counter() - started)
+    message = (perf_counter() - start) / samples
+    start = perf_counter()
+    for _ in range(samples):
+        started = perf_counter()
+        metrics.observe_broadcast(50, 5000, perf_counter() - started)
+    return message, (perf_counter() - start) / samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--members', type=int, default=50)
+    parser.add_argument('--duration', type=float, default=2.0)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    os.chdir(tempfile.mkdtemp(prefix='voicechat-metrics-'))
+    server = VoiceChatServer('127.0.0.1', 0, 0, engine='threaded')
+    senders = populate(server, args.members)
+    metrics = server.metrics or Metrics()
+
+    rates = {'без метрик': [], 'с метриками': []}
+    for _ in range(args.rounds):
+        for mode in rates:
+            server.metrics = metrics if mode == 'с метриками' else None
+            rates[mode].append(measure(server, senders, args.duration))
+            server.storage.flush()
+    print(f"участников: {args.members}, раундов: {args.rounds} по {args.duration:.0f} с")
+    print(f"{'способ':<13}{'сообщ./с (медиана)':>20}{'мин':>8}{'макс':>8}")
+    medians = {}
+    for mode, values in rates.items():
+        values.sort()
+        medians[mode] = values[len(values) // 2]
+        print(f"{mode:<13}{medians[mode]:>20.0f}{values[0]:>8.0f}{values[-1]:>8.0f}")
+    off, on = medians['без метрик'], medians['с метриками']
+    print(f"разница: {(1 / on - 1 / off) * 1e6:+.2f} мкс на сообщение ({(off - on) / off * 100:+.1f}%)")
+    message, broadcast = observe_cost()
+    print(f"замер обработчика: {message * 1e9:.0f} нс, рассылки: {broadcast * 1e9:.0f} нс")
+
+    server.metrics = metrics
+    start = time.perf_counter()
+    for _ in range(100):
+        body = server.render_metrics()
+    print(f"ответ /metrics: {(time.perf_counter() - start) / 100 * 1000:.2f} мс, "
+          f"{len(body.splitlines())} строк")
+    server.storage.close()
+
+
+if __name__ == '__main__':
+    main()
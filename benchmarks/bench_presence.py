@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Стоимость опроса присутствия: get_rooms и get_users.
+
+Сервер с --users клиентами (сокеты-заглушки), разложенными по --rooms
+комнатам; один клиент опрашивает списки. Сравниваются:
+
+    снимок      прежний обработчик: словарь всех комнат (или список
+                участников) и json.dumps на каждый запрос
+    кэш         rooms_list/users_list из presence.Presence: готовые байты,
+                пока версия не изменилась
+    разница     запрос с since: rooms_diff/users_diff с версии, которую
+                клиент получил --poll запросов назад
+
+Между опросами происходит --churn переходов между комнатами на 100
+запросов: они сбрасывают кэш и попадают в разницу. Для каждого способа -
+запросов в секунду и средний размер ответа.
+
+Пример:
+    python benchmarks/bench_presence.py --users 2000 --rooms 100 --churn 0 10 100
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from server import VoiceChatServer  # noqa: E402
+
+from common import RecordingSocket, add_clients  # noqa: E402
+
+
+def populate(server, users, rooms):
+    names = ['general'] + [f'room{i}' for i in range(1, rooms)]
+    # Ответы опрашивающему клиенту остаются в его сокете до подсчета
+    sockets = add_clients(server, users, names, RecordingSocket)
+    # Уведомления о переходах получает только опрашивающий клиент, а
+    # рассылка идет вне замеряемых запросов
+    for sock in sockets[1:]:
+        server.connections[sock].closed = True
+    return sockets, names
+
+
+def legacy_rooms_list(server, sock, message):
+    """Прежний get_rooms: словарь всех комнат на каждый запрос"""
+    rooms_info = {}
+    for room, users in server.rooms.items():
+        rooms_info[room] = len(users)
+    server.send_message(sock, {'type': 'rooms_list', 'rooms': rooms_info})
+
+
+def legacy_users_list(server, sock, message):
+    """Прежний get_users: полный список участников своей комнаты"""
+    room = server.clients[sock]['room']
+    server.send_message(sock, {
+        'type': 'users_list', 'users': list(server.rooms.get(room, set())), 'room': room
+    })
+
+
+def move(server, sockets, names, rng):
+    """Переход случайного клиента (не опрашивающего) в случайную комнату"""
+    sock = rng.choice(sockets[1:])
+    info = server.clients[sock]
+    server.remove_from_room(sock, info['username'], info['room'])
+    info['room'] = rng.choice(names)
+    server.add_to_room(sock, info['username'], info['room'])
+
+
+def measure(server, sockets, names, request, mode, churn, poll, duration, seed=1):
+    """Запросов в секунду и средний размер ответа"""
+    rng = random.Random(seed)
+    sock = sockets[0]
+    legacy = {'get_rooms': legacy_rooms_list, 'get_users': legacy_users_list}[request]
+    versions = []
+    count = 0
+    sent = 0
+    elapsed = 0.0
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        for _ in range(churn):
+            move(server, sockets, names, rng)
+        started = time.perf_counter()
+        for _ in range(100):
+            message = {'type': request}
+            if mode == 'снимок':
+                legacy(server, sock, message)
+            else:
+                if mode == 'разница' and len(versions) >= poll:
+                    message['since'] = versions[-poll]
+                server.process_message(sock, message)
+            count += 1
+        elapsed += time.perf_counter() - started
+        if mode == 'разница':
+            versions.append(server.presence.version if request == 'get_rooms'
+                            else server.presence.room_version(server.clients[sock]['room']))
+        sent += sum(map(len, sock.packets))
+        sock.packets.clear()
+    return count / elapsed, sent / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--rooms', type=int, default=100)
+    parser.add_argument('--churn', nargs='+', type=int, default=[0, 10, 100],
+                        help='переходов между комнатами на 100 запросов')
+    parser.add_argument('--poll', type=int, default=1,
+                        help='разница с версии, полученной столько пачек запросов назад')
+    parser.add_argument('--duration', type=float, default=2.0)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    os.chdir(tempfile.mkdtemp(prefix='voicechat-presence-'))
+    server = VoiceChatServer('127.0.0.1', 0, 0, engine='threaded')
+    server.metrics = None
+    sockets, names = populate(server, args.users, args.rooms)
+    print(f"пользователей: {args.users}, комнат: {args.rooms}, "
+          f"в комнате опрашивающего: {len(server.rooms['general'])}")
+    print(f"{'запрос':<11}{'переходов':>10}  {'способ':<9}{'запросов/с':>12}{'байт/ответ':>12}")
+    for request in ('get_rooms', 'get_users'):
+        for churn in args.churn:
+            for mode in ('снимок', 'кэш', 'разница'):
+                rate, size = measure(server, sockets, names, request, mode, churn,
+                                     args.poll, args.duration)
+                print(f"{request:<11}{churn:>10}  {mode:<9}{rate:>12.0f}{size:>12.0f}")
+    server.storage.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Волна переподключений: кадры присутствия с пачками и без.
+
+Сервер в этом процессе, клиенты - сокеты-заглушки в комнате general.
+Сценарии:
+
+    перезапуск  --users клиентов входят в пустой сервер в течение --spread
+                секунд
+    обрыв       --users клиентов в комнате отключаются в течение --spread
+                секунд и входят снова через 0..--reconnect секунд
+
+События идут по расписанию в виртуальном времени, окна сборки
+(ROOM_CONFIG['presence_batch'], по умолчанию выключено) отсчитываются по
+нему же. Окно 0 - прежние user_joined/user_left на каждое изменение. Для каждого окна -
+кадры присутствия (user_joined, user_left, users_diff, users_list) и их
+байты, всего и в пересчете на клиента, а также время обработки волны.
+
+Пример:
+    python benchmarks/bench_presence_storm.py --users 1000 --windows 0 0.02 0.05 0.1
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from connection import ClientConnection  # noqa: E402
+from presence import PresenceBatcher  # noqa: E402
+from server import VoiceChatServer  # noqa: E402
+
+from common import RecordingSocket  # noqa: E402
+
+PRESENCE_TYPES = (b'user_joined', b'user_left', b'users_diff', b'users_list')
+TYPE_OFFSET = len(b'{"type": "')
+
+
+class Storm:
+    """Сервер с клиентами-заглушками и подсчетом отправленных кадров"""
+
+    def __init__(self, window):
+        self.server = VoiceChatServer('127.0.0.1', 0, 0, engine='threaded')
+        self.server.metrics = None
+        self.server.presence_batcher = None
+        if window > 0:
+            # Без потока сборки: окна закрывает расписание волны
+            self.server.presence_batcher = PresenceBatcher(window, self.server.flush_presence)
+        self.window = window
+        self.sockets = {}  # {username: сокет}
+        self.frames = 0
+        self.bytes = 0
+
+    def login(self, username):
+        sock = RecordingSocket()
+        conn = ClientConnection(sock, ('127.0.0.1', len(self.sockets)))
+        self.server.connections[sock] = conn
+        self.sockets[username] = sock
+        self.server.finish_login(sock, username, ('', False), (True, None), None)
+
+    def logout(self, username):
+        self.server.disconnect_client(self.sockets.pop(username))
+
+    def collect(self):
+        """Подсчет отправленных кадров присутствия и их сброс"""
+        for sock in self.server.connections:
+            for data in sock.packets:
+                kind = data[TYPE_OFFSET:data.find(b'"', TYPE_OFFSET)]
+                if kind in PRESENCE_TYPES:
+                    self.frames += 1
+                    self.bytes += len(data)
+            sock.packets.clear()
+
+    def run(self, events):
+        """События (время, действие, имя) по порядку с окнами сборки"""
+        batcher = self.server.presence_batcher
+        window_end = None
+        started = time.perf_counter()
+        for at, action, username in events:
+            if window_end is not None and at >= window_end:
+                batcher.drain()
+                self.collect()
+                window_end = None
+            action(username)
+            self.collect()
+            if batcher is not None and window_end is None and batcher.rooms:
+                window_end = at + self.window
+        if batcher is not None:
+            batcher.drain()
+            self.collect()
+        return time.perf_counter() - started
+
+    def close(self):
+        self.server.storage.close()
+
+
+def restart_events(storm, users, spread, rng):
+    return sorted((rng.uniform(0, spread), storm.login, f'user{i}') for i in range(users))
+
+
+def blip_events(storm, users, spread, reconnect, rng):
+    events = []
+    for i in range(users):
+        left = rng.uniform(0, spread)
+        events.append((left, storm.logout, f'user{i}'))
+        events.append((left + rng.uniform(0, reconnect), storm.login, f'user{i}'))
+    # При равном времени выход раньше входа
+    return sorted(events, key=lambda event: (event[0], event[1] == storm.login))
+
+
+def measure(scenario, window, args):
+    rng = random.Random(args.seed)
+    storm = Storm(window)
+    try:
+        if scenario == 'перезапуск':
+            events = restart_events(storm, args.users, args.spread, rng)
+        else:
+            batcher, storm.server.presence_batcher = storm.server.presence_batcher, None
+            for i in range(args.users):
+                storm.login(f'user{i}')
+            storm.collect()
+            storm.frames = storm.bytes = 0
+            storm.server.presence_batcher = batcher
+            events = blip_events(storm, args.users, args.spread, args.reconnect, rng)
+        elapsed = storm.run(events)
+        return storm.frames, storm.bytes, elapsed
+    finally:
+        storm.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--spread', type=float, default=2.0,
+                        help='секунд, за которые проходит волна')
+    parser.add_argument('--reconnect', type=float, default=1.0,
+                        help='наибольшая пауза перед повторным входом (обрыв)')
+    parser.add_argument('--windows', nargs='+', type=float, default=[0, 0.02, 0.05, 0.1],
+                        help='окна сборки в секундах, 0 - без пачек')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    os.chdir(tempfile.mkdtemp(prefix='voicechat-storm-'))
+    print(f"пользователей: {args.users}, волна: {args.spread:g} с, "
+          f"повторный вход через 0..{args.reconnect:g} с")
+    print(f"{'сценарий':<12}{'окно, мс':>9}{'кадров':>10}{'на клиента':>12}"
+          f"{'МБ':>9}{'меньше в':>10}{'обработка, с':>14}")
+    for scenario in ('перезапуск', 'обрыв'):
+        baseline = None
+        for window in args.windows:
+            frames, sent, elapsed = measure(scenario, window, args)
+            if baseline is None:
+                baseline = frames
+            ratio = baseline / frames if frames else float('inf')
+            print(f"{scenario:<12}{window * 1000:>9.0f}{frames:>10}{frames / args.users:>12.1f}"
+                  f"{sent / 1e6:>9.1f}{ratio:>10.1f}{elapsed:>14.2f}")
+
+
+if __name__ == '__main__':
+    main()
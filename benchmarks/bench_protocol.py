@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Разбор входящего потока: старый формат и кадры при разных размерах фрагментов.
+
+Поток из --messages сообщений чата (с кириллицей, экранированием и
+числами) режется на фрагменты случайной длины до --chunk байт - как их
+отдает recv при медленной сети - и подается в protocol.FrameDecoder.
+Сообщения, оборванные концом фрагмента, должны дождаться продолжения:
+результат сверяется с исходными сообщениями. Для каждого способа -
+сообщений в секунду.
+
+Пример:
+    python benchmarks/bench_protocol.py --messages 20000 --chunks 1 7 64 4096
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from protocol import FrameDecoder, encode_payload, frame_message  # noqa: E402
+
+
+def make_messages(count, rng):
+    return [{
+        'type': 'chat',
+        'message': f'привет "{i}" \\ {rng.random():.6f} ☺',
+        'n': rng.choice([i, -i, i / 7, 1e-9 * i]),
+        'flags': [True, False, None],
+    } for i in range(count)]
+
+
+def split(data, chunk, rng):
+    pos = 0
+    while pos < len(data):
+        size = rng.randint(1, chunk)
+        yield data[pos:pos + size]
+        pos += size
+
+
+def measure(stream, feed, chunk, expected, seed=1):
+    pieces = list(split(stream, chunk, random.Random(seed)))
+    started = time.perf_counter()
+    decoded = []
+    for piece in pieces:
+        decoded += feed(piece)
+    elapsed = time.perf_counter() - started
+    if decoded != expected:
+        raise SystemExit(f"разбор с фрагментами до {chunk} байт: сообщения не совпали")
+    return len(expected) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--chunks', nargs='+', type=int, default=[1, 7, 64, 4096],
+                        help='наибольший размер фрагмента в байтах')
+    args = parser.parse_args()
+
+    messages = make_messages(args.messages, random.Random(1))
+    legacy = b''.join(encode_payload(message) for message in messages)
+    framed = b''.join(frame_message(message) for message in messages)
+    print(f"сообщений: {args.messages}, старый формат {len(legacy)} байт, кадры {len(framed)} байт")
+    print(f"{'фрагмент до':>12}  {'формат':<8}{'сообщений/с':>13}")
+    for chunk in args.chunks:
+        for name, stream, method in (('старый', legacy, FrameDecoder.feed_legacy),
+                                     ('кадры', framed, FrameDecoder.feed_frames)):
+            decoder = FrameDecoder()
+            rate = measure(stream, lambda data: method(decoder, data), chunk, messages)
+            print(f"{chunk:>12}  {name:<8}{rate:>13.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Адаптивное качество голоса: переключение профиля посреди фразы и
+поведение BitrateController.
+
+1. Щелчки. Тон кодируется с переключением профиля каждые 0.5 с и
+   воспроизводится так же, как у слушателя (voice_playback._Stream).
+   Для каждого способа смены - switch_quality (без сброса состояния) и
+   set_quality (сброс кодера, как в начале фразы) - выводится наибольшая
+   вторая разность отсчетов сразу после смены относительно ее 99.9-го
+   процентиля до и после смены (около 1 - смена не слышна; худшая и
+   медиана по сменам) и сколько звука выпало при сменах.
+
+2. Регулятор. Интервалы отчетов с заданными потерями канала одного
+   отправителя и нагрузкой ретранслятора; для каждого интервала -
+   профиль отправителя, потолок и исходящий трафик ретранслятора для
+   комнаты --members участников, где все --speakers говорят одновременно.
+
+Пример:
+    python benchmarks/bench_quality_switch.py --members 30 --speakers 10
+"""
+
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+from config import AUDIO_CONFIG, VOICE_QUALITY  # noqa: E402
+from voice_bitrate import BitrateController  # noqa: E402
+from voice_codec import FRAME_HEADER, VoiceEncoder, quality_profile  # noqa: E402
+from voice_playback import _Stream  # noqa: E402
+from voice_relay import VOICE_HEADER  # noqa: E402
+
+SWITCH_ORDER = ('low', 'medium', 'high', 'low', 'high', 'medium')
+
+# (потери отправителя %, джиттер мс, нагрузка ретранслятора) по интервалам
+TIMELINE = (
+    [(0.0, 5.0, 0.2)] * 3
+    + [(8.0, 12.0, 0.2)] * 2  # плохой канал отправителя
+    + [(0.3, 6.0, 0.2)] * 7  # канал восстановился
+    + [(0.3, 6.0, 0.85)] * 3  # ретранслятор перегружен
+    + [(0.3, 6.0, 0.3)] * 8
+)
+
+
+def click_test(method, seconds, rate):
+    chunk = AUDIO_CONFIG['chunk']
+    frame = rate * AUDIO_CONFIG['frame_ms'] // 1000
+    t = np.arange(int(seconds * rate)) / rate
+    signal = (6000 * np.sin(2 * np.pi * 300 * t) + 3000 * np.sin(2 * np.pi * 1100 * t))
+    signal = signal.astype(np.int16)
+    encoder = VoiceEncoder('medium', rate)
+    stream = _Stream(AUDIO_CONFIG['frame_ms'])
+    period = int(0.5 * rate / chunk)
+    output = []
+    marks = []
+    fed = 0
+    for index, start in enumerate(range(0, len(signal) - chunk + 1, chunk)):
+        if index % period == period // 2:
+            marks.append(len(output) * frame)
+            getattr(encoder, method)(SWITCH_ORDER[len(marks) % len(SWITCH_ORDER)])
+        for _, data in encoder.encode(signal[start:start + chunk]):
+            output.append(stream.render(data, rate, frame))
+        fed += chunk
+    played = np.concatenate(output).astype(np.float64)
+    second = np.abs(np.diff(played, 2))
+    # Смена слышна, если рядом с ней вторая разность больше, чем обычно
+    # бывает у обоих профилей - до смены и после
+    window = 3 * frame
+    span = 12 * frame
+    ratios = []
+    for mark in marks:
+        before = second[max(window, mark - span):mark]
+        after = second[mark + window:mark + window + span]
+        if len(before) < frame or len(after) < frame:
+            continue
+        typical = max(np.percentile(before, 99.9), np.percentile(after, 99.9))
+        ratios.append(second[mark:mark + window].max() / typical)
+    # Звук, выпавший при сменах: подано минус закодировано минус остаток кодера
+    fed_ms = fed / rate * 1000
+    encoded_ms = len(output) * AUDIO_CONFIG['frame_ms']
+    pending_ms = len(encoder.pending) / encoder.rate * 1000
+    lost_ms = round(fed_ms - encoded_ms - pending_ms, 1) + 0.0  # без "-0.0"
+    return max(ratios), float(np.median(ratios)), lost_ms
+
+
+def wire_bps(quality):
+    """Байт/с одного говорящего на проводе (без IP/UDP)"""
+    profile = quality_profile(quality)
+    frames = 1000 / AUDIO_CONFIG['frame_ms']
+    payload = profile['bitrate'] / 8 / frames
+    return (payload + VOICE_HEADER.size + FRAME_HEADER.size) * frames
+
+
+def controller_test(members, speakers):
+    controller = BitrateController()
+    others = [f'user{i}' for i in range(1, speakers)]
+    users = ['sender'] + others
+    rows = []
+    busy = 0.0
+    for step, (loss, jitter, load) in enumerate(TIMELINE):
+        now = float(step * AUDIO_CONFIG['report_interval'])
+        busy += load * AUDIO_CONFIG['report_interval']
+        if step == 0:
+            controller.observe_load({'busy': 0.0, 'send_errors': 0}, now - AUDIO_CONFIG['report_interval'])
+        controller.observe_load({'busy': busy, 'send_errors': 0}, now)
+        health = {'sender': (loss, jitter)}
+        health.update((name, (0.2, 5.0)) for name in others)
+        controller.evaluate(users, health)
+        outbound = sum(wire_bps(controller.quality(name)) for name in users) * (members - 1)
+        rows.append((step, loss, load, controller.quality('sender'),
+                     controller.quality(others[0]) if others else '-',
+                     controller.stats()['cap'], outbound * 8 / 1e6))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=6.0)
+    parser.add_argument('--members', type=int, default=30)
+    parser.add_argument('--speakers', type=int, default=10)
+    args = parser.parse_args()
+
+    rate = AUDIO_CONFIG['rate']
+    print(f"смена профиля каждые ~0.5 с ({', '.join(VOICE_QUALITY)}), вывод {rate} Гц")
+    print(f"{'способ':>15}{'щелчок, x':>11}{'медиана':>9}{'выпало, мс':>12}")
+    for method in ('switch_quality', 'set_quality'):
+        worst, median, lost = click_test(method, args.seconds, rate)
+        print(f"{method:>15}{worst:>11.2f}{median:>9.2f}{lost:>12.1f}")
+
+    print()
+    print(f"регулятор: интервал {AUDIO_CONFIG['report_interval']} с, комната {args.members}, "
+          f"говорят {args.speakers}")
+    print(f"{'интервал':>9}{'потери %':>9}{'нагрузка':>9}{'отправитель':>12}{'остальные':>10}"
+          f"{'потолок':>9}{'исх. Мбит/с':>12}")
+    for step, loss, load, sender, other, cap, mbps in controller_test(args.members, args.speakers):
+        print(f"{step:>9}{loss:>9.1f}{load:>9.2f}{sender:>12}{other:>10}{cap:>9}{mbps:>12.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочная проверка доступа к базе пользователей из многих потоков.
+
+--threads потоков в течение --seconds секунд выполняют входы (чтение
+хеша случайного пользователя) и регистрации (доля --register-pct) -
+так же, как потоки клиентов сервера. Сравниваются:
+
+    shared    прежний способ: одно подключение с check_same_thread=False,
+              общий курсор, commit после каждой регистрации
+    storage   storage.Storage: пул читателей, WAL, поток записи с
+              групповой фиксацией
+
+Для каждого способа выводятся входов и регистраций в секунду и ошибки:
+исключения sqlite3, чужие строки в ответе на вход (курсор перемешал
+результаты параллельных запросов) и регистрации, подтвержденные
+клиенту, но не найденные в базе после прогона. Каждый способ работает
+в отдельном процессе: общий курсор под нагрузкой может намертво зависнуть
+или уронить интерпретатор - тогда вместо чисел выводится "завис" или
+номер сигнала.
+
+Пример:
+    python benchmarks/bench_storage.py --threads 32 --seconds 5
+"""
+
+import argparse
+import json
+import os
+import random
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from storage import SCHEMA, Storage  # noqa: E402
+
+
+def stored_hash(username):
+    return f'hash-of-{username}'
+
+
+def seed(path, users):
+    storage = Storage(path)
+    futures = [storage.create_user(f'user{i}', stored_hash(f'user{i}')) for i in range(users)]
+    for future in futures:
+        future.result()
+    storage.close()
+
+
+class Shared:
+    """Прежний доступ к базе из server.py"""
+
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.cursor = self.conn.cursor()
+        for statement in SCHEMA:
+            self.cursor.execute(statement)
+
+    def user_credentials(self, username):
+        self.cursor.execute(
+            'SELECT password_hash, is_admin FROM users WHERE username = ?', (username,)
+        )
+        return self.cursor.fetchone()
+
+    def register(self, username, password_hash, done):
+        try:
+            self.cursor.execute(
+                'INSERT INTO users (username, password_hash) VALUES (?, ?)',
+                (username, password_hash)
+            )
+            self.conn.commit()
+            done(True, None)
+        except sqlite3.IntegrityError:
+            done(False, None)
+
+    def close(self):
+        self.conn.close()
+
+
+class Pooled:
+    def __init__(self, path):
+        self.storage = Storage(path)
+
+    def user_credentials(self, username):
+        return self.storage.user_credentials(username)
+
+    def register(self, username, password_hash, done):
+        self.storage.create_user(username, password_hash, done)
+
+    def close(self):
+        self.storage.flush()
+        self.stats = self.storage.stats()
+        self.storage.close()
+
+
+def worker(db, index, users, register_pct, deadline, result):
+    rng = random.Random(index)
+    registered = 0
+    while time.perf_counter() < deadline:
+        try:
+            if rng.random() * 100 < register_pct:
+                username = f'new{index}_{registered}'
+                registered += 1
+
+                def done(created, error, username=username):
+                    if error is not None:
+                        result['errors'] += 1
+                    elif created:
+                        result['confirmed'].append(username)
+                db.register(username, stored_hash(username), done)
+                result['registrations'] += 1
+            else:
+                username = f'user{rng.randrange(users)}'
+                row = db.user_credentials(username)
+                if row is None or row[0] != stored_hash(username):
+                    result['wrong'] += 1
+                result['logins'] += 1
+        except sqlite3.Error:
+            result['errors'] += 1
+
+
+def run(mode, threads, seconds, users, register_pct):
+    workdir = tempfile.mkdtemp(prefix='voicechat-storage-')
+    path = os.path.join(workdir, 'users.db')
+    seed(path, users)
+    db = Shared(path) if mode == 'shared' else Pooled(path)
+    results = [
+        {'logins': 0, 'registrations': 0, 'errors': 0, 'wrong': 0, 'confirmed': []}
+        for _ in range(threads)
+    ]
+    deadline = time.perf_counter() + seconds
+    pool = [
+        threading.Thread(target=worker, args=(db, i, users, register_pct, deadline, results[i]))
+        for i in range(threads)
+    ]
+    started = time.perf_counter()
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    db.close()
+    elapsed = time.perf_counter() - started
+
+    # Все подтвержденные регистрации должны быть в базе с верным хешем
+    check = sqlite3.connect(path)
+    rows = dict(check.execute('SELECT username, password_hash FROM users'))
+    check.close()
+    confirmed = [name for r in results for name in r['confirmed']]
+    missing = sum(1 for name in confirmed if rows.get(name) != stored_hash(name))
+    total = {key: sum(r[key] for r in results) for key in ('logins', 'registrations', 'errors', 'wrong')}
+    total.update(
+        login_rate=total['logins'] / elapsed,
+        register_rate=len(confirmed) / elapsed,
+        missing=missing,
+        batch=getattr(db, 'stats', {}).get('avg_batch', 1.0),
+    )
+    return total
+
+
+def run_isolated(mode, args):
+    """Прогон в отдельном процессе: (результат, None) или (None, что случилось)"""
+    command = [
+        sys.executable, os.path.abspath(__file__), '--child', mode,
+        '--threads', str(args.threads), '--seconds', str(args.seconds),
+        '--users', str(args.users), '--register-pct', str(args.register_pct),
+    ]
+    try:
+        child = subprocess.run(
+            command, capture_output=True, text=True,
+            timeout=args.seconds + args.hang_timeout,
+        )
+    except subprocess.TimeoutExpired:
+        return None, 'завис'
+    if child.returncode < 0:
+        return None, f'упал: {signal.Signals(-child.returncode).name}'
+    if child.returncode:
+        return None, f'ошибка: {child.stderr.strip().splitlines()[-1]}'
+    return json.loads(child.stdout), None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--register-pct', type=float, default=10.0)
+    parser.add_argument('--modes', nargs='+', default=['shared', 'storage'])
+    parser.add_argument('--hang-timeout', type=float, default=30.0,
+                        help='секунд сверх --seconds, после которых прогон считается зависшим')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run(args.child, args.threads, args.seconds, args.users, args.register_pct)))
+        return
+
+    print(f"потоков: {args.threads}, пользователей: {args.users}, "
+          f"регистраций: {args.register_pct:.0f}%")
+    print(f"{'способ':<9}{'вход/с':>10}{'рег./с':>9}{'исключений':>12}"
+          f"{'чужих строк':>13}{'потеряно рег.':>15}{'записей/commit':>16}")
+    for mode in args.modes:
+        r, failure = run_isolated(mode, args)
+        if failure:
+            print(f"{mode:<9}  {failure}")
+            continue
+        print(f"{mode:<9}{r['login_rate']:>10.0f}{r['register_rate']:>9.0f}"
+              f"{r['errors']:>12}{r['wrong']:>13}{r['missing']:>15}{r['batch']:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
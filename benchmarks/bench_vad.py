@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Определение речи и подавление пауз на синтетическом разговоре.
+
+Сигнал: фон (белый шум, в сценарии fan - еще и гул 100 Гц) и фразы из
+слогов - гармонический звук с огибающей и глухие шумовые согласные. Доля
+времени с речью задается --talk-ratio. Один и тот же сигнал прогоняется
+через VoiceCapture с определением речи и без него; выводятся:
+
+    пакетов/с      с VAD и без (без VAD - все 1000 / frame_ms)
+    полнота        доля кадров слогов, которые были переданы
+    ложные         доля кадров пауз (вне фраз и их хвоста), которые ушли в сеть
+    мкс/кадр       время VoiceActivityDetector.process на кадр
+    пересылок/с    нагрузка ретранслятора для комнаты --members участников
+                   с открытыми микрофонами: пакеты/с * участники * (участники - 1)
+
+Пример:
+    python benchmarks/bench_vad.py --seconds 60 --members 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+from config import AUDIO_CONFIG  # noqa: E402
+from voice_capture import VoiceCapture  # noqa: E402
+from voice_codec import Resampler  # noqa: E402
+from voice_relay import FLAG_CN, VOICE_HEADER  # noqa: E402
+from voice_vad import HANGOVER_MS, VoiceActivityDetector  # noqa: E402
+
+from common import RecordingSocket  # noqa: E402
+
+# Сценарии фона: RMS белого шума и амплитуда гула
+SCENARIOS = {
+    'quiet': {'noise': 30, 'hum': 0},
+    'office': {'noise': 200, 'hum': 0},
+    'fan': {'noise': 500, 'hum': 800},
+}
+
+
+def conversation(seconds, rate, talk_ratio, noise, hum, seed):
+    """Сигнал и разметка: маска фраз и маска слогов (по отсчетам)"""
+    rng = np.random.default_rng(seed)
+    total = int(seconds * rate)
+    signal = noise * rng.standard_normal(total)
+    if hum:
+        signal += hum * np.sin(2 * np.pi * 100 * np.arange(total) / rate)
+    talk = np.zeros(total, dtype=bool)
+    voiced = np.zeros(total, dtype=bool)
+
+    position = int(rng.uniform(0.5, 2.0) * rate)
+    while position < total:
+        phrase = int(rng.uniform(1.5, 5.0) * rate)
+        end = min(total, position + phrase)
+        talk[position:end] = True
+        cursor = position
+        while cursor < end:
+            if rng.random() < 0.2:
+                # Глухая согласная: шум без периодичности
+                length = int(rng.uniform(0.05, 0.12) * rate)
+                amplitude = rng.uniform(800, 2000)
+                burst = amplitude * rng.standard_normal(length)
+            else:
+                length = int(rng.uniform(0.12, 0.28) * rate)
+                f0 = rng.uniform(90, 220)
+                t = np.arange(length) / rate
+                burst = sum(np.sin(2 * np.pi * f0 * k * t) / k for k in range(1, 11))
+                burst *= rng.uniform(2000, 7000) * np.hanning(length)
+            length = min(length, end - cursor)
+            signal[cursor:cursor + length] += burst[:length]
+            voiced[cursor:cursor + length] = True
+            cursor += length + int(rng.uniform(0.02, 0.10) * rate)
+        pause = phrase * (1 - talk_ratio) / talk_ratio
+        position = end + int(rng.uniform(0.5, 1.5) * pause)
+    return np.clip(signal, -32768, 32767).astype(np.int16), talk, voiced
+
+
+def frame_mask(mask, rate, frame_ms, frames, rule):
+    size = rate * frame_ms // 1000
+    usable = min(frames, len(mask) // size)
+    return rule(mask[:usable * size].reshape(usable, size), axis=1)
+
+
+def transmit(signal, rate, chunk, vad):
+    """Прогон сигнала через конвейер захвата; номера переданных кадров"""
+    sock = RecordingSocket()
+    capture = VoiceCapture(sock, ('127.0.0.1', 0), input_rate=rate, chunk=chunk, vad=vad)
+    capture.set_transmitting(True)
+    start_ts = capture.timestamp
+    for offset in range(0, len(signal) - chunk + 1, chunk):
+        capture.callback(signal[offset:offset + chunk].tobytes(), chunk, None, 0)
+        capture.pump()
+    sent = set()
+    comfort = 0
+    for packet in sock.packets:
+        _, _, _, _, timestamp, flags = VOICE_HEADER.unpack_from(packet)
+        if flags & FLAG_CN:
+            comfort += 1
+            continue
+        sent.add((timestamp - start_ts) // capture.encoder.frame_ms)
+    return capture, sent, comfort, len(sock.packets)
+
+
+def vad_cost(signal, rate, frame_ms):
+    """Среднее время классификации одного кадра, мкс"""
+    size = rate * frame_ms // 1000
+    frames = [signal[i:i + size] for i in range(0, len(signal) - size + 1, size)]
+    vad = VoiceActivityDetector(frame_ms)
+    start = time.perf_counter()
+    for frame in frames:
+        vad.process(frame)
+    return (time.perf_counter() - start) / len(frames) * 1e6
+
+
+def run(name, scenario, args):
+    rate = AUDIO_CONFIG['rate']
+    chunk = AUDIO_CONFIG['chunk']
+    frame_ms = AUDIO_CONFIG['frame_ms']
+    signal, talk, voiced = conversation(
+        args.seconds, rate, args.talk_ratio, scenario['noise'], scenario['hum'], args.seed
+    )
+    plain, _, _, plain_packets = transmit(signal, rate, chunk, vad=False)
+    capture, sent, comfort, packets = transmit(signal, rate, chunk, vad=True)
+
+    frames = int(args.seconds * 1000 // frame_ms)
+    # Слог - кадр, в котором он занимает хотя бы половину отсчетов
+    syllable_frames = frame_mask(voiced, rate, frame_ms, frames, lambda m, axis: m.mean(axis) >= 0.5)
+    talk_frames = frame_mask(talk, rate, frame_ms, frames, np.any)
+    # Паузы: кадры вне фраз и без законного хвоста после них
+    hangover = HANGOVER_MS // frame_ms + 1
+    near_talk = talk_frames.copy()
+    for shift in range(1, hangover + 1):
+        near_talk[shift:] |= talk_frames[:-shift]
+    pauses = ~near_talk
+
+    transmitted = np.zeros(len(syllable_frames), dtype=bool)
+    for index in sent:
+        if 0 <= index < len(transmitted):
+            transmitted[index] = True
+    recall = transmitted[syllable_frames].mean() * 100
+    false_rate = transmitted[pauses].mean() * 100 if pauses.any() else 0.0
+
+    duration = len(signal) / rate
+    pps_plain = plain_packets / duration
+    pps = packets / duration
+    members = args.members
+    return {
+        'name': name,
+        'talk': talk.mean() * 100,
+        'pps_plain': pps_plain,
+        'pps': pps,
+        'kbps_plain': plain.bytes_sent * 8 / duration / 1000,
+        'kbps': capture.bytes_sent * 8 / duration / 1000,
+        'recall': recall,
+        'false': false_rate,
+        'comfort': comfort,
+        'vad_us': vad_cost(
+            Resampler(rate, capture.encoder.rate).process(signal), capture.encoder.rate, frame_ms
+        ),
+        'forwards_plain': pps_plain * members * (members - 1),
+        'forwards': pps * members * (members - 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=60.0)
+    parser.add_argument('--talk-ratio', type=float, default=0.35)
+    parser.add_argument('--members', type=int, default=20)
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), action='append')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f"кадр {AUDIO_CONFIG['frame_ms']} мс, качество {AUDIO_CONFIG['voice_quality']}, "
+          f"хвост {HANGOVER_MS} мс, комната {args.members} участников")
+    print(f"{'фон':>7}{'речь %':>8}{'пак/с':>7}{'c VAD':>7}{'кбит/с':>8}{'c VAD':>7}"
+          f"{'полнота %':>11}{'ложные %':>10}{'фраз':>6}{'мкс/кадр':>10}"
+          f"{'пересылок/с':>13}{'c VAD':>9}")
+    for name in args.scenario or list(SCENARIOS):
+        r = run(name, SCENARIOS[name], args)
+        print(f"{r['name']:>7}{r['talk']:>8.1f}{r['pps_plain']:>7.1f}{r['pps']:>7.1f}"
+              f"{r['kbps_plain']:>8.1f}{r['kbps']:>7.1f}{r['recall']:>11.1f}{r['false']:>10.1f}"
+              f"{r['comfort']:>6}{r['vad_us']:>10.1f}"
+              f"{r['forwards_plain']:>13.0f}{r['forwards']:>9.0f}")
+
+
+if __name__ == '__main__':
+    main()
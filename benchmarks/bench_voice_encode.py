@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Конвейер захвата и кодирования голоса без звуковой карты.
+
+SyntheticSource вызывает колбэк VoiceCapture блоками AUDIO_CONFIG['chunk'],
+конвейер (кольцо, передискретизация, кодирование) отправляет пакеты в
+сокет-заглушку. Для каждого профиля voice_quality выводятся: размер пакета,
+битрейт на проводе (с заголовками пакета, без IP/UDP), время кодирования
+кадра, доля реального времени и отношение сигнал/шум после декодирования.
+
+Пример:
+    python benchmarks/bench_voice_encode.py --seconds 10
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+from config import AUDIO_CONFIG, VOICE_QUALITY  # noqa: E402
+from voice_capture import SyntheticSource, VoiceCapture  # noqa: E402
+from voice_codec import Resampler, decode_frame, quality_profile  # noqa: E402
+from voice_relay import VOICE_HEADER  # noqa: E402
+
+from common import RecordingSocket  # noqa: E402
+
+
+def snr(reference, decoded):
+    size = min(len(reference), len(decoded))
+    reference = reference[:size].astype(np.float64)
+    error = decoded[:size].astype(np.float64) - reference
+    return 10 * np.log10((reference ** 2).mean() / max((error ** 2).mean(), 1e-9))
+
+
+def run(quality, seconds):
+    chunk = AUDIO_CONFIG['chunk']
+    rate = AUDIO_CONFIG['rate']
+    sock = RecordingSocket()
+    capture = VoiceCapture(sock, ('127.0.0.1', 0), quality, vad=False)
+    capture.set_transmitting(True)
+    source = SyntheticSource(rate, chunk, realtime=False)
+    blocks = int(seconds * rate / chunk)
+
+    signal = []
+    elapsed = 0.0
+    for _ in range(blocks):
+        block = source.block()
+        signal.append(block)
+        capture.callback(block.tobytes(), chunk, None, 0)
+        start = time.perf_counter()
+        capture.pump()
+        elapsed += time.perf_counter() - start
+
+    profile = quality_profile(quality)
+    reference = Resampler(rate, profile['rate']).process(np.concatenate(signal))
+    decoded = np.concatenate([decode_frame(packet[VOICE_HEADER.size:])[0] for packet in sock.packets])
+    duration = blocks * chunk / rate
+    frames = len(sock.packets)
+    return {
+        'profile': profile,
+        'packet': len(sock.packets[0]),
+        'wire_kbps': capture.bytes_sent * 8 / duration / 1000,
+        'frame_us': elapsed / frames * 1e6,
+        'realtime': elapsed / duration * 100,
+        'snr': snr(reference, decoded),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--seconds', type=float, default=10.0)
+    args = parser.parse_args()
+
+    raw_kbps = AUDIO_CONFIG['rate'] * 16 / 1000
+    print(f"без сжатия: {AUDIO_CONFIG['rate']} Гц paInt16 = {raw_kbps:.0f} кбит/с, "
+          f"кадр {AUDIO_CONFIG['frame_ms']} мс")
+    print(f"{'качество':>9}{'Гц':>7}{'кодек':>7}{'пакет, Б':>10}{'кбит/с':>8}"
+          f"{'сжатие':>8}{'мкс/кадр':>10}{'% CPU':>7}{'SNR, дБ':>9}")
+    for quality in VOICE_QUALITY:
+        result = run(quality, args.seconds)
+        profile = result['profile']
+        print(f"{quality:>9}{profile['rate']:>7}{profile['codec']:>7}{result['packet']:>10}"
+              f"{result['wire_kbps']:>8.1f}{raw_kbps / result['wire_kbps']:>7.1f}x"
+              f"{result['frame_us']:>10.0f}{result['realtime']:>7.2f}{result['snr']:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
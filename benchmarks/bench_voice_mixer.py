@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Стоимость серверного микширования (VoiceMixer) в зависимости от размера комнаты.
+
+Для каждой комбинации (участников, говорящих) замеряется время одного
+такта: декодирование пакетов VOICE говорящих (профиль --quality),
+сложение кадров, вычитание собственного голоса, кодирование mu-law и
+подготовка пакетов для всех слушателей. Сокет - заглушка, системные
+вызовы не учитываются. Бюджет такта - AUDIO_CONFIG['frame_ms'].
+
+Пример:
+    python benchmarks/bench_voice_mixer.py --rooms 10 50 100 --speakers 1 5 20
+"""
+
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+
+from config import AUDIO_CONFIG, VOICE_QUALITY  # noqa: E402
+from voice_codec import VoiceEncoder  # noqa: E402
+from voice_mixer import VoiceMixer  # noqa: E402
+from voice_relay import PACKET_VOICE, VOICE_HEADER  # noqa: E402
+
+from common import NullSocket  # noqa: E402
+
+
+def voice_packets(quality, count):
+    """Пакеты VOICE с кадрами шума, закодированными профилем quality"""
+    encoder = VoiceEncoder(quality, input_rate=VOICE_QUALITY[quality]['rate'])
+    rng = np.random.default_rng(0)
+    packets = []
+    for _ in range(count):
+        frame = rng.integers(-8000, 8000, encoder.frame_samples, dtype=np.int16)
+        packets.append(VOICE_HEADER.pack(PACKET_VOICE, 60, 0, 0, 0, 0) + encoder.encode_frame(frame))
+    return packets
+
+
+def measure(room_size, speakers, iterations, quality):
+    mixer = VoiceMixer(NullSocket())
+    listeners = tuple(('127.0.0.1', 10000 + i) for i in range(room_size))
+    packets = voice_packets(quality, speakers)
+    targets = {'room': listeners}
+
+    elapsed = 0.0
+    for _ in range(iterations):
+        start = time.perf_counter()
+        for i in range(speakers):
+            mixer.push('room', listeners[i], packets[i])
+        mixer.tick(targets)
+        elapsed += time.perf_counter() - start
+    return elapsed / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rooms', nargs='+', type=int, default=[10, 50, 100])
+    parser.add_argument('--speakers', nargs='+', type=int, default=[1, 5, 20])
+    parser.add_argument('--iterations', type=int, default=300)
+    parser.add_argument('--quality', choices=tuple(VOICE_QUALITY), default=AUDIO_CONFIG['voice_quality'],
+                        help='профиль кадров говорящих')
+    args = parser.parse_args()
+
+    budget = AUDIO_CONFIG['frame_ms'] / 1000
+    print(f"бюджет такта: {budget * 1e3:.1f} мс")
+    print(f"{'участников':>10}{'говорящих':>10}{'такт, мкс':>11}{'% бюджета':>11}"
+          f"{'пакетов (пересылка)':>21}{'пакетов (микс)':>16}")
+    for room_size in args.rooms:
+        for speakers in args.speakers:
+            if speakers > room_size:
+                continue
+            cost = measure(room_size, speakers, args.iterations, args.quality)
+            forwarded = speakers * (room_size - 1)
+            mixed = room_size - (1 if speakers == 1 else 0)
+            print(f"{room_size:>10}{speakers:>10}{cost * 1e6:>11.0f}{cost / budget * 100:>11.2f}"
+                  f"{forwarded:>21}{mixed:>16}")
+
+
+if __name__ == '__main__':
+    main()
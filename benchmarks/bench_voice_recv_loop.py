@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Пропускная способность цикла приема голоса: recvfrom против кольца буферов.
+
+legacy - прежний цикл handle_voice_connections: recvfrom(4096) на каждый
+пакет с созданием нового объекта bytes. ring - VoiceRelay.serve():
+recvfrom_into в заранее выделенные буферы и прием пачками.
+
+Один говорящий непрерывно шлет пакеты в комнату с --listeners слушателями,
+ретранслятор в отдельном процессе считает обработанные пакеты в секунду.
+
+Пример:
+    python benchmarks/bench_voice_recv_loop.py --listeners 1 --duration 5
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import AUDIO_CONFIG  # noqa: E402
+from voice_relay import PACKET_AUDIO, PACKET_REGISTER, VoiceRelay  # noqa: E402
+
+
+class CountingRelay(VoiceRelay):
+    """Ретранслятор со счетчиком обработанных пакетов"""
+
+    def __init__(self, sock):
+        super().__init__(sock)
+        self.processed = 0
+        self.first = None
+
+    def handle_packet(self, data, address):
+        if data[0] == PACKET_AUDIO:
+            if self.first is None:
+                self.first = time.perf_counter()
+            self.processed += 1
+            self.last = time.perf_counter()
+        super().handle_packet(data, address)
+
+
+def relay_process(mode, pipe, control, users):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 << 20)
+    sock.bind(('127.0.0.1', 0))
+    relay = CountingRelay(sock)
+    tokens = [relay.issue_token(f'user{i}', 'general') for i in range(users)]
+    pipe.send((sock.getsockname()[1], tokens))
+
+    def running():
+        return not control.poll()
+
+    if mode == 'legacy':
+        while running():
+            data, address = sock.recvfrom(4096)
+            relay.handle_packet(data, address)
+    else:
+        relay.serve(running)
+
+    elapsed = (relay.last - relay.first) if relay.first else 0.0
+    pipe.send((relay.processed, elapsed, relay.forwarded))
+
+
+def run(mode, listeners, duration, payload):
+    pipe, child = multiprocessing.Pipe()
+    control_r, control_w = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(target=relay_process, args=(mode, child, control_r, listeners + 1))
+    proc.start()
+    port, tokens = pipe.recv()
+    address = ('127.0.0.1', port)
+
+    sockets = []
+    for token in tokens:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.sendto(bytes([PACKET_REGISTER]) + token.encode('ascii'), address)
+        sockets.append(sock)
+    time.sleep(0.5)
+
+    packet = bytes([PACKET_AUDIO]) + b'\0' * payload
+    speaker = sockets[0]
+    deadline = time.perf_counter() + duration
+    sent = 0
+    while time.perf_counter() < deadline:
+        for _ in range(64):
+            speaker.sendto(packet, address)
+        sent += 64
+        # Короткая пауза, чтобы ретранслятор получил процессор на одном ядре
+        time.sleep(0.0005)
+    time.sleep(0.5)
+    control_w.send(True)
+    # Пустой пакет будит ретранслятор, ждущий в recvfrom
+    speaker.sendto(b'\xff', address)
+    processed, elapsed, forwarded = pipe.recv()
+    proc.join()
+    for sock in sockets:
+        sock.close()
+    return sent, processed, processed / elapsed if elapsed else 0.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--listeners', type=int, default=1)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--payload', type=int, default=AUDIO_CONFIG['chunk'] * 2)
+    args = parser.parse_args()
+
+    print(f"{'цикл':<8}{'отправлено':>12}{'обработано':>12}{'пак./с':>10}")
+    for mode in ('legacy', 'ring'):
+        sent, processed, pps = run(mode, args.listeners, args.duration, args.payload)
+        print(f"{mode:<8}{sent:>12}{processed:>12}{pps:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Задержка пересылки голоса через VoiceRelay при многих говорящих.
+
+Ретранслятор работает в отдельном процессе с тем же циклом приема, что
+и handle_voice_connections. Каждый говорящий отправляет пакеты с частотой
+AUDIO_CONFIG (rate / chunk, ~43 пакета/с), в пакет вписано время отправки;
+получатели считают задержку от отправки до приема. Отдельно ретранслятор
+замеряет собственное время обработки пакета (от recvfrom до последнего
+sendto).
+
+Пример:
+    python benchmarks/bench_voice_relay.py --speakers 50 --rooms 5 --duration 10
+"""
+
+import argparse
+import multiprocessing
+import os
+import selectors
+import socket
+import struct
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from config import AUDIO_CONFIG  # noqa: E402
+from voice_relay import PACKET_AUDIO, PACKET_REGISTER, VoiceRelay  # noqa: E402
+
+from common import percentile  # noqa: E402
+
+STAMP = struct.Struct('!d')
+
+
+def relay_process(port_pipe, control, speakers, rooms):
+    """Процесс ретранслятора: выдает токены и обслуживает порт"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(('127.0.0.1', 0))
+    relay = VoiceRelay(sock)
+    tokens = [relay.issue_token(f'user{i}', f'room{i % rooms}') for i in range(speakers)]
+    port_pipe.send((sock.getsockname()[1], tokens))
+
+    timings = []
+    sock.settimeout(0.5)
+    while not control.poll():
+        try:
+            data, address = sock.recvfrom(4096)
+        except socket.timeout:
+            continue
+        start = time.perf_counter()
+        relay.handle_packet(data, address)
+        if data[0] == PACKET_AUDIO:
+            timings.append(time.perf_counter() - start)
+    port_pipe.send((timings, relay.stats()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--speakers', type=int, default=50)
+    parser.add_argument('--rooms', type=int, default=5)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--payload', type=int, default=AUDIO_CONFIG['chunk'] * 2,
+                        help='размер аудиоданных в байтах (по умолчанию сырой paInt16 chunk)')
+    args = parser.parse_args()
+
+    parent_pipe, child_pipe = multiprocessing.Pipe()
+    control_r, control_w = multiprocessing.Pipe(duplex=False)
+    proc = multiprocessing.Process(
+        target=relay_process, args=(child_pipe, control_r, args.speakers, args.rooms)
+    )
+    proc.start()
+    port, tokens = parent_pipe.recv()
+    relay_address = ('127.0.0.1', port)
+
+    selector = selectors.DefaultSelector()
+    sockets = []
+    for token in tokens:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        sock.bind(('127.0.0.1', 0))
+        sock.setblocking(False)
+        sock.sendto(bytes([PACKET_REGISTER]) + token.encode('ascii'), relay_address)
+        selector.register(sock, selectors.EVENT_READ)
+        sockets.append(sock)
+    time.sleep(0.5)
+    for key, _ in selector.select(timeout=0):
+        while True:
+            try:
+                key.fileobj.recv(16)
+            except BlockingIOError:
+                break
+
+    interval = AUDIO_CONFIG['chunk'] / AUDIO_CONFIG['rate']
+    padding = b'\0' * max(0, args.payload - STAMP.size)
+    header = bytes([PACKET_AUDIO])
+    latencies = []
+    sent = 0
+    start = time.perf_counter()
+    # Говорящие равномерно распределены внутри периода пакета
+    next_send = [start + interval * i / len(sockets) for i in range(len(sockets))]
+    while time.perf_counter() - start < args.duration:
+        now = time.perf_counter()
+        for i, sock in enumerate(sockets):
+            if now >= next_send[i]:
+                sock.sendto(header + STAMP.pack(time.perf_counter()) + padding, relay_address)
+                next_send[i] += interval
+                sent += 1
+        timeout = max(0.0, min(next_send) - time.perf_counter())
+        for key, _ in selector.select(timeout=timeout):
+            while True:
+                try:
+                    data = key.fileobj.recv(4096)
+                except BlockingIOError:
+                    break
+                latencies.append(time.perf_counter() - STAMP.unpack_from(data, 1)[0])
+
+    control_w.send(True)
+    timings, stats = parent_pipe.recv()
+    proc.join()
+
+    members = args.speakers / args.rooms
+    expected = sent * (members - 1)
+    print(f"говорящих: {args.speakers}, комнат: {args.rooms}, пакет: {args.payload} байт")
+    print(f"отправлено: {sent} ({sent / args.duration:.0f} пак./с), "
+          f"переслано: {stats['forwarded']} ({stats['forwarded'] / args.duration:.0f} пак./с), "
+          f"получено: {len(latencies)} из {expected:.0f}")
+    print(f"обработка в ретрансляторе, мкс: p50={percentile(timings, 50) * 1e6:.0f} "
+          f"p99={percentile(timings, 99) * 1e6:.0f}")
+    print(f"задержка отправка->прием, мс: p50={percentile(latencies, 50) * 1e3:.2f} "
+          f"p95={percentile(latencies, 95) * 1e3:.2f} p99={percentile(latencies, 99) * 1e3:.2f}")
+
+
+if __name__ == '__main__':
+    main()
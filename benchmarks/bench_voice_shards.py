@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Масштабирование многопроцессной ретрансляции голоса по числу процессов.
+
+Запускает ShardedVoiceRelay с 1, 2, ... обработчиками на одном порту
+(SO_REUSEPORT), регистрирует говорящих в нескольких комнатах и нагружает
+порт из отдельных процессов-генераторов. Суммарная скорость пересылки
+берется из счетчиков обработчиков.
+
+Пример:
+    python benchmarks/bench_voice_shards.py --workers 1 2 4 --speakers 64 --rooms 16
+"""
+
+import argparse
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from voice_relay import PACKET_AUDIO, PACKET_REGISTER  # noqa: E402
+from voice_shards import ShardedVoiceRelay  # noqa: E402
+
+from common import free_port  # noqa: E402
+
+
+def generator(port, tokens, stop, payload):
+    """Процесс-генератор: регистрирует своих говорящих и шлет пакеты без пауз"""
+    address = ('127.0.0.1', port)
+    sockets = []
+    for token in tokens:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(2.0)
+        for _ in range(5):
+            sock.sendto(bytes([PACKET_REGISTER]) + token.encode('ascii'), address)
+            try:
+                sock.recv(16)
+                break
+            except socket.timeout:
+                continue
+        sock.setblocking(False)
+        sockets.append(sock)
+
+    packet = bytes([PACKET_AUDIO]) + b'\0' * payload
+    while not stop.is_set():
+        for sock in sockets:
+            try:
+                sock.sendto(packet, address)
+            except BlockingIOError:
+                pass
+        time.sleep(0.001)
+
+
+def run(workers, speakers, rooms, generators, duration, payload):
+    port = free_port(socket.SOCK_DGRAM)
+    relay = ShardedVoiceRelay('127.0.0.1', port, workers)
+    relay.start()
+    running = True
+    threading.Thread(target=relay.serve, args=(lambda: running,), daemon=True).start()
+    time.sleep(1.0)
+
+    tokens = [relay.issue_token(f'user{i}', f'room{i % rooms}') for i in range(speakers)]
+    stop = multiprocessing.Event()
+    procs = [
+        multiprocessing.Process(target=generator, args=(port, tokens[i::generators], stop, payload))
+        for i in range(generators)
+    ]
+    for proc in procs:
+        proc.start()
+
+    time.sleep(3.0)
+    start_forwarded = relay.stats()['forwarded']
+    start = time.monotonic()
+    time.sleep(duration)
+    forwarded = relay.stats()['forwarded'] - start_forwarded
+    elapsed = time.monotonic() - start
+
+    stop.set()
+    for proc in procs:
+        proc.join()
+    running = False
+    relay.stop()
+    return forwarded / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 2, 4])
+    parser.add_argument('--speakers', type=int, default=64)
+    parser.add_argument('--rooms', type=int, default=16)
+    parser.add_argument('--generators', type=int, default=2)
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--payload', type=int, default=320)
+    args = parser.parse_args()
+
+    print(f"ядер: {os.cpu_count()}, говорящих: {args.speakers}, комнат: {args.rooms}")
+    print(f"{'процессов':>10}{'пересылок/с':>14}{'на процесс':>12}")
+    for workers in args.workers:
+        rate = run(workers, args.speakers, args.rooms, args.generators, args.duration, args.payload)
+        print(f"{workers:>10}{rate:>14.0f}{rate / workers:>12.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+Общие части бенчмарков: сокеты-заглушки, клиенты сервера в этом процессе,
+запуск сервера отдельным процессом и его ресурсы из /proc, перцентили.
+
+Скрипты запускаются как python benchmarks/<имя>.py, поэтому каталог
+benchmarks уже в sys.path и модуль импортируется как common.
+"""
+
+import asyncio
+import os
+import socket
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from connection import ClientConnection  # noqa: E402
+from voice_relay import FLAG_CN, PACKET_REGISTERED, PACKET_VOICE, VOICE_HEADER  # noqa: E402
+
+CLK_TCK = os.sysconf('SC_CLK_TCK')
+
+
+class NullSocket:
+    """Сокет-заглушка, отбрасывающий данные"""
+
+    def sendall(self, data):
+        pass
+
+    def send(self, data, flags=0):
+        return len(data)
+
+    def sendto(self, data, address):
+        return len(data)
+
+    def shutdown(self, how):
+        pass
+
+    def close(self):
+        pass
+
+
+class RecordingSocket(NullSocket):
+    """Сокет-заглушка, запоминающий отправленные пакеты и кадры"""
+
+    def __init__(self):
+        self.packets = []
+
+    def send(self, data, flags=0):
+        self.packets.append(data)
+        return len(data)
+
+    def sendto(self, data, address):
+        self.packets.append(data)
+        return len(data)
+
+
+def add_clients(server, count, rooms=('general',), make_socket=NullSocket):
+    """Клиенты с сокетами make_socket(), по кругу в комнатах rooms"""
+    sockets = []
+    for i in range(count):
+        sock = make_socket()
+        conn = ClientConnection(sock, ('127.0.0.1', i), nonblocking=server.text_loop is not None)
+        conn.framed = True
+        username = f'user{i}'
+        room = rooms[i % len(rooms)]
+        server.connections[sock] = conn
+        server.clients[sock] = {'username': username, 'room': room, 'is_admin': False}
+        server.user_sockets[username] = sock
+        server.add_to_room(sock, username, room)
+        sockets.append(sock)
+    return sockets
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else 0.0
+
+
+def free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_port(port, timeout=10.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f'Сервер не запустился на порту {port}')
+
+
+def proc_status(pid):
+    """RSS (КБ) и число потоков процесса из /proc"""
+    rss = threads = 0
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                rss = int(line.split()[1])
+            elif line.startswith('Threads:'):
+                threads = int(line.split()[1])
+    return rss, threads
+
+
+def proc_rss(pid):
+    """RSS процесса из /proc, КБ"""
+    return proc_status(pid)[0]
+
+
+def proc_cpu(pid):
+    """Суммарное процессорное время процесса в секундах"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK
+
+
+class VoiceProtocol(asyncio.DatagramProtocol):
+    """Голосовой сокет клиента нагрузки: регистрация и пришедшие кадры речи"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, address):
+        kind = data[0] if data else None
+        if kind == PACKET_REGISTERED:
+            self.client.voice_ready.set()
+        elif kind == PACKET_VOICE and len(data) > VOICE_HEADER.size:
+            _, _, _, _, sent_ms, flags = VOICE_HEADER.unpack_from(data)
+            if not flags & FLAG_CN:
+                self.client.voice_received(data, sent_ms)
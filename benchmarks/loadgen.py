@@ -0,0 +1,508 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный прогон сервера: много клиентов на asyncio против server.py.
+
+Запускает server.py в отдельном процессе (для каждого режима из
+--engines и каждого числа клиентов сценария - заново, с пустой базой) и
+подключает к нему клиентов без интерфейса. Каждый клиент проходит
+рукопожатие hello, регистрацию, вход и переходит в свою комнату; затем в
+течение duration секунд (после warmup) делает действия из mix
+пуассоновским потоком со средней частотой actions_per_second:
+
+    chat         сообщение в комнату; в тексте - время отправки, каждый
+                 получатель-сосед по комнате считает задержку доставки
+    get_rooms    запрос-ответ rooms_list
+    get_users    запрос-ответ users_list
+    join_room    переход в случайную комнату сценария (ответ room_joined)
+
+В каждой комнате первые voice.talkers_per_room клиентов непрерывно шлют
+голос по UDP (пакеты VOICE каждые frame_ms), остальные принимают; время в
+заголовке VOICE дает задержку пересылки.
+
+Результат: задержка доставки чата, запросов и голоса (p50/p95/p99,
+мс), сообщений, доставок и пакетов в секунду, время регистрации и входа,
+RSS и загрузка процессора сервера, ошибки и разрывы. В задержку входит и
+планирование самого генератора: на одной машине он делит процессор с
+сервером, поэтому сравнивать режимы стоит только прогонами с одинаковыми
+условиями.
+
+Сценарии - JSON-файлы в benchmarks/scenarios (--scenario имя или путь);
+незаданные поля берутся из DEFAULTS, clients может быть списком - ступени
+нагрузки. Случайность задается seed сценария, поэтому прогоны
+воспроизводимы. --output сохраняет сценарий и результаты в JSON для
+сравнения прогонов.
+
+Пример:
+    python benchmarks/loadgen.py --list
+    python benchmarks/loadgen.py --scenario chat_rooms --engines threaded selector
+    python benchmarks/loadgen.py --scenario smoke --output smoke.json
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'scenarios')
+sys.path.insert(0, ROOT)
+
+from protocol import FrameDecoder, encode_payload, frame_message, hello_message  # noqa: E402
+from voice_relay import (  # noqa: E402
+    FLAG_CN, FLAG_START, PACKET_REGISTER, PACKET_VOICE, VOICE_HEADER,
+)
+
+from common import VoiceProtocol, free_port, percentile, proc_cpu, proc_rss, wait_port  # noqa: E402
+
+CHAT_TAG = 'lg'  # начало текста сообщений генератора: "lg <время отправки> ..."
+ACTIONS = ('chat', 'get_rooms', 'get_users', 'join_room')
+# Тип ответа на запрос действия
+REPLIES = {'rooms_list': 'get_rooms', 'users_list': 'get_users', 'room_joined': 'join_room'}
+SETUP_TIMEOUT = 60.0  # секунд на ответ при регистрации и входе
+DRAIN = 1.0  # секунд после окна на доставку отправленного
+RSS_INTERVAL = 0.5
+VOICE_LEVEL = 60  # дБ в заголовке VOICE
+
+DEFAULTS = {
+    'description': '',
+    'seed': 1,
+    'clients': 50,  # число клиентов или список ступеней
+    'rooms': 2,  # general, room1, ...
+    'engines': ['threaded'],
+    'duration': 20.0,  # секунд замера
+    'warmup': 3.0,  # секунд после входа всех клиентов до замера
+    'setup_concurrency': 8,  # одновременных регистраций и входов
+    'actions_per_second': 0.5,  # на клиента
+    'mix': {'chat': 80, 'get_rooms': 5, 'get_users': 10, 'join_room': 5},
+    'chat_bytes': 64,  # длина текста сообщения
+    'voice': {'talkers_per_room': 0, 'frame_ms': 20, 'frame_bytes': 160},
+    'server_args': [],  # дополнительные аргументы server.py
+}
+
+
+def summary(values):
+    """Задержки в мс: число, p50, p95, p99, максимум"""
+    ordered = sorted(values)
+    return {
+        'count': len(ordered),
+        'p50': round(percentile(ordered, 50) * 1000, 2),
+        'p95': round(percentile(ordered, 95) * 1000, 2),
+        'p99': round(percentile(ordered, 99) * 1000, 2),
+        'max': round(ordered[-1] * 1000, 2) if ordered else 0.0,
+    }
+
+
+def load_scenario(name):
+    """Сценарий по имени из benchmarks/scenarios или по пути, поверх DEFAULTS"""
+    path = name if os.path.exists(name) else os.path.join(SCENARIOS, name + '.json')
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    unknown = set(data) - set(DEFAULTS)
+    if unknown:
+        raise ValueError(f"Неизвестные поля сценария: {', '.join(sorted(unknown))}")
+    scenario = dict(DEFAULTS, **data)
+    scenario['voice'] = dict(DEFAULTS['voice'], **data.get('voice', {}))
+    if set(scenario['mix']) - set(ACTIONS):
+        raise ValueError(f"Действия mix: {', '.join(ACTIONS)}")
+    if isinstance(scenario['clients'], int):
+        scenario['clients'] = [scenario['clients']]
+    scenario['name'] = os.path.splitext(os.path.basename(path))[0]
+    return scenario
+
+
+def list_scenarios():
+    for filename in sorted(os.listdir(SCENARIOS)):
+        if filename.endswith('.json'):
+            scenario = load_scenario(os.path.join(SCENARIOS, filename))
+            print(f"{scenario['name']:<14}{scenario['description']}")
+
+
+def raise_fd_limit():
+    """Каждому клиенту нужны TCP- и UDP-сокет"""
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+class LoadRun:
+    """Общие счетчики и окно замера одного прогона"""
+
+    def __init__(self, scenario, port):
+        self.scenario = scenario
+        self.port = port
+        self.rooms = ['general'] + [f'room{i}' for i in range(1, scenario['rooms'])]
+        self.base = time.monotonic()  # начало отсчета времени в пакетах VOICE
+        self.window = (float('inf'), float('inf'))
+        self.latency = collections.defaultdict(list)  # {вид: [секунды]}
+        self.counts = collections.Counter()
+        self.setup_errors = collections.Counter()
+        self.closing = False
+
+    def measuring(self, sent):
+        """Отправлено ли в окне замера (время по time.monotonic)"""
+        return self.window[0] <= sent < self.window[1]
+
+    def voice_clock(self):
+        """Миллисекунды от начала прогона для поля времени VOICE"""
+        return int((time.monotonic() - self.base) * 1000) & 0xFFFFFFFF
+
+
+class LoadClient:
+    """Клиент без интерфейса: текстовое подключение и, если нужно, голос"""
+
+    def __init__(self, run, index):
+        self.run = run
+        self.index = index
+        self.rng = random.Random(run.scenario['seed'] * 1000003 + index)
+        self.username = f'lg{index}'
+        self.password = f'pw{index}'
+        self.room = run.rooms[index % len(run.rooms)]
+        self.talker = index // len(run.rooms) < run.scenario['voice']['talkers_per_room']
+        self.reader = self.writer = None
+        self.decoder = FrameDecoder()
+        self.hello_done = False
+        self.waiter = None  # (ожидаемые типы, future) на время регистрации и входа
+        self.pending = collections.defaultdict(collections.deque)  # {действие: [время отправки]}
+        self.voice = None  # asyncio.DatagramTransport
+        self.voice_ready = asyncio.Event()
+        self.reading = None
+
+    def voice_received(self, data, sent_ms):
+        run = self.run
+        if run.measuring(run.base + sent_ms / 1000):
+            run.latency['voice'].append(((run.voice_clock() - sent_ms) & 0xFFFFFFFF) / 1000)
+            run.counts['voice_received'] += 1
+
+    def send(self, message):
+        self.writer.write(frame_message(message))
+
+    async def request(self, message, expect):
+        """Отправка и ожидание ответа одного из типов expect или error"""
+        future = asyncio.get_running_loop().create_future()
+        self.waiter = (expect, future)
+        self.send(message)
+        reply = await asyncio.wait_for(future, SETUP_TIMEOUT)
+        if reply.get('type') == 'error':
+            raise RuntimeError(reply.get('message', 'error'))
+        return reply
+
+    async def setup(self, semaphore):
+        """Подключение, регистрация, вход, переход в комнату, привязка голоса"""
+        run = self.run
+        async with semaphore:
+            self.reader, self.writer = await asyncio.open_connection('127.0.0.1', run.port)
+            # hello в старом формате, следующие сообщения сервер читает как кадры
+            self.writer.write(encode_payload(hello_message()))
+            self.reading = asyncio.create_task(self.read_loop())
+            started = time.monotonic()
+            await self.request(
+                {'type': 'register', 'username': self.username, 'password': self.password},
+                ('register_success',)
+            )
+            run.latency['register'].append(time.monotonic() - started)
+            started = time.monotonic()
+            login = await self.request(
+                {'type': 'login', 'username': self.username, 'password': self.password},
+                ('login_success',)
+            )
+            run.latency['login'].append(time.monotonic() - started)
+        if self.room != 'general':
+            await self.request({'type': 'join_room', 'room': self.room}, ('room_joined',))
+        if run.scenario['voice']['talkers_per_room']:
+            await self.connect_voice(login['voice_token'], login['voice_port'])
+
+    async def connect_voice(self, token, port):
+        loop = asyncio.get_running_loop()
+        self.voice, _ = await loop.create_datagram_endpoint(
+            lambda: VoiceProtocol(self), remote_addr=('127.0.0.1', port)
+        )
+        packet = bytes([PACKET_REGISTER]) + token.encode('ascii')
+        for _ in range(10):
+            self.voice.sendto(packet)
+            try:
+                await asyncio.wait_for(self.voice_ready.wait(), 1.0)
+                return
+            except asyncio.TimeoutError:
+                pass
+        raise RuntimeError('голосовой адрес не привязан')
+
+    async def read_loop(self):
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                if not self.hello_done:
+                    messages = self.decoder.feed_legacy(data)
+                    if any(message.get('type') == 'hello' for message in messages):
+                        self.hello_done = True
+                        messages += self.decoder.feed_frames(b'')
+                else:
+                    messages = self.decoder.feed_frames(data)
+                for message in messages:
+                    self.dispatch(message)
+        except (ConnectionError, OSError):
+            pass
+        if not self.run.closing:
+            self.run.counts['disconnects'] += 1
+        if self.waiter is not None and not self.waiter[1].done():
+            self.waiter[1].set_exception(ConnectionError('сервер закрыл подключение'))
+
+    def dispatch(self, message):
+        msg_type = message.get('type')
+        if self.waiter is not None and (msg_type in self.waiter[0] or msg_type == 'error'):
+            expect, future = self.waiter
+            self.waiter = None
+            if not future.done():
+                future.set_result(message)
+            return
+        run = self.run
+        now = time.monotonic()
+        if msg_type == 'chat_message':
+            text = message.get('message', '')
+            if message.get('username') == self.username or not text.startswith(CHAT_TAG):
+                return
+            try:
+                sent = float(text.split(' ', 2)[1])
+            except (IndexError, ValueError):
+                return
+            if run.measuring(sent):
+                run.latency['chat'].append(now - sent)
+                run.counts['chat_delivered'] += 1
+        elif msg_type in REPLIES:
+            action = REPLIES[msg_type]
+            if self.pending[action]:
+                sent = self.pending[action].popleft()
+                if run.measuring(sent):
+                    run.latency[action].append(now - sent)
+        elif msg_type == 'error':
+            run.counts['errors'] += 1
+
+    async def act(self):
+        """Действия mix пуассоновским потоком до конца окна замера"""
+        run = self.run
+        scenario = run.scenario
+        names = list(scenario['mix'])
+        weights = [scenario['mix'][name] for name in names]
+        rate = scenario['actions_per_second']
+        if not rate or not names:
+            return
+        while True:
+            await asyncio.sleep(self.rng.expovariate(rate))
+            now = time.monotonic()
+            if now >= run.window[1] or self.writer.is_closing():
+                return
+            action = self.rng.choices(names, weights)[0]
+            if action == 'chat':
+                text = f'{CHAT_TAG} {now:.6f} '
+                text += 'x' * max(scenario['chat_bytes'] - len(text), 0)
+                self.send({'type': 'chat', 'message': text})
+            elif action == 'join_room':
+                self.room = self.rng.choice(run.rooms)
+                self.pending[action].append(now)
+                self.send({'type': 'join_room', 'room': self.room})
+            else:
+                self.pending[action].append(now)
+                self.send({'type': action})
+            if run.measuring(now):
+                run.counts[action] += 1
+            await self.writer.drain()
+
+    async def talk(self):
+        """Голос без пауз до конца окна: VOICE каждые frame_ms, в конце - CN"""
+        run = self.run
+        voice = run.scenario['voice']
+        interval = voice['frame_ms'] / 1000
+        payload = self.rng.randbytes(voice['frame_bytes'])
+        flags = FLAG_START
+        sequence = 0
+        next_at = time.monotonic()
+        while next_at < run.window[1]:
+            header = VOICE_HEADER.pack(
+                PACKET_VOICE, VOICE_LEVEL, 0, sequence & 0xFFFF, run.voice_clock(), flags
+            )
+            self.voice.sendto(header + payload)
+            if run.measuring(time.monotonic()):
+                run.counts['voice_sent'] += 1
+            flags = 0
+            sequence += 1
+            next_at += interval
+            await asyncio.sleep(max(next_at - time.monotonic(), 0))
+        header = VOICE_HEADER.pack(
+            PACKET_VOICE, VOICE_LEVEL, 0, sequence & 0xFFFF, run.voice_clock(), FLAG_CN
+        )
+        self.voice.sendto(header + bytes([30]))
+
+    async def close(self):
+        if self.voice is not None:
+            self.voice.close()
+        if self.writer is not None:
+            self.writer.close()
+            try:
+                await self.writer.wait_closed()
+            except (ConnectionError, OSError):
+                pass
+        if self.reading is not None:
+            await self.reading
+
+
+async def sample_server(run, pid, stats):
+    """RSS сервера каждые RSS_INTERVAL секунд и процессор за окно замера"""
+    await asyncio.sleep(max(run.window[0] - time.monotonic(), 0))
+    cpu = proc_cpu(pid)
+    started = time.monotonic()
+    while time.monotonic() < run.window[1]:
+        stats['rss_peak'] = max(stats['rss_peak'], proc_rss(pid))
+        await asyncio.sleep(RSS_INTERVAL)
+    stats['rss'] = proc_rss(pid)
+    stats['rss_peak'] = max(stats['rss_peak'], stats['rss'])
+    stats['cpu'] = (proc_cpu(pid) - cpu) / (time.monotonic() - started) * 100
+
+
+async def drive(scenario, count, port, pid):
+    run = LoadRun(scenario, port)
+    clients = [LoadClient(run, i) for i in range(count)]
+    semaphore = asyncio.Semaphore(scenario['setup_concurrency'])
+    started = time.monotonic()
+    results = await asyncio.gather(
+        *(client.setup(semaphore) for client in clients), return_exceptions=True
+    )
+    setup_time = time.monotonic() - started
+    ready = []
+    for client, result in zip(clients, results):
+        if isinstance(result, BaseException):
+            run.setup_errors[str(result) or type(result).__name__] += 1
+        else:
+            ready.append(client)
+
+    window_start = time.monotonic() + scenario['warmup']
+    run.window = (window_start, window_start + scenario['duration'])
+    server = {'rss_peak': 0, 'rss': 0, 'cpu': 0.0}
+    tasks = [client.act() for client in ready]
+    tasks += [client.talk() for client in ready if client.talker and client.voice is not None]
+    await asyncio.gather(sample_server(run, pid, server), *tasks)
+    await asyncio.sleep(DRAIN)
+    run.closing = True
+    await asyncio.gather(*(client.close() for client in clients), return_exceptions=True)
+
+    duration = scenario['duration']
+    counts = run.counts
+    return {
+        'clients': count,
+        'connected': len(ready),
+        'setup_errors': dict(run.setup_errors),
+        'setup_s': round(setup_time, 2),
+        'register': summary(run.latency['register']),
+        'login': summary(run.latency['login']),
+        'chat': summary(run.latency['chat']),
+        'chat_sent_per_s': round(counts['chat'] / duration, 1),
+        'chat_delivered_per_s': round(counts['chat_delivered'] / duration, 1),
+        'requests': {action: summary(run.latency[action]) for action in ACTIONS if action != 'chat'},
+        'requests_per_s': round(sum(counts[a] for a in ACTIONS if a != 'chat') / duration, 1),
+        'voice': summary(run.latency['voice']),
+        'voice_sent_per_s': round(counts['voice_sent'] / duration, 1),
+        'voice_received_per_s': round(counts['voice_received'] / duration, 1),
+        'errors': counts['errors'],
+        'disconnects': counts['disconnects'],
+        'server_rss_mb': round(server['rss'] / 1024, 1),
+        'server_rss_peak_mb': round(server['rss_peak'] / 1024, 1),
+        'server_cpu_pct': round(server['cpu'], 1),
+    }
+
+
+def run(scenario, engine, count):
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix='voicechat-load-')
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT, 'server.py'), '--engine', engine,
+         '--host', '127.0.0.1', '--text-port', str(port), '--voice-port', str(free_port()),
+         *scenario['server_args']],
+        cwd=workdir, stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_port(port)
+        time.sleep(0.5)
+        result = asyncio.run(drive(scenario, count, port, proc.pid))
+        result['engine'] = engine
+        return result
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+def print_header():
+    print(f"{'клиенты':>8}  {'режим':<10}{'чат/с':>7}{'доставок/с':>11}"
+          f"{'чат p50':>9}{'p95':>7}{'p99':>7}{'запросы p99':>12}"
+          f"{'голос p50':>10}{'p99':>7}{'пакетов/с':>10}"
+          f"{'RSS, МБ':>9}{'CPU, %':>8}{'ошибок':>8}{'разрывов':>9}")
+
+
+def print_result(r):
+    requests_p99 = max((s['p99'] for s in r['requests'].values()), default=0.0)
+    print(f"{r['clients']:>8}  {r['engine']:<10}{r['chat_sent_per_s']:>7.0f}"
+          f"{r['chat_delivered_per_s']:>11.0f}{r['chat']['p50']:>9.1f}{r['chat']['p95']:>7.1f}"
+          f"{r['chat']['p99']:>7.1f}{requests_p99:>12.1f}{r['voice']['p50']:>10.1f}"
+          f"{r['voice']['p99']:>7.1f}{r['voice_received_per_s']:>10.0f}"
+          f"{r['server_rss_peak_mb']:>9.1f}{r['server_cpu_pct']:>8.0f}{r['errors']:>8}"
+          f"{r['disconnects']:>9}")
+    if r['connected'] < r['clients']:
+        reasons = ', '.join(f'{reason}: {n}' for reason, n in r['setup_errors'].items())
+        print(f"{'':>10}не вошли {r['clients'] - r['connected']}: {reasons}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--scenario', default='smoke', help='имя из benchmarks/scenarios или путь')
+    parser.add_argument('--engines', nargs='+', choices=('threaded', 'selector'),
+                        help='режимы сервера, по умолчанию - из сценария')
+    parser.add_argument('--clients', nargs='+', type=int, help='ступени вместо сценария')
+    parser.add_argument('--duration', type=float, help='секунд замера вместо сценария')
+    parser.add_argument('--output', help='JSON-файл со сценарием и результатами')
+    parser.add_argument('--list', action='store_true', help='список сценариев')
+    args = parser.parse_args()
+
+    if args.list:
+        list_scenarios()
+        return
+    try:
+        scenario = load_scenario(args.scenario)
+    except (OSError, ValueError) as e:
+        parser.error(f"сценарий {args.scenario}: {e}")
+    if args.engines:
+        scenario['engines'] = args.engines
+    if args.clients:
+        scenario['clients'] = args.clients
+    if args.duration:
+        scenario['duration'] = args.duration
+    raise_fd_limit()
+
+    print(f"сценарий {scenario['name']}: {scenario['description']}")
+    print(f"комнат: {scenario['rooms']}, действий в секунду на клиента: "
+          f"{scenario['actions_per_second']}, говорящих в комнате: "
+          f"{scenario['voice']['talkers_per_room']}, замер {scenario['duration']:.0f} с, "
+          f"ядер: {os.cpu_count()}")
+    print("задержки - мс, RSS - пик за окно замера")
+    print_header()
+    results = []
+    for count in scenario['clients']:
+        for engine in scenario['engines']:
+            result = run(scenario, engine, count)
+            print_result(result)
+            results.append(result)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'scenario': scenario, 'cpus': os.cpu_count(), 'results': results},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,490 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Воспроизведение записанного трафика против одной или двух сборок сервера.
+
+Запись делает сам сервер (python server.py --capture FILE, формат - в
+traffic_capture.py): подключения, входящие сообщения и сведения о
+голосовых пакетах с временем. Здесь для каждой сборки из --builds
+(каталог с server.py; по умолчанию - этот) запускается server.py в
+отдельном процессе с одинаковой заранее подготовленной базой, и запись
+проигрывается:
+
+    --speed 1      в исходном темпе
+    --speed 10     в 10 раз быстрее
+    --speed max    без пауз между записями
+
+Каждое подключение записи - отдельное подключение к серверу, его записи
+идут строго по порядку. Паролей в записи нет: пользователи, которые
+входят, не регистрируясь в самой записи, заранее создаются в базе с
+паролем replay-<имя>, и тот же пароль подставляется в login и register.
+Голос: после login_success подключение, у которого в записи есть
+голосовые пакеты, привязывает UDP-адрес и шлет пакеты того же типа,
+размера и флагов; в VOICE - время отправки, получатели считают задержку.
+Пакеты, до которых вход еще не завершился (при ускорении вход отстает от
+записи), не отправляются и считаются в voice_skipped.
+
+Задержка - от отправки запроса до ответа на него (login -
+login_success, chat - возврат своего сообщения, join_room - room_joined
+и т.д.); error засчитывается самому старому ожидающему запросу
+подключения. Результаты группируются по фазам - отрезкам записи по
+--phase-seconds, фаза подписана преобладающим в ней типом сообщений
+(волна входов - login, переходы - join_room, шквал чата - chat). Для двух
+сборок выводятся обе и разница: p99 и ошибки второй минус первой.
+
+Пример:
+    python server.py --capture evening.vcap
+    python benchmarks/replay.py evening.vcap --speed 10
+    python benchmarks/replay.py evening.vcap --speed max --builds ../ts-main .
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from auth import hash_password  # noqa: E402
+from config import SECURITY_CONFIG  # noqa: E402
+from protocol import FrameDecoder, encode_payload, frame_message, hello_message  # noqa: E402
+from storage import Storage  # noqa: E402
+from traffic_capture import CONNECT, DISCONNECT, MESSAGE, VOICE, read_capture  # noqa: E402
+from voice_relay import PACKET_REGISTER, PACKET_VOICE, VOICE_HEADER  # noqa: E402
+
+from common import VoiceProtocol, free_port, percentile, proc_cpu, proc_rss, wait_port  # noqa: E402
+
+# Ответ, которым завершается запрос
+EXPECT = {
+    'login': 'login_success',
+    'register': 'register_success',
+    'join_room': 'room_joined',
+    'create_room': 'room_created',
+    'get_rooms': 'rooms_list',
+    'get_users': 'users_list',
+    'get_history': 'history',
+    'chat': 'chat_message',
+    'admin_command': 'admin_response',
+}
+REQUEST_OF = {reply: request for request, reply in EXPECT.items()}
+Phase = collections.namedtuple('Phase', 'index start end label messages')
+
+
+def replay_password(username):
+    return f'replay-{username}'
+
+
+def analyze(records, phase_seconds):
+    """Фазы записи, пользователи для базы и подключения с голосом"""
+    types = collections.defaultdict(collections.Counter)
+    registered = set()
+    users = set()
+    voice_connections = set()
+    for kind, t, conn_id, payload in records:
+        if kind == MESSAGE:
+            msg_type = payload.get('type')
+            if msg_type != 'hello':
+                types[int(t // phase_seconds)][msg_type] += 1
+            username = payload.get('username')
+            if msg_type == 'register' and isinstance(username, str):
+                registered.add(username)
+            elif msg_type == 'login' and isinstance(username, str) and username not in registered:
+                users.add(username)
+        elif kind == VOICE:
+            voice_connections.add(conn_id)
+    last = int(records[-1][1] // phase_seconds) if records else 0
+    phases = []
+    for index in range(last + 1):
+        counts = types.get(index, collections.Counter())
+        label = counts.most_common(1)[0][0] if counts else '-'
+        phases.append(Phase(index, index * phase_seconds, (index + 1) * phase_seconds,
+                            label, sum(counts.values())))
+    return phases, sorted(users), voice_connections
+
+
+def seed_database(directory, users):
+    """База с пользователями записи (пароль replay-<имя>), общая для сборок"""
+    os.makedirs(directory)
+    storage = Storage(os.path.join(directory, 'users.db'))
+    admin = SECURITY_CONFIG['admin_username']
+    for username in users:
+        password_hash = hash_password(replay_password(username))
+        storage.create_user(username, password_hash, is_admin=username == admin).result()
+    storage.close()
+
+
+class PhaseStats:
+    """Задержки и ошибки одной фазы по типам запросов"""
+
+    def __init__(self):
+        self.latency = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.sent = 0
+        self.voice = []
+        self.voice_sent = 0
+
+
+class Replay:
+    """Общее состояние проигрывания одной сборки"""
+
+    def __init__(self, phases, phase_seconds, port, voice_connections):
+        self.phases = [PhaseStats() for _ in phases]
+        self.phase_seconds = phase_seconds
+        self.port = port
+        self.voice_connections = voice_connections
+        self.base = time.monotonic()
+        self.counts = collections.Counter()
+
+    def phase_index(self, t):
+        return min(int(t // self.phase_seconds), len(self.phases) - 1)
+
+    def phase(self, t):
+        return self.phases[self.phase_index(t)]
+
+    def voice_clock(self):
+        return int((time.monotonic() - self.base) * 1000) & 0xFFFFFFFF
+
+
+class ReplayConnection:
+    """Одно подключение записи: свои записи по порядку в отдельной задаче"""
+
+    def __init__(self, replay, conn_id):
+        self.replay = replay
+        self.conn_id = conn_id
+        self.inbox = asyncio.Queue()
+        self.reader = self.writer = None
+        self.decoder = FrameDecoder()
+        self.hello_done = False
+        self.username = None
+        self.pending = collections.defaultdict(collections.deque)  # {тип: [(время, фаза)]}
+        self.voice = None
+        self.voice_ready = asyncio.Event()
+        self.sequence = 0
+        self.tasks = []
+        self.task = asyncio.create_task(self.run())
+
+    def voice_received(self, data, sent_ms):
+        if len(data) < VOICE_HEADER.size + 2:
+            return
+        # Номер фазы отправитель кладет в начало данных кадра
+        index = int.from_bytes(data[VOICE_HEADER.size:VOICE_HEADER.size + 2], 'big')
+        if index < len(self.replay.phases):
+            delay = ((self.replay.voice_clock() - sent_ms) & 0xFFFFFFFF) / 1000
+            self.replay.phases[index].voice.append(delay)
+
+    async def run(self):
+        while True:
+            item = await self.inbox.get()
+            if item is None:
+                return
+            kind, t, payload = item
+            try:
+                if kind == CONNECT:
+                    await self.connect()
+                elif kind == MESSAGE:
+                    await self.send(t, payload)
+                elif kind == VOICE:
+                    self.send_voice(t, payload)
+                elif kind == DISCONNECT:
+                    self.close()
+            except (ConnectionError, OSError):
+                self.replay.phase(t).errors['connection'] += 1
+                self.close()
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.replay.port)
+        self.writer.write(encode_payload(hello_message()))
+        self.tasks.append(asyncio.create_task(self.read_loop()))
+
+    async def send(self, t, message):
+        msg_type = message.get('type')
+        if msg_type == 'hello':
+            return
+        if self.writer is None or self.writer.is_closing():
+            self.replay.counts['skipped'] += 1
+            return
+        if msg_type in ('login', 'register') and isinstance(message.get('username'), str):
+            message = dict(message, password=replay_password(message['username']))
+        phase = self.replay.phase(t)
+        phase.sent += 1
+        if msg_type in EXPECT:
+            self.pending[msg_type].append((time.monotonic(), phase))
+        self.writer.write(frame_message(message))
+        await self.writer.drain()
+
+    def send_voice(self, t, info):
+        kind, size, flags = info
+        if not self.voice_ready.is_set():
+            self.replay.counts['voice_skipped'] += 1
+            return
+        index = self.replay.phase_index(t)
+        if kind == PACKET_VOICE:
+            header = VOICE_HEADER.pack(
+                kind, 60, 0, self.sequence & 0xFFFF, self.replay.voice_clock(), flags
+            )
+            packet = header + index.to_bytes(2, 'big') + bytes(max(size - len(header) - 2, 0))
+        else:
+            packet = bytes([kind]) + bytes(max(size - 1, 0))
+        self.sequence += 1
+        self.voice.sendto(packet)
+        self.replay.phases[index].voice_sent += 1
+
+    async def connect_voice(self, token, port):
+        loop = asyncio.get_running_loop()
+        self.voice, _ = await loop.create_datagram_endpoint(
+            lambda: VoiceProtocol(self), remote_addr=('127.0.0.1', port)
+        )
+        packet = bytes([PACKET_REGISTER]) + token.encode('ascii')
+        for _ in range(10):
+            self.voice.sendto(packet)
+            try:
+                await asyncio.wait_for(self.voice_ready.wait(), 1.0)
+                return
+            except asyncio.TimeoutError:
+                pass
+
+    async def read_loop(self):
+        try:
+            while True:
+                data = await self.reader.read(65536)
+                if not data:
+                    break
+                if not self.hello_done:
+                    messages = self.decoder.feed_legacy(data)
+                    if any(message.get('type') == 'hello' for message in messages):
+                        self.hello_done = True
+                        messages += self.decoder.feed_frames(b'')
+                else:
+                    messages = self.decoder.feed_frames(data)
+                for message in messages:
+                    self.dispatch(message)
+        except (ConnectionError, OSError):
+            pass
+
+    def dispatch(self, message):
+        msg_type = message.get('type')
+        if msg_type == 'chat_message' and message.get('username') != self.username:
+            return
+        if msg_type == 'login_success':
+            self.username = message.get('username')
+            if self.conn_id in self.replay.voice_connections and message.get('voice_token'):
+                self.tasks.append(asyncio.create_task(
+                    self.connect_voice(message['voice_token'], message['voice_port'])
+                ))
+        if msg_type == 'error':
+            # Ошибка - ответ на самый старый ожидающий запрос
+            waiting = [(queue[0][0], request) for request, queue in self.pending.items() if queue]
+            if not waiting:
+                self.replay.counts['unmatched_errors'] += 1
+                return
+            request = min(waiting)[1]
+            _, phase = self.pending[request].popleft()
+            phase.errors[request] += 1
+            return
+        request = REQUEST_OF.get(msg_type)
+        if request is not None and self.pending[request]:
+            sent, phase = self.pending[request].popleft()
+            phase.latency[request].append(time.monotonic() - sent)
+
+    def close(self):
+        if self.writer is not None and not self.writer.is_closing():
+            self.writer.close()
+        if self.voice is not None:
+            self.voice.close()
+
+    def unanswered(self):
+        return sum(len(queue) for queue in self.pending.values())
+
+
+async def play(records, phases, phase_seconds, speed, port, voice_connections, drain):
+    replay = Replay(phases, phase_seconds, port, voice_connections)
+    connections = {}
+    started = time.monotonic()
+    for kind, t, conn_id, payload in records:
+        if speed:
+            delay = started + t / speed - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        connection = connections.get(conn_id)
+        if connection is None:
+            if kind != CONNECT:
+                continue
+            connection = connections[conn_id] = ReplayConnection(replay, conn_id)
+        connection.inbox.put_nowait((kind, t, payload))
+    for connection in connections.values():
+        connection.inbox.put_nowait(None)
+    await asyncio.gather(*(connection.task for connection in connections.values()))
+    elapsed = time.monotonic() - started
+    deadline = time.monotonic() + drain
+    while time.monotonic() < deadline and any(c.unanswered() for c in connections.values()):
+        await asyncio.sleep(0.05)
+    for connection in connections.values():
+        connection.close()
+        replay.counts['unanswered'] += connection.unanswered()
+    tasks = [task for connection in connections.values() for task in connection.tasks]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    return replay, elapsed
+
+
+def phase_summary(stats):
+    latency = [value for values in stats.latency.values() for value in values]
+    return {
+        'sent': stats.sent,
+        'answered': len(latency),
+        'p50': round(percentile(latency, 50) * 1000, 2),
+        'p99': round(percentile(latency, 99) * 1000, 2),
+        'errors': sum(stats.errors.values()),
+        'voice_sent': stats.voice_sent,
+        'voice_p99': round(percentile(stats.voice, 99) * 1000, 2),
+    }
+
+
+def run(build, args, records, phases, voice_connections, seed_dir):
+    port = free_port()
+    workdir = tempfile.mkdtemp(prefix='voicechat-replay-')
+    shutil.copytree(seed_dir, os.path.join(workdir, 'server_data'))
+    proc = subprocess.Popen(
+        [sys.executable, os.path.join(build, 'server.py'), '--engine', args.engine,
+         '--host', '127.0.0.1', '--text-port', str(port), '--voice-port', str(free_port())],
+        cwd=workdir, stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    try:
+        wait_port(port)
+        time.sleep(0.5)
+        cpu_start = proc_cpu(proc.pid)
+        replay, elapsed = asyncio.run(play(
+            records, phases, args.phase_seconds, args.speed, port, voice_connections, args.drain
+        ))
+        rss, cpu_end = proc_rss(proc.pid), proc_cpu(proc.pid)
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    by_type = collections.defaultdict(list)
+    errors = collections.Counter()
+    for stats in replay.phases:
+        for request, values in stats.latency.items():
+            by_type[request].extend(values)
+        errors.update(stats.errors)
+    return {
+        'build': build,
+        'elapsed': round(elapsed, 2),
+        'server_cpu_s': round(cpu_end - cpu_start, 2),
+        'server_rss_mb': round(rss / 1024, 1),
+        'counts': dict(replay.counts),
+        'phases': [phase_summary(stats) for stats in replay.phases],
+        'types': {
+            request: {
+                'count': len(values),
+                'p50': round(percentile(values, 50) * 1000, 2),
+                'p99': round(percentile(values, 99) * 1000, 2),
+                'errors': errors[request],
+            }
+            for request, values in sorted(by_type.items())
+        },
+    }
+
+
+def print_results(phases, results):
+    names = [os.path.basename(os.path.abspath(r['build'])) or r['build'] for r in results]
+    for name, r in zip(names, results):
+        counts = ', '.join(f'{key}: {value}' for key, value in sorted(r['counts'].items()))
+        print(f"{name}: проигрывание {r['elapsed']:.1f} с, CPU сервера {r['server_cpu_s']:.1f} с, "
+              f"RSS {r['server_rss_mb']:.1f} МБ{'; ' + counts if counts else ''}")
+
+    print("\nпо фазам (задержки - мс):")
+    header = f"{'фаза, с':>11}  {'преобладает':<14}{'сообщ.':>7}"
+    for name in names:
+        header += f"{'p50':>8}{'p99':>8}{'ошибок':>7}{'голос p99':>10}"
+    if len(results) == 2:
+        header += f"{'Δ p99':>8}{'Δ ошибок':>9}"
+    print(header)
+    for phase in phases:
+        line = f"{phase.start:>5.0f}-{phase.end:<5.0f}  {phase.label:<14}{phase.messages:>7}"
+        rows = [r['phases'][phase.index] for r in results]
+        for row in rows:
+            line += f"{row['p50']:>8.1f}{row['p99']:>8.1f}{row['errors']:>7}{row['voice_p99']:>10.1f}"
+        if len(rows) == 2:
+            line += f"{rows[1]['p99'] - rows[0]['p99']:>+8.1f}{rows[1]['errors'] - rows[0]['errors']:>+9}"
+        print(line)
+
+    print("\nпо типам запросов:")
+    header = f"{'тип':<15}"
+    for name in names:
+        header += f"{'число':>7}{'p50':>8}{'p99':>8}{'ошибок':>7}"
+    if len(results) == 2:
+        header += f"{'Δ p99':>8}{'Δ ошибок':>9}"
+    print(header)
+    empty = {'count': 0, 'p50': 0.0, 'p99': 0.0, 'errors': 0}
+    for request in sorted(set().union(*(r['types'] for r in results))):
+        rows = [r['types'].get(request, empty) for r in results]
+        line = f"{request:<15}"
+        for row in rows:
+            line += f"{row['count']:>7}{row['p50']:>8.1f}{row['p99']:>8.1f}{row['errors']:>7}"
+        if len(rows) == 2:
+            line += f"{rows[1]['p99'] - rows[0]['p99']:>+8.1f}{rows[1]['errors'] - rows[0]['errors']:>+9}"
+        print(line)
+
+
+def parse_speed(value):
+    if value == 'max':
+        return 0.0
+    speed = float(value)
+    if speed <= 0:
+        raise argparse.ArgumentTypeError('скорость - положительное число или max')
+    return speed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('capture', help='файл записи (server.py --capture)')
+    parser.add_argument('--speed', type=parse_speed, default=1.0,
+                        help='во сколько раз быстрее записи, max - без пауз')
+    parser.add_argument('--builds', nargs='+', default=[ROOT],
+                        help='каталоги сборок с server.py (одна или две для сравнения)')
+    parser.add_argument('--engine', choices=('threaded', 'selector'), default='threaded')
+    parser.add_argument('--phase-seconds', type=float, default=10.0,
+                        help='длина фазы в секундах записи')
+    parser.add_argument('--drain', type=float, default=30.0,
+                        help='секунд ожидания оставшихся ответов после последней записи, не больше')
+    parser.add_argument('--output', help='JSON-файл с результатами')
+    args = parser.parse_args()
+    if len(args.builds) > 2:
+        parser.error('сравниваются не больше двух сборок')
+    # server.py запускается из временного каталога
+    args.builds = [os.path.abspath(build) for build in args.builds]
+
+    records = list(read_capture(args.capture))
+    if not records:
+        parser.error(f'{args.capture}: нет записей')
+    phases, users, voice_connections = analyze(records, args.phase_seconds)
+    connections = sum(1 for record in records if record[0] == CONNECT)
+    print(f"запись: {len(records)} записей, подключений {connections}, "
+          f"{records[-1][1]:.1f} с, фаз {len(phases)}; скорость "
+          f"{'max' if not args.speed else f'{args.speed:g}x'}, режим {args.engine}")
+
+    seed_dir = os.path.join(tempfile.mkdtemp(prefix='voicechat-replay-seed-'), 'server_data')
+    print(f"подготовка базы: {len(users)} пользователей")
+    seed_database(seed_dir, users)
+    results = [run(build, args, records, phases, voice_connections, seed_dir) for build in args.builds]
+    print_results(phases, results)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'capture': args.capture, 'speed': args.speed or 'max', 'engine': args.engine,
+                'phases': [phase._asdict() for phase in phases], 'results': results,
+            }, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,329 @@
+"""
+История текстового чата по комнатам.
+
+Сообщение получает номер (id) сразу при отправке и попадает в кольцевой
+буфер комнаты в памяти (ROOM_CONFIG['history_ring'] последних
+сообщений) - оттуда берутся последние сообщения для room_joined, без
+обращения к базе. В базу сообщения пишутся пачками: append только
+добавляет сообщение в очередь, поток БД (storage.Storage) забирает всю
+очередь одной операцией executemany, пока рассылка идет дальше. Очередь
+ограничена history_queue_limit: если база не успевает, самые старые
+незаписанные сообщения отбрасываются (они остаются в буфере комнаты) и
+учитываются в счетчике dropped.
+
+Более старые сообщения читаются страницами по курсору: page(room,
+before=id) возвращает до limit сообщений с номером меньше before, от
+старых к новым. После перезапуска буфер комнаты заполняется из базы при
+первом обращении.
+
+Поиск (search) идет по записанным в базу сообщениям через полнотекстовый
+индекс FTS5 (storage.FULLTEXT_SCHEMA), который обновляется триггером при
+каждой записи пачки. Фильтры по комнате, автору и времени, результаты от
+новых к старым, следующая страница - по курсору before. Время
+переводится в границы id по индексу created: номера и время сообщений
+растут вместе, а диапазон rowid FTS5 проверяет без перебора.
+"""
+
+import collections
+import logging
+import re
+import threading
+import time
+from datetime import datetime
+
+from config import ROOM_CONFIG
+
+SELECT_LAST_ID = 'SELECT MAX(id) FROM messages'
+SELECT_PAGE = (
+    'SELECT id, username, message, created FROM messages '
+    'WHERE room = ? AND id < ? ORDER BY id DESC LIMIT ?'
+)
+INSERT_MESSAGE = 'INSERT INTO messages (id, room, username, message, created) VALUES (?, ?, ?, ?, ?)'
+# MIN(id)/MAX(id) SQLite считает перебором по id, поэтому - по индексу created
+SELECT_FIRST_SINCE = 'SELECT id FROM messages WHERE created >= ? ORDER BY created LIMIT 1'
+SELECT_LAST_BEFORE = 'SELECT id FROM messages WHERE created < ? ORDER BY created DESC LIMIT 1'
+COUNT_SCOPE = {
+    'username': 'SELECT COUNT(*) FROM (SELECT 1 FROM messages WHERE username = ? AND id BETWEEN ? AND ? LIMIT ?)',
+    'room': 'SELECT COUNT(*) FROM (SELECT 1 FROM messages WHERE room = ? AND id BETWEEN ? AND ? LIMIT ?)',
+}
+
+SEARCH_LIMIT = 100  # результатов на странице поиска, не больше
+# Автор или комната, у которых в диапазоне не больше стольких сообщений,
+# перебираются по своему индексу с проверкой каждого сообщения в FTS5:
+# иначе частое слово заставило бы пройти весь его список ради пары
+# совпадений у редкого автора
+SCOPE_SCAN = 1000
+_QUERY_TERM = re.compile(r'"([^"]*)"|(\S+)')
+_WORD = re.compile(r'\w+', re.UNICODE)
+_RELATIVE = re.compile(r'^(\d+(?:\.\d+)?)\s*([mhdw])$')
+_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+
+
+def parse_time(value, now=None):
+    """Граница поиска по времени -> unix-время.
+
+    Число - unix-время; '30m', '12h', '7d', '2w' - столько назад от now;
+    строка ISO - '2024-05-01' или '2024-05-01 18:30' (местное время).
+    """
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    text = str(value).strip()
+    relative = _RELATIVE.match(text)
+    if relative:
+        if now is None:
+            now = time.time()
+        return now - float(relative.group(1)) * _UNITS[relative.group(2)]
+    try:
+        return float(text)
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(text).timestamp()
+    except ValueError:
+        raise ValueError(f"Неверное время: {value}")
+
+
+def match_expression(text):
+    """Запрос пользователя -> выражение FTS5.
+
+    Слова ищутся все сразу (AND), "фраза в кавычках" - подряд, слово* -
+    по началу (не короче двух букв). Служебный синтаксис FTS5 из запроса
+    не передается.
+    """
+    terms = []
+    text = text.replace('ё', 'е').replace('Ё', 'Е')
+    for phrase, word in _QUERY_TERM.findall(text):
+        words = _WORD.findall(phrase or word)
+        if not words:
+            continue
+        term = '"' + ' '.join(words) + '"'
+        if word.endswith('*') and len(words) == 1 and len(words[0]) >= 2:
+            term += '*'
+        terms.append(term)
+    return ' '.join(terms)
+
+
+def _entry(message_id, room, username, text, created):
+    """Сообщение в том виде, в каком его получают клиенты"""
+    return {
+        'type': 'chat_message',
+        'id': message_id,
+        'username': username,
+        'message': text,
+        'room': room,
+        'timestamp': datetime.fromtimestamp(created).strftime('%H:%M:%S'),
+        'created': created,
+    }
+
+
+class ChatHistory:
+    """Кольцевые буферы комнат и пакетная запись сообщений в базу"""
+
+    def __init__(self, storage, ring_size=ROOM_CONFIG['history_ring'],
+                 queue_limit=ROOM_CONFIG['history_queue_limit']):
+        self.storage = storage
+        self.ring_size = ring_size
+        self.queue_limit = queue_limit
+        self.lock = threading.Lock()
+        self.rings = {}  # {room: deque последних сообщений}
+        self.pending = collections.deque()  # ждут записи в базу
+        self.writing = []  # забраны потоком БД, но еще не зафиксированы
+        self.flush_scheduled = False
+        self.last_id = storage.query_one(SELECT_LAST_ID)[0] or 0
+        self.appended = 0
+        self.stored = 0
+        self.dropped = 0
+        self.batches = 0
+
+    def append(self, room, username, text, created=None):
+        """Новое сообщение комнаты: готовый payload chat_message с id"""
+        if created is None:
+            created = time.time()
+        self._ring(room)
+        with self.lock:
+            self.last_id += 1
+            entry = _entry(self.last_id, room, username, text, created)
+            self.rings[room].append(entry)
+            self.pending.append(entry)
+            self.appended += 1
+            if len(self.pending) > self.queue_limit:
+                self.pending.popleft()
+                self.dropped += 1
+            schedule = not self.flush_scheduled
+            self.flush_scheduled = True
+        if schedule:
+            self.storage.submit(self._flush, self._flushed)
+        return entry
+
+    def recent(self, room, limit=ROOM_CONFIG['history_on_join']):
+        """Последние limit сообщений комнаты, от старых к новым"""
+        ring = self._ring(room)
+        with self.lock:
+            entries = list(ring)
+        return entries[-limit:] if limit else []
+
+    def page(self, room, before=None, limit=ROOM_CONFIG['history_page']):
+        """До limit сообщений с id < before, от старых к новым, и есть ли еще"""
+        ring = self._ring(room)
+        with self.lock:
+            entries = [entry for entry in ring if before is None or entry['id'] < before]
+        entries = entries[-(limit + 1):]
+        if len(entries) <= limit:
+            # Буфера не хватило: более старые - из базы
+            start = entries[0]['id'] if entries else before
+            entries = self._older(room, start, limit + 1 - len(entries)) + entries
+        return entries[-limit:], len(entries) > limit
+
+    def search(self, query='', room=None, username=None, since=None, until=None,
+               before=None, limit=SEARCH_LIMIT):
+        """Поиск по истории: (сообщения от новых к старым, есть ли еще).
+
+        since/until - время (unix), before - id, с которого продолжать.
+        Без текста запроса нужен хотя бы один фильтр.
+        """
+        conditions = []
+        params = []
+        expression = match_expression(query or '')
+        if query and not expression:
+            return [], False
+        if not expression and room is None and username is None:
+            raise ValueError("Укажите текст запроса, комнату или пользователя")
+
+        # Время -> границы id (номера растут вместе со временем)
+        low = high = None
+        if since is not None:
+            low = self._id_at(SELECT_FIRST_SINCE, since)
+            if low is None:
+                return [], False
+        if until is not None:
+            high = self._id_at(SELECT_LAST_BEFORE, until)
+            if high is None:
+                return [], False
+        if before is not None:
+            high = min(high, before - 1) if high is not None else before - 1
+
+        fulltext = expression and self.storage.fulltext
+        key = 'm.id'
+        source = 'messages m'
+        if fulltext and self._small_scope(room, username, low, high):
+            conditions.append(
+                'EXISTS (SELECT 1 FROM messages_fts WHERE messages_fts MATCH ? AND rowid = m.id)'
+            )
+            params.append(expression)
+        elif fulltext:
+            key = 'f.rowid'
+            source = 'messages_fts f JOIN messages m ON m.id = f.rowid'
+            conditions.append('messages_fts MATCH ?')
+            params.append(expression)
+        else:
+            for word in _WORD.findall(query or ''):
+                conditions.append("m.message LIKE ? ESCAPE '\\'")
+                params.append('%' + re.sub(r'([%_\\])', r'\\\1', word) + '%')
+        if room is not None:
+            conditions.append('m.room = ?')
+            params.append(room)
+        if username is not None:
+            conditions.append('m.username = ?')
+            params.append(username)
+        if low is not None:
+            conditions.append(f'{key} >= ?')
+            params.append(low)
+        if high is not None:
+            conditions.append(f'{key} <= ?')
+            params.append(high)
+
+        limit = max(1, min(limit, SEARCH_LIMIT))
+        sql = (
+            f'SELECT m.id, m.room, m.username, m.message, m.created FROM {source} '
+            f'WHERE {" AND ".join(conditions)} ORDER BY {key} DESC LIMIT ?'
+        )
+        rows = self.storage.query_all(sql, params + [limit + 1])
+        results = []
+        for message_id, message_room, author, text, created in rows[:limit]:
+            entry = _entry(message_id, message_room, author, text, created)
+            entry['date'] = datetime.fromtimestamp(created).strftime('%Y-%m-%d %H:%M:%S')
+            results.append(entry)
+        return results, len(rows) > limit
+
+    def _id_at(self, sql, moment):
+        row = self.storage.query_one(sql, (moment,))
+        return row[0] if row else None
+
+    def _small_scope(self, room, username, low, high):
+        """Сообщений автора (или комнаты) в диапазоне id не больше SCOPE_SCAN"""
+        column, value = ('username', username) if username is not None else ('room', room)
+        if value is None:
+            return False
+        count = self.storage.query_one(COUNT_SCOPE[column], (
+            value, low if low is not None else 0,
+            high if high is not None else self.last_id, SCOPE_SCAN + 1
+        ))[0]
+        return count <= SCOPE_SCAN
+
+    def _ring(self, room):
+        """Буфер комнаты; при первом обращении заполняется из базы"""
+        ring = self.rings.get(room)
+        if ring is not None:
+            return ring
+        loaded = self._load(room, None, self.ring_size)
+        with self.lock:
+            ring = self.rings.get(room)
+            if ring is None:
+                ring = self.rings[room] = collections.deque(loaded, maxlen=self.ring_size)
+        return ring
+
+    def _older(self, room, before, limit):
+        """limit сообщений старше before из базы и еще не записанных"""
+        with self.lock:
+            waiting = [
+                entry for entry in self.writing + list(self.pending)
+                if entry['room'] == room and (before is None or entry['id'] < before)
+            ]
+        if len(waiting) >= limit:
+            return waiting[-limit:]
+        start = waiting[0]['id'] if waiting else before
+        return self._load(room, start, limit - len(waiting)) + waiting
+
+    def _load(self, room, before, limit):
+        if limit <= 0:
+            return []
+        rows = self.storage.query_all(
+            SELECT_PAGE, (room, before if before is not None else self.last_id + 1, limit)
+        )
+        return [_entry(message_id, room, username, text, created)
+                for message_id, username, text, created in reversed(rows)]
+
+    def _flush(self, conn):
+        """Запись всей очереди одной операцией (выполняется в потоке БД)"""
+        with self.lock:
+            batch = self.writing = list(self.pending)
+            self.pending.clear()
+            self.flush_scheduled = False
+        conn.executemany(INSERT_MESSAGE, [
+            (entry['id'], entry['room'], entry['username'], entry['message'], entry['created'])
+            for entry in batch
+        ])
+        return len(batch)
+
+    def _flushed(self, count, error):
+        with self.lock:
+            self.writing = []
+        if error is not None:
+            logging.error(f"Ошибка записи истории чата: {error}")
+            return
+        with self.lock:
+            self.stored += count
+            self.batches += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'appended': self.appended,
+                'stored': self.stored,
+                'pending': len(self.pending),
+                'dropped': self.dropped,
+                'batches': self.batches,
+                'rooms': len(self.rings),
+            }
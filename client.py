@@ -7,23 +7,52 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, scrolledtext
 import socket
-import json
 import threading
+import time
 from datetime import datetime
 
+from config import AUDIO_CONFIG
+from protocol import (
+    FRAMING, RECV_BUFFER_SIZE, FrameDecoder, encode_payload, frame_message, hello_message
+)
+
 try:
     import pyaudio
 except ImportError:
     pyaudio = None
     print("PyAudio не установлен. Голосовые функции недоступны.")
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+    print("NumPy не установлен. Голосовые функции недоступны.")
+
+from voice_capture import VoiceCapture
+from voice_playback import VoicePlayback
+from voice_relay import MAX_DATAGRAM, PACKET_REGISTER, PACKET_REGISTERED
+
+VOICE_ENABLED = pyaudio is not None and numpy is not None
+
 
 class ModernVoiceChatClient:
     def __init__(self):
         self.host = 'localhost'
         self.text_port = 12345
         self.connected = False
+        self.logged_in = False
         self.username = ""
+        self.password = ""
+        self.framed = False
+        self.decoder = FrameDecoder()
+        self.send_lock = threading.Lock()
+        self.audio = None
+        self.voice_socket = None
+        self.voice_capture = None
+        self.voice_playback = None
+        self.voice_registered = False
+        self.voice_server = None  # UDP-адрес ретранслятора
+        self.speaking = set()  # участники комнаты, которые сейчас говорят
 
         self.setup_colors()
         self.create_gui()
@@ -224,6 +253,43 @@ class ModernVoiceChatClient:
         )
         self.username_entry.pack(fill=tk.X, ipady=8, pady=(5, 0))
 
+        # Поле пароля
+        password_container = tk.Frame(fields_frame, bg=self.colors['bg_dark'])
+        password_container.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=(0, 10))
+
+        tk.Label(
+            password_container,
+            text="🔑 Пароль:",
+            font=('Segoe UI', 10, 'bold'),
+            fg=self.colors['text_light'],
+            bg=self.colors['bg_dark']
+        ).pack(anchor=tk.W)
+
+        self.password_entry = tk.Entry(
+            password_container,
+            font=('Segoe UI', 11),
+            bg=self.colors['bg_light'],
+            fg=self.colors['text_light'],
+            insertbackground=self.colors['text_light'],
+            border=0,
+            relief='flat',
+            show='•'
+        )
+        self.password_entry.pack(fill=tk.X, ipady=8, pady=(5, 0))
+        self.password_entry.bind('<Return>', lambda event: self.connect())
+
+        self.register_mode = tk.BooleanVar(value=False)
+        tk.Checkbutton(
+            password_container,
+            text="Новый пользователь",
+            variable=self.register_mode,
+            font=('Segoe UI', 10),
+            fg=self.colors['text_dim'],
+            bg=self.colors['bg_dark'],
+            selectcolor=self.colors['bg_dark'],
+            activebackground=self.colors['bg_dark']
+        ).pack(anchor=tk.W, pady=(5, 0))
+
         # Кнопка подключения
         btn_container = tk.Frame(fields_frame, bg=self.colors['bg_dark'])
         btn_container.pack(side=tk.RIGHT)
@@ -315,7 +381,7 @@ class ModernVoiceChatClient:
         )
         voice_frame.pack(fill=tk.X, pady=(0, 15))
 
-        if pyaudio:
+        if VOICE_ENABLED:
             # Кнопка голосовой записи
             self.voice_btn = tk.Button(
                 voice_frame,
@@ -328,6 +394,8 @@ class ModernVoiceChatClient:
                 cursor='hand2'
             )
             self.voice_btn.pack(fill=tk.X, ipady=15)
+            self.voice_btn.bind('<ButtonPress-1>', self.start_recording)
+            self.voice_btn.bind('<ButtonRelease-1>', self.stop_recording)
 
             # Индикатор записи
             self.recording_indicator = tk.Label(
@@ -338,11 +406,35 @@ class ModernVoiceChatClient:
                 bg=self.colors['bg_dark']
             )
             self.recording_indicator.pack(pady=(10, 0))
+
+            # Открытый микрофон: передается только речь (определение речи
+            # в VoiceCapture), кнопку держать не нужно
+            self.voice_activation = tk.BooleanVar(value=AUDIO_CONFIG['voice_activation'])
+            tk.Checkbutton(
+                voice_frame,
+                text="Голосовая активация",
+                variable=self.voice_activation,
+                command=self.toggle_voice_activation,
+                font=('Segoe UI', 10),
+                fg=self.colors['text_dim'],
+                bg=self.colors['bg_dark'],
+                selectcolor=self.colors['bg_dark'],
+                activebackground=self.colors['bg_dark']
+            ).pack(pady=(10, 0))
+
+            self.speaking_label = tk.Label(
+                voice_frame,
+                text="",
+                font=('Segoe UI', 10),
+                fg=self.colors['accent_green'],
+                bg=self.colors['bg_dark']
+            )
+            self.speaking_label.pack(pady=(5, 0))
         else:
             # Сообщение об отсутствии PyAudio
             warning_label = tk.Label(
                 voice_frame,
-                text="⚠️ Голосовые функции недоступны\nУстановите pyaudio для поддержки голоса",
+                text="⚠️ Голосовые функции недоступны\nУстановите pyaudio и numpy для поддержки голоса",
                 font=('Segoe UI', 11),
                 fg=self.colors['accent_orange'],
                 bg=self.colors['bg_dark'],
@@ -387,11 +479,14 @@ class ModernVoiceChatClient:
 
     def connect(self):
         """Подключение к серверу с улучшенными визуальными эффектами"""
+        if self.connected:
+            return
         self.host = self.server_entry.get() or 'localhost'
         self.username = self.username_entry.get().strip()
+        self.password = self.password_entry.get()
 
-        if not self.username:
-            messagebox.showwarning("⚠️ Ошибка", "Введите имя пользователя")
+        if not self.username or not self.password:
+            messagebox.showwarning("⚠️ Ошибка", "Введите имя пользователя и пароль")
             return
 
         # Изменяем кнопку во время подключения
@@ -406,24 +501,40 @@ class ModernVoiceChatClient:
                 self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
                 self.socket.connect((self.host, self.text_port))
                 self.connected = True
-
-                # Отправка имени
-                message = {'type': 'join', 'username': self.username}
-                self.socket.send(json.dumps(message).encode())
+                self.negotiate_framing()
 
                 # Запуск потока приема сообщений
                 threading.Thread(target=self.receive_messages, daemon=True).start()
 
-                # Обновляем UI в главном потоке
-                self.root.after(0, self.on_connected)
+                # Новый пользователь сначала регистрируется, вход - после register_success
+                action = 'register' if self.register_mode.get() else 'login'
+                self.send_json({'type': action, 'username': self.username, 'password': self.password})
 
             except Exception as e:
-                self.root.after(0, lambda: self.on_connection_failed(str(e)))
+                self.close_connection()
+                self.root.after(0, lambda e=e: self.on_connection_failed(str(e)))
 
         threading.Thread(target=connect_thread, daemon=True).start()
 
+    def close_connection(self):
+        """Закрытие подключения (ошибка входа или сети) вместе с голосом"""
+        self.connected = False
+        self.logged_in = False
+        self.framed = False
+        self.decoder = FrameDecoder()
+        try:
+            # shutdown будит поток приема, заблокированный в recv
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except (AttributeError, OSError):
+            pass
+        try:
+            self.socket.close()
+        except (AttributeError, OSError):
+            pass
+        self.stop_voice()
+
     def on_connected(self):
-        """Обработчик успешного подключения"""
+        """Обработчик успешного входа"""
         self.connect_btn.config(
             text="✅ Подключен",
             bg=self.colors['accent_green'],
@@ -433,6 +544,7 @@ class ModernVoiceChatClient:
             text=f"🟢 Подключен как {self.username}",
             fg=self.colors['accent_green']
         )
+        self.register_mode.set(False)
         self.add_message("Успешно подключен к серверу!", "SYSTEM")
 
     def on_connection_failed(self, error):
@@ -446,7 +558,7 @@ class ModernVoiceChatClient:
 
     def send_message(self, event=None):
         """Отправка сообщения с улучшенной обработкой"""
-        if not self.connected:
+        if not self.logged_in:
             messagebox.showwarning("⚠️ Предупреждение", "Сначала подключитесь к серверу")
             return
 
@@ -455,36 +567,255 @@ class ModernVoiceChatClient:
             return
 
         try:
-            message = {'type': 'message', 'text': text, 'username': self.username}
-            self.socket.send(json.dumps(message).encode())
+            # Свое сообщение появится в чате, когда сервер разошлет его комнате
+            self.send_json({'type': 'chat', 'message': text})
             self.message_entry.delete(0, tk.END)
 
-            # Добавляем наше сообщение в чат
-            self.add_message(text, self.username)
-
         except Exception as e:
             self.add_message(f"Ошибка отправки: {e}", "ERROR")
 
+    def negotiate_framing(self):
+        """Рукопожатие для перехода на кадры с префиксом длины.
+
+        Сервер без поддержки кадров не отвечает на hello - тогда клиент
+        остается на старом формате.
+        """
+        self.socket.sendall(encode_payload(hello_message()))
+        self.socket.settimeout(2.0)
+        try:
+            data = self.socket.recv(RECV_BUFFER_SIZE)
+            for message in self.decoder.feed_legacy(data):
+                if message.get('type') == 'hello' and message.get('framing') == FRAMING:
+                    self.framed = True
+        except socket.timeout:
+            pass
+        finally:
+            self.socket.settimeout(None)
+
+    def send_json(self, message):
+        """Отправка сообщения серверу в согласованном формате"""
+        data = frame_message(message) if self.framed else encode_payload(message)
+        with self.send_lock:
+            self.socket.sendall(data)
+
     def receive_messages(self):
         """Прием сообщений от сервера"""
+        recv_buffer = bytearray(RECV_BUFFER_SIZE)
+        recv_view = memoryview(recv_buffer)
         while self.connected:
             try:
-                data = self.socket.recv(1024).decode()
-                if not data:
+                nbytes = self.socket.recv_into(recv_view)
+                if not nbytes:
                     break
 
-                message = json.loads(data)
+                if self.framed:
+                    messages = self.decoder.feed_frames(recv_view[:nbytes])
+                else:
+                    messages = self.decoder.feed_legacy(recv_view[:nbytes])
 
-                # Обновляем UI в главном потоке
-                if message['type'] == 'message':
-                    self.root.after(0, lambda: self.add_message(message['text'], message['username']))
-                elif message['type'] == 'system':
-                    self.root.after(0, lambda: self.add_message(message['text'], "SYSTEM"))
+                for message in messages:
+                    self.handle_server_message(message)
 
             except Exception as e:
                 if self.connected:
-                    self.root.after(0, lambda: self.add_message(f"Ошибка приема: {e}", "ERROR"))
+                    self.root.after(0, lambda e=e: self.add_message(f"Ошибка приема: {e}", "ERROR"))
+                break
+        if self.connected:
+            self.close_connection()
+            self.root.after(0, lambda: self.on_connection_failed("Соединение с сервером закрыто"))
+
+    def handle_server_message(self, message):
+        """Обработка одного сообщения сервера"""
+        # Обновляем UI в главном потоке
+        if message['type'] == 'chat_message':
+            self.root.after(0, lambda: self.add_message(message['message'], message['username']))
+        elif message['type'] == 'error':
+            self.root.after(0, lambda: self.add_message(message['message'], "ERROR"))
+            if not self.logged_in:
+                # Неверный пароль, занятое имя - вход не состоялся
+                self.close_connection()
+                self.root.after(0, lambda: self.on_connection_failed(message['message']))
+        elif message['type'] == 'register_success':
+            self.send_json({'type': 'login', 'username': self.username, 'password': self.password})
+        elif message['type'] == 'login_success':
+            self.logged_in = True
+            self.root.after(0, self.on_connected)
+            self.show_history(message.get('history', []))
+            if message.get('voice_token'):
+                self.start_voice(message['voice_token'], message['voice_port'])
+        elif message['type'] == 'room_joined':
+            self.root.after(0, lambda: self.add_message(f"Комната {message['room']}", "SYSTEM"))
+            self.show_history(message.get('history', []))
+        elif message['type'] == 'user_joined':
+            self.root.after(0, lambda: self.add_message(f"{message['username']} вошел", "SYSTEM"))
+        elif message['type'] == 'voice_quality':
+            if self.voice_capture is not None:
+                self.voice_capture.set_quality(message['quality'])
+        elif message['type'] == 'voice_activity':
+            self.root.after(0, lambda: self.update_speaking(message['username'], message['speaking']))
+        elif message['type'] == 'user_left':
+            self.root.after(0, lambda: self.add_message(f"{message['username']} вышел", "SYSTEM"))
+            self.root.after(0, lambda: self.update_speaking(message['username'], False))
+        elif message['type'] == 'users_diff':
+            for username in message['joined']:
+                if username != self.username:
+                    self.root.after(0, lambda username=username: self.add_message(f"{username} вошел", "SYSTEM"))
+            for username in message['left']:
+                self.root.after(0, lambda username=username: self.add_message(f"{username} вышел", "SYSTEM"))
+                self.root.after(0, lambda username=username: self.update_speaking(username, False))
+
+    def show_history(self, history):
+        """Последние сообщения комнаты из login_success/room_joined"""
+        for entry in history:
+            self.root.after(0, lambda entry=entry: self.add_message(entry['message'], entry['username']))
+
+    def start_voice(self, token, voice_port):
+        """Привязка UDP-адреса к сессии и подготовка захвата голоса.
+
+        Вызывается на каждый login_success: голос прежнего подключения
+        закрыт в close_connection, новый токен регистрируется заново.
+        """
+        if not VOICE_ENABLED:
+            return
+        self.voice_registered = False
+        packet = bytes([PACKET_REGISTER]) + token.encode('ascii')
+        if self.voice_socket is not None:
+            threading.Thread(target=self.register_voice, args=(self.voice_socket, packet), daemon=True).start()
+            return
+        server_address = self.voice_server = (self.host, voice_port)
+        sock = self.voice_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        threading.Thread(target=self.receive_voice, args=(sock,), daemon=True).start()
+        threading.Thread(target=self.register_voice, args=(sock, packet), daemon=True).start()
+
+        self.audio = pyaudio.PyAudio()
+        self.voice_capture = VoiceCapture(self.voice_socket, server_address)
+        try:
+            self.voice_capture.open(self.audio)
+        except OSError as e:
+            self.voice_capture = None
+            self.root.after(0, lambda e=e: self.add_message(f"Микрофон недоступен: {e}", "ERROR"))
+        else:
+            self.root.after(0, self.toggle_voice_activation)
+
+        self.voice_playback = VoicePlayback()
+        try:
+            self.voice_playback.open(self.audio)
+        except OSError as e:
+            self.voice_playback = None
+            self.root.after(0, lambda e=e: self.add_message(f"Вывод звука недоступен: {e}", "ERROR"))
+        else:
+            threading.Thread(target=self.send_voice_reports, args=(sock,), daemon=True).start()
+
+    def stop_voice(self):
+        """Остановка захвата и воспроизведения, закрытие голосового сокета"""
+        sock = self.voice_socket
+        if sock is None:
+            return
+        # Потоки приема, регистрации и отчетов работают, пока voice_socket - их сокет
+        self.voice_socket = None
+        self.voice_registered = False
+        capture, self.voice_capture = self.voice_capture, None
+        playback, self.voice_playback = self.voice_playback, None
+        if capture is not None:
+            capture.close()
+        if playback is not None:
+            playback.close()
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass  # UDP без connect: ENOTCONN, но recv все равно просыпается
+        sock.close()
+        if self.audio is not None:
+            self.audio.terminate()
+            self.audio = None
+        self.speaking.clear()
+        self.root.after(0, self.reset_voice_panel)
+
+    def reset_voice_panel(self):
+        """Кнопка и индикатор записи после остановки голоса"""
+        self.voice_btn.config(bg=self.colors['accent_green'])
+        self.recording_indicator.config(text="🔴 НЕ ЗАПИСЫВАЕТСЯ", fg=self.colors['text_dim'])
+        self.speaking_label.config(text="")
+
+    def register_voice(self, sock, packet):
+        """Повтор REGISTER, пока ретранслятор не ответит REGISTERED"""
+        for _ in range(AUDIO_CONFIG['register_attempts']):
+            if self.voice_socket is not sock or self.voice_registered:
+                return
+            try:
+                sock.sendto(packet, self.voice_server)
+            except OSError:
+                break
+            time.sleep(AUDIO_CONFIG['register_interval'])
+        if self.voice_socket is sock and not self.voice_registered:
+            self.root.after(0, lambda: self.add_message(
+                "Голосовой сервер не отвечает: голос недоступен", "ERROR"))
+
+    def receive_voice(self, sock):
+        """Прием голосовых пакетов сервера"""
+        while self.voice_socket is sock:
+            try:
+                data = sock.recv(MAX_DATAGRAM)
+            except OSError:
                 break
+            if not data or self.voice_socket is not sock:
+                continue
+            if data[0] == PACKET_REGISTERED:
+                self.voice_registered = True
+            elif self.voice_playback is not None:
+                self.voice_playback.receive(data)
+
+    def send_voice_reports(self, sock):
+        """Периодические отчеты о качестве приема для сервера"""
+        interval = AUDIO_CONFIG['report_interval']
+        while self.voice_socket is sock:
+            time.sleep(interval)
+            playback = self.voice_playback
+            if not self.voice_registered or playback is None or self.voice_socket is not sock:
+                continue
+            try:
+                sock.sendto(playback.report(), self.voice_server)
+            except OSError:
+                break
+
+    def start_recording(self, event=None):
+        """Начало передачи голоса, пока кнопка нажата"""
+        if self.voice_capture is None:
+            self.add_message("Голос станет доступен после входа на сервер", "SYSTEM")
+            return
+        self.voice_capture.set_transmitting(True)
+        self.voice_btn.config(bg=self.colors['accent_red'])
+        self.recording_indicator.config(text="🟢 ИДЕТ ЗАПИСЬ", fg=self.colors['accent_green'])
+
+    def stop_recording(self, event=None):
+        """Конец передачи голоса"""
+        if self.voice_capture is None or self.voice_activation.get():
+            return
+        self.voice_capture.set_transmitting(False)
+        self.voice_btn.config(bg=self.colors['accent_green'])
+        self.recording_indicator.config(text="🔴 НЕ ЗАПИСЫВАЕТСЯ", fg=self.colors['text_dim'])
+
+    def toggle_voice_activation(self):
+        """Включение и выключение открытого микрофона"""
+        if self.voice_capture is None:
+            return
+        if self.voice_activation.get():
+            self.start_recording()
+        else:
+            self.voice_capture.set_transmitting(False)
+            self.voice_btn.config(bg=self.colors['accent_green'])
+            self.recording_indicator.config(text="🔴 НЕ ЗАПИСЫВАЕТСЯ", fg=self.colors['text_dim'])
+
+    def update_speaking(self, username, speaking):
+        """Список говорящих по событиям voice_activity"""
+        if not VOICE_ENABLED:
+            return
+        if speaking:
+            self.speaking.add(username)
+        else:
+            self.speaking.discard(username)
+        text = f"🔊 Говорят: {', '.join(sorted(self.speaking))}" if self.speaking else ""
+        self.speaking_label.config(text=text)
 
     def add_message(self, text, sender):
         """Добавление сообщения в чат с улучшенным форматированием"""
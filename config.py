@@ -4,7 +4,19 @@ SERVER_CONFIG = {
     'text_port': 12345,
     'voice_port': 12346,
     'max_clients': 50,
+    'text_engine': 'threaded',  # threaded, selector
+    'outbound_high_water': 256 * 1024,  # байт в очереди, выше - пропуск уведомлений о присутствии
+    'outbound_hard_limit': 1024 * 1024,  # байт в очереди, выше - отключение клиента
+    'slow_consumer_timeout': 10,  # секунд выше high water до отключения
+    'voice_workers': 0,  # процессов ретрансляции голоса (SO_REUSEPORT), 0 - в основном процессе
+    'voice_mode': 'forward',  # forward - пересылка потоков, mix - микширование на сервере
+    'voice_bitrate_control': True,  # сервер меняет профиль качества клиентов по потерям и нагрузке
     'database_path': 'server_data/users.db',
+    'database_readers': 4,  # подключений SQLite для чтения (storage.py)
+    'database_batch': 256,  # операций записи в одной транзакции, не больше
+    'metrics': True,  # время обработчиков, рассылки, байты (metrics.py, команда metrics)
+    'metrics_port': 0,  # HTTP /metrics для Prometheus на 127.0.0.1, 0 - выключен
+    'capture_file': None,  # запись входящего трафика для benchmarks/replay.py (traffic_capture.py)
     'log_file': 'server.log'
 }
 
@@ -14,7 +26,21 @@ AUDIO_CONFIG = {
     'channels': 1,
     'rate': 44100,
     'chunk': 1024,
-    'voice_quality': 'medium'  # low, medium, high
+    'voice_quality': 'medium',  # low, medium, high
+    'frame_ms': 20,  # длительность звука в одном UDP-пакете
+    'vad': True,  # не передавать паузы (определение речи на клиенте)
+    'voice_activation': False,  # открытый микрофон: передача по голосу без кнопки
+    'report_interval': 5,  # секунд между отчетами о качестве приема
+    'register_interval': 0.5,  # секунд между повторами REGISTER до ответа ретранслятора
+    'register_attempts': 10  # повторов REGISTER, затем ошибка
+}
+
+# Профили качества голоса: частота дискретизации и кодек передачи.
+# Битрейт без заголовков: adpcm - 4 бита на отсчет, mulaw - 8 бит
+VOICE_QUALITY = {
+    'low': {'rate': 8000, 'codec': 'adpcm'},  # 32 кбит/с
+    'medium': {'rate': 16000, 'codec': 'adpcm'},  # 64 кбит/с
+    'high': {'rate': 16000, 'codec': 'mulaw'}  # 128 кбит/с
 }
 
 # Настройки безопасности
@@ -26,6 +52,29 @@ SECURITY_CONFIG = {
     'admin_password': 'admin123'
 }
 
+# Хеширование паролей (auth.py)
+AUTH_CONFIG = {
+    'kdf': 'scrypt',  # scrypt, pbkdf2_sha256 (если scrypt недоступен - pbkdf2_sha256)
+    'scrypt_n': 2 ** 14,  # ~16 МБ памяти и ~50 мс на проверку
+    'scrypt_r': 8,
+    'scrypt_p': 1,
+    'pbkdf2_iterations': 600000,
+    'workers': 0,  # процессов проверки паролей, 0 - по числу ядер
+    'max_pending': 4096  # проверок в очереди, сверх - отказ "сервер занят"
+}
+
+# Логирование сервера (server_logging.py); файл - SERVER_CONFIG['log_file']
+LOG_CONFIG = {
+    'level': 'INFO',
+    'format': 'text',  # text - строки как раньше, json - запись JSON на строку
+    'console': True,  # дублировать в stderr
+    'max_bytes': 10 * 1024 * 1024,  # размер файла до ротации
+    'backup_count': 5,  # старых файлов server.log.1..N
+    'queue_size': 10000,  # записей в очереди, сверх - отбрасываются
+    'chat_content': True,  # писать текст сообщений чата (логгер chat)
+    'rate_limits': {'voice': 20}  # записей в секунду по категориям, лишние отбрасываются
+}
+
 # Настройки GUI
 GUI_CONFIG = {
     'window_width': 800,
@@ -40,7 +89,17 @@ ROOM_CONFIG = {
     'default_room': 'general',
     'max_room_name_length': 32,
     'max_rooms': 100,
-    'auto_create_rooms': True
+    'auto_create_rooms': True,
+    'voice_max_speakers': 0,  # пересылать голос N самых громких говорящих, 0 - всех
+    'voice_room_speakers': {},  # лимиты для отдельных комнат: {'general': 4}
+    'history_ring': 200,  # последних сообщений комнаты в памяти
+    'history_on_join': 50,  # сообщений истории в room_joined и login_success
+    'history_page': 50,  # сообщений в странице get_history, не больше
+    'history_queue_limit': 10000,  # сообщений в очереди записи в базу, сверх - отбрасываются
+    'presence_history': 1000,  # изменений состава в журнале комнаты для users_diff/rooms_diff
+    # Секунд сбора входов/выходов в один users_diff (например 0.05); 0 - user_joined/user_left
+    # сразу: клиенты, не понимающие users_diff, по умолчанию работают как раньше
+    'presence_batch': 0
 }
 
 # Константы сообщений
@@ -0,0 +1,300 @@
+"""
+Состояние одного TCP-подключения к текстовому серверу
+"""
+
+import logging
+import selectors
+import socket
+import threading
+import time
+from collections import deque
+
+from protocol import FrameDecoder, encode_frame
+
+# Результаты постановки данных в очередь отправки
+SENT = 'sent'  # отправлено сразу, очередь пуста
+QUEUED = 'queued'
+DROPPED = 'dropped'
+OVERFLOW = 'overflow'
+
+# Неблокирующая отправка без смены режима сокета: в режиме threaded поток
+# чтения остается в блокирующем recv. Где флага нет (Windows), блокирующие
+# сокеты разбирает поток отправки подключения.
+SEND_FLAGS = getattr(socket, 'MSG_DONTWAIT', 0)
+
+WRITER_IDLE_TIMEOUT = 1.0
+
+
+class ClientConnection:
+    """Сокет клиента вместе с его очередью исходящих данных.
+
+    Очередь ограничена: выше high_water второстепенные сообщения
+    (droppable) отбрасываются, а клиент, который не успевает читать дольше
+    slow_timeout секунд или переполнил hard_limit, считается медленным
+    и должен быть отключен.
+    """
+
+    def __init__(self, sock, address, high_water=256 * 1024,
+                 hard_limit=1024 * 1024, slow_timeout=10.0, nonblocking=False):
+        self.sock = sock
+        self.address = address
+        # Можно ли писать в сокет из любого потока, не блокируясь
+        self.direct_send = nonblocking or bool(SEND_FLAGS)
+        # Очередь хранит ссылки на готовые кадры: при рассылке в комнату
+        # один и тот же объект bytes разделяется всеми получателями
+        self.outbound = deque()
+        self.outbound_offset = 0
+        self.outbound_bytes = 0
+        self.high_water = high_water
+        self.hard_limit = hard_limit
+        self.slow_timeout = slow_timeout
+        self.over_since = None
+        self.dropped = 0
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.writer_active = False
+        self.closed = False
+        self.framed = False  # True после рукопожатия hello
+        self.decoder = FrameDecoder()
+        self.auth_checking = False  # пароль проверяется в пуле (auth.AuthPool)
+        self.auth_pending = False  # проверка или разбор отложенного: новые сообщения - в очередь
+        self.deferred = []  # сообщения, пришедшие за время проверки
+
+    def wire_bytes(self, payload):
+        """Представление JSON-payload в формате, согласованном с клиентом"""
+        return encode_frame(payload) if self.framed else payload
+
+    def read_messages(self, data):
+        """Разбор всех полных сообщений из нового фрагмента данных"""
+        if self.framed:
+            return self.decoder.feed_frames(data)
+        return self.decoder.feed_legacy(data)
+
+    def queue(self, data, droppable=False, start_writer=False):
+        """Отправка данных или добавление в очередь с учетом лимитов.
+
+        При пустой очереди данные сразу пишутся в сокет без блокировки; в
+        очередь попадает только то, что не поместилось в буфер сокета, и
+        тогда результат QUEUED - очередь должен разобрать цикл событий или
+        OutboundWriter. start_writer - для сокетов без неблокирующей
+        отправки запустить поток отправки, если он еще не работает.
+        """
+        with self.lock:
+            if self.closed:
+                return DROPPED
+            sent = 0
+            if self.direct_send and not self.outbound:
+                try:
+                    sent = self.sock.send(data, SEND_FLAGS)
+                except OSError:
+                    # Буфер сокета полон или сокет неисправен: остаток уходит в
+                    # очередь, ошибку обработает тот, кто ее разбирает
+                    pass
+                if sent == len(data):
+                    return SENT
+
+            size = self.outbound_bytes + len(data) - sent
+            if size > self.hard_limit:
+                return OVERFLOW
+            if size > self.high_water:
+                now = time.monotonic()
+                if self.over_since is None:
+                    self.over_since = now
+                elif now - self.over_since > self.slow_timeout:
+                    return OVERFLOW
+                if droppable and not sent:
+                    # Начатый кадр отбросить нельзя - он уже частично в сокете
+                    self.dropped += 1
+                    return DROPPED
+
+            if sent:
+                self.outbound_offset = sent
+            self.outbound.append(data)
+            self.outbound_bytes = size
+            if start_writer and not self.direct_send:
+                if not self.writer_active:
+                    self.writer_active = True
+                    threading.Thread(target=self._writer_loop, daemon=True).start()
+                else:
+                    self.ready.notify()
+            return QUEUED
+
+    def has_pending(self):
+        """Есть ли неотправленные данные"""
+        return bool(self.outbound)
+
+    def stats(self):
+        """Текущая глубина очереди отправки"""
+        return {
+            'queued_bytes': self.outbound_bytes,
+            'queued_frames': len(self.outbound),
+            'dropped': self.dropped,
+            'over_high_water': self.over_since is not None,
+        }
+
+    def close(self):
+        """Пометка подключения закрытым и сброс очереди"""
+        with self.lock:
+            self.closed = True
+            self.outbound.clear()
+            self.outbound_offset = 0
+            self.outbound_bytes = 0
+            self.ready.notify()
+
+    def flush(self):
+        """Неблокирующая отправка накопленных данных (цикл событий, OutboundWriter).
+
+        Возвращает True, если очередь опустошена полностью.
+        """
+        with self.lock:
+            while self.outbound:
+                chunk = self.outbound[0]
+                try:
+                    if self.outbound_offset:
+                        sent = self.sock.send(memoryview(chunk)[self.outbound_offset:], SEND_FLAGS)
+                    else:
+                        sent = self.sock.send(chunk, SEND_FLAGS)
+                except (BlockingIOError, InterruptedError):
+                    return False
+                if not sent:
+                    return False
+                self._sent(sent)
+                self.outbound_offset += sent
+                if self.outbound_offset == len(chunk):
+                    self.outbound.popleft()
+                    self.outbound_offset = 0
+            return True
+
+    def _sent(self, size):
+        """Учет отправленных байтов; вызывается под self.lock"""
+        self.outbound_bytes -= size
+        if self.outbound_bytes <= self.high_water:
+            self.over_since = None
+
+    def _writer_loop(self):
+        """Поток отправки для блокирующих сокетов без MSG_DONTWAIT.
+
+        Блокирующий sendall выполняется здесь, а не в потоке, который
+        рассылает сообщение, поэтому медленный клиент задерживает только
+        собственную очередь. Поток завершается после простоя.
+        """
+        while True:
+            with self.lock:
+                if not self.outbound and not self.closed:
+                    self.ready.wait(WRITER_IDLE_TIMEOUT)
+                if self.closed or not self.outbound:
+                    self.writer_active = False
+                    return
+                chunk = self.outbound.popleft()
+
+            try:
+                self.sock.sendall(chunk)
+            except OSError as e:
+                logging.error("Ошибка отправки сообщения: %s", e)
+                self.close()
+                with self.lock:
+                    self.writer_active = False
+                return
+
+            with self.lock:
+                if not self.closed:
+                    self._sent(len(chunk))
+
+
+class OutboundWriter:
+    """Общий поток отправки очередей для режима threaded.
+
+    ClientConnection.queue пишет в сокет сам, пока клиент успевает
+    читать. Подключения, у которых в очереди остались данные, передаются
+    сюда через request_write: один поток ждет готовности их сокетов к
+    записи (selectors) и дописывает очередь без блокировки, поэтому
+    медленный клиент не задерживает ни рассылку, ни других клиентов.
+    """
+
+    def __init__(self):
+        self.selector = selectors.DefaultSelector()
+        self.thread = None
+        self.running = True
+        self._lock = threading.Lock()
+        self._pending = set()
+        self._waker_r, self._waker_w = socket.socketpair()
+        self._waker_r.setblocking(False)
+        self._waker_w.setblocking(False)
+        self.selector.register(self._waker_r, selectors.EVENT_READ, None)
+
+    def request_write(self, conn):
+        """Дописать очередь подключения, как только сокет примет данные"""
+        with self._lock:
+            wake = not self._pending
+            self._pending.add(conn)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        if wake:
+            self._wake()
+
+    def stop(self):
+        self.running = False
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._waker_w.send(b'\0')
+        except OSError:
+            pass
+
+    def run(self):
+        while self.running:
+            for key, _ in self.selector.select(timeout=1.0):
+                if key.data is None:
+                    self._drain_waker()
+                else:
+                    self._write(key.data)
+
+            # Закрытые подключения снимаем раньше новых запросов: номер их
+            # сокета мог достаться новому подключению
+            for key in list(self.selector.get_map().values()):
+                if key.data is not None and key.data.closed:
+                    self._unwatch(key.data)
+            with self._lock:
+                pending, self._pending = self._pending, set()
+            for conn in pending:
+                self._write(conn)
+        self.selector.close()
+
+    def _write(self, conn):
+        if conn.closed:
+            self._unwatch(conn)
+            return
+        try:
+            done = conn.flush()
+        except OSError as e:
+            logging.error("Ошибка отправки сообщения: %s", e)
+            conn.close()
+            self._unwatch(conn)
+            # Поток чтения получит EOF и вызовет disconnect_client
+            try:
+                conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            return
+        if done:
+            self._unwatch(conn)
+        else:
+            try:
+                self.selector.register(conn.sock, selectors.EVENT_WRITE, conn)
+            except KeyError:
+                pass  # уже ждем готовности
+
+    def _unwatch(self, conn):
+        try:
+            self.selector.unregister(conn.sock)
+        except (KeyError, ValueError):
+            pass
+
+    def _drain_waker(self):
+        try:
+            while self._waker_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
@@ -0,0 +1,280 @@
+"""
+Метрики сервера: счетчики и гистограммы задержек.
+
+Диспетчер сообщений (VoiceChatServer.process_message) замеряет время
+обработчика каждого типа сообщения, рассылка в комнату - число
+получателей, байты и время; считаются принятые байты и байты, принятые в
+очереди отправки. Запись одного замера - поиск корзины по фиксированным
+границам (bisect) и несколько сложений под одной блокировкой, без
+выделения памяти.
+
+Значения, которые дешевле прочитать в момент запроса (подключения,
+комнаты, счетчики голоса, базы, очередей), сервер добавляет к снимку
+сам. Снимок отдается командой администратора metrics и, если задан
+SERVER_CONFIG['metrics_port'], по HTTP в текстовом формате Prometheus
+(MetricsEndpoint, только 127.0.0.1).
+
+Квантили в снимке - верхняя граница корзины, в которую попал квантиль,
+то есть оценка сверху с точностью до соседней границы.
+"""
+
+import bisect
+import collections
+import http.server
+import logging
+import threading
+import time
+
+# Границы корзин: время обработки, секунды
+LATENCY_BOUNDS = (
+    25e-6, 50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3,
+    10e-3, 25e-3, 50e-3, 100e-3, 250e-3, 1.0,
+)
+# Число получателей одной рассылки
+FANOUT_BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+RATE_WINDOW = 60.0  # секунд, за которые считаются значения "в секунду"
+PREFIX = 'voicechat_'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Счетчики по корзинам; изменяется под блокировкой владельца"""
+
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя - выше всех границ
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def copy(self):
+        other = Histogram(self.bounds)
+        other.counts = list(self.counts)
+        other.sum = self.sum
+        other.count = self.count
+        return other
+
+    def quantile(self, q):
+        """Верхняя граница корзины квантиля; None - выше последней границы"""
+        if not self.count:
+            return 0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def summary(self, scale=1.0):
+        def scaled(value):
+            return None if value is None else round(value * scale, 3)
+        return {
+            'count': self.count,
+            'avg': scaled(self.sum / self.count) if self.count else 0,
+            'p50': scaled(self.quantile(0.5)),
+            'p95': scaled(self.quantile(0.95)),
+            'p99': scaled(self.quantile(0.99)),
+        }
+
+
+class Metrics:
+    """Счетчики диспетчера и рассылки"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.monotonic()
+        self.messages = {}  # {тип: Histogram времени обработчика}
+        self.errors = collections.Counter()  # {тип: исключений в обработчике}
+        self.broadcast_time = Histogram(LATENCY_BOUNDS)
+        self.fanout = Histogram(FANOUT_BOUNDS)
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.frames_sent = 0
+        self.samples = {}  # {имя: deque[(время, значение)]} для per_second
+
+    def observe_message(self, msg_type, elapsed, failed=False):
+        with self.lock:
+            histogram = self.messages.get(msg_type)
+            if histogram is None:
+                histogram = self.messages[msg_type] = Histogram(LATENCY_BOUNDS)
+            histogram.observe(elapsed)
+            if failed:
+                self.errors[msg_type] += 1
+
+    def observe_broadcast(self, recipients, nbytes, elapsed):
+        with self.lock:
+            self.fanout.observe(recipients)
+            self.broadcast_time.observe(elapsed)
+            self.bytes_sent += nbytes
+            self.frames_sent += recipients
+
+    def received(self, nbytes):
+        with self.lock:
+            self.bytes_received += nbytes
+
+    def sent(self, nbytes):
+        with self.lock:
+            self.bytes_sent += nbytes
+            self.frames_sent += 1
+
+    def per_second(self, name, value):
+        """Скорость роста счетчика за последние RATE_WINDOW секунд запросов"""
+        now = time.monotonic()
+        with self.lock:
+            samples = self.samples.setdefault(name, collections.deque([(self.started, 0)]))
+            while len(samples) > 1 and now - samples[1][0] >= RATE_WINDOW:
+                samples.popleft()
+            since, previous = samples[0]
+            samples.append((now, value))
+        return round((value - previous) / (now - since), 1) if now > since else 0.0
+
+    def collect(self):
+        """Копия счетчиков для снимка и Prometheus"""
+        with self.lock:
+            return {
+                'uptime': time.monotonic() - self.started,
+                'messages': {name: h.copy() for name, h in self.messages.items()},
+                'errors': dict(self.errors),
+                'broadcast_time': self.broadcast_time.copy(),
+                'fanout': self.fanout.copy(),
+                'bytes_received': self.bytes_received,
+                'bytes_sent': self.bytes_sent,
+                'frames_sent': self.frames_sent,
+            }
+
+    def snapshot(self):
+        """Счетчики в виде для admin_response: время - в миллисекундах"""
+        data = self.collect()
+        messages = {}
+        for name, histogram in sorted(data['messages'].items()):
+            messages[name] = histogram.summary(scale=1000)
+            messages[name]['errors'] = data['errors'].get(name, 0)
+        return {
+            'uptime': round(data['uptime']),
+            'messages': messages,
+            'broadcast': {
+                'time_ms': data['broadcast_time'].summary(scale=1000),
+                'recipients': data['fanout'].summary(),
+            },
+            'bytes': {
+                'received': data['bytes_received'],
+                'sent': data['bytes_sent'],
+                'frames_sent': data['frames_sent'],
+                'received_per_second': self.per_second('bytes_received', data['bytes_received']),
+                'sent_per_second': self.per_second('bytes_sent', data['bytes_sent']),
+            },
+        }
+
+
+def _labels(**labels):
+    if not labels:
+        return ''
+    text = ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in labels.items()
+    )
+    return '{' + text + '}'
+
+
+def _histogram_lines(lines, name, histogram, **labels):
+    cumulative = 0
+    for bound, count in zip(histogram.bounds, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{_labels(**labels, le=repr(float(bound)))} {cumulative}')
+    lines.append(f'{name}_bucket{_labels(**labels, le="+Inf")} {histogram.count}')
+    lines.append(f'{name}_sum{_labels(**labels)} {histogram.sum}')
+    lines.append(f'{name}_count{_labels(**labels)} {histogram.count}')
+
+
+def _flatten(prefix, values):
+    """{'voice': {'talking': 2}} -> [('voice_talking', 2)], только числа"""
+    for key, value in values.items():
+        name = f'{prefix}_{key}' if prefix else key
+        if isinstance(value, dict):
+            yield from _flatten(name, value)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def render_prometheus(metrics, counters=None, gauges=None):
+    """Текстовый формат Prometheus: счетчики Metrics и значения сервера"""
+    data = metrics.collect()
+    lines = []
+
+    name = PREFIX + 'message_duration_seconds'
+    lines.append(f'# HELP {name} Время обработчика сообщения по типу')
+    lines.append(f'# TYPE {name} histogram')
+    for msg_type, histogram in sorted(data['messages'].items()):
+        _histogram_lines(lines, name, histogram, type=msg_type)
+    name = PREFIX + 'message_errors_total'
+    lines.append(f'# TYPE {name} counter')
+    for msg_type, count in sorted(data['errors'].items()):
+        lines.append(f'{name}{_labels(type=msg_type)} {count}')
+
+    name = PREFIX + 'broadcast_duration_seconds'
+    lines.append(f'# TYPE {name} histogram')
+    _histogram_lines(lines, name, data['broadcast_time'])
+    name = PREFIX + 'broadcast_recipients'
+    lines.append(f'# TYPE {name} histogram')
+    _histogram_lines(lines, name, data['fanout'])
+
+    values = {
+        'received_bytes_total': data['bytes_received'],
+        'sent_bytes_total': data['bytes_sent'],
+        'sent_frames_total': data['frames_sent'],
+    }
+    values.update((f'{key}_total', value) for key, value in _flatten('', counters or {}))
+    for key, value in values.items():
+        lines.append(f'# TYPE {PREFIX}{key} counter')
+        lines.append(f'{PREFIX}{key} {value}')
+    lines.append(f'# TYPE {PREFIX}uptime_seconds gauge')
+    lines.append(f'{PREFIX}uptime_seconds {data["uptime"]:.3f}')
+    for key, value in _flatten('', gauges or {}):
+        lines.append(f'# TYPE {PREFIX}{key} gauge')
+        lines.append(f'{PREFIX}{key} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsEndpoint:
+    """GET /metrics в текстовом формате Prometheus в отдельном потоке"""
+
+    def __init__(self, render, port, host='127.0.0.1'):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                try:
+                    body = render().encode('utf-8')
+                except Exception:
+                    logging.error("Ошибка подготовки метрик", exc_info=True)
+                    self.send_error(500)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', CONTENT_TYPE)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("metrics: " + format, *args)
+
+        self.httpd = http.server.ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,271 @@
+"""
+Версии присутствия: список комнат и участники каждой комнаты.
+
+Все изменения состава комнат идут через Presence (join, leave,
+create_room), и каждое увеличивает версию комнаты и версию списка комнат
+(directory). По версиям:
+
+    снимки      rooms_list и users_list комнаты кодируются в JSON один раз
+                и отдаются готовыми байтами, пока версия не изменилась
+    изменения   последние ROOM_CONFIG['presence_history'] изменений
+                хранятся в журнале, и клиент, знающий версию since,
+                получает только разницу: rooms_diff - новые числа
+                участников изменившихся комнат, users_diff - кто вошел и
+                кто вышел (вход и выход между версиями взаимно
+                сокращаются). Если since старше журнала или из другого
+                запуска сервера (epoch), вместо разницы - снимок
+
+epoch - случайная метка запуска сервера: версии после перезапуска
+начинаются заново, и по epoch клиент отличает их от прежних.
+
+Словарь rooms ({комната: множество имен}) общий с сервером: читать его
+можно как раньше, изменять - только через Presence.
+
+PresenceBatcher собирает изменения за короткое окно (волна переподключений
+после перезапуска): вместо user_joined/user_left на каждое изменение
+участники комнаты получают один users_diff за окно, подписчики списка
+комнат - один rooms_diff.
+"""
+
+import collections
+import json
+import logging
+import secrets
+import threading
+import time
+
+from config import ROOM_CONFIG
+
+
+def _encode(message):
+    return json.dumps(message).encode('utf-8')
+
+
+class Presence:
+    """Составы комнат с версиями, журналом изменений и готовыми снимками"""
+
+    def __init__(self, rooms, history=ROOM_CONFIG['presence_history']):
+        self.rooms = rooms
+        self.history = history
+        self.epoch = secrets.token_hex(4)
+        self.lock = threading.Lock()
+        self.version = 0  # версия списка комнат
+        self.room_versions = dict.fromkeys(rooms, 0)
+        self.directory_log = collections.deque(maxlen=history)  # (версия, комната, участников)
+        self.room_logs = {}  # {комната: deque[(версия, вошел, имя)]}
+        self.rooms_cache = None  # (версия, payload rooms_list)
+        self.users_cache = {}  # {комната: (версия, payload users_list)}
+
+    def create_room(self, room):
+        """Новая пустая комната; версия списка комнат или None, если уже есть"""
+        with self.lock:
+            if room in self.rooms:
+                return None
+            self.rooms[room] = set()
+            self.room_versions[room] = 0
+            return self._directory_changed(room, 0)
+
+    def join(self, room, username):
+        """Вход в комнату (создается при необходимости).
+
+        Возвращает (версия комнаты, версия списка комнат, участников) или
+        None, если пользователь уже в комнате.
+        """
+        with self.lock:
+            members = self.rooms.get(room)
+            if members is None:
+                members = self.rooms[room] = set()
+            self.room_versions.setdefault(room, 0)
+            if username in members:
+                return None
+            members.add(username)
+            return self._room_changed(room, True, username)
+
+    def leave(self, room, username):
+        """Выход из комнаты; то же, что join, или None, если не был в ней"""
+        with self.lock:
+            members = self.rooms.get(room)
+            if members is None or username not in members:
+                return None
+            members.discard(username)
+            return self._room_changed(room, False, username)
+
+    def _room_changed(self, room, joined, username):
+        version = self.room_versions[room] = self.room_versions.get(room, 0) + 1
+        log = self.room_logs.get(room)
+        if log is None:
+            log = self.room_logs[room] = collections.deque(maxlen=self.history)
+        log.append((version, joined, username))
+        self.users_cache.pop(room, None)
+        count = len(self.rooms[room])
+        return version, self._directory_changed(room, count), count
+
+    def _directory_changed(self, room, count):
+        self.version += 1
+        self.directory_log.append((self.version, room, count))
+        self.rooms_cache = None
+        return self.version
+
+    def room_version(self, room):
+        with self.lock:
+            return self.room_versions.get(room)
+
+    def rooms_payload(self):
+        """Готовый rooms_list текущей версии"""
+        with self.lock:
+            if self.rooms_cache is None:
+                self.rooms_cache = (self.version, _encode({
+                    'type': 'rooms_list',
+                    'rooms': {room: len(users) for room, users in self.rooms.items()},
+                    'epoch': self.epoch,
+                    'version': self.version,
+                }))
+            return self.rooms_cache[1]
+
+    def users_payload(self, room):
+        """Готовый users_list комнаты или None, если комнаты нет"""
+        with self.lock:
+            cached = self.users_cache.get(room)
+            if cached is None:
+                if room not in self.rooms:
+                    return None
+                version = self.room_versions.setdefault(room, 0)
+                cached = self.users_cache[room] = (version, _encode({
+                    'type': 'users_list',
+                    'users': list(self.rooms[room]),
+                    'room': room,
+                    'epoch': self.epoch,
+                    'version': version,
+                }))
+            return cached[1]
+
+    def rooms_diff(self, since, epoch=None):
+        """rooms_diff с версии since или None, если нужен снимок"""
+        with self.lock:
+            if not self._covers(self.directory_log, self.version, since, epoch):
+                return None
+            changed = {}
+            for version, room, count in self.directory_log:
+                if version > since:
+                    changed[room] = count
+            return {
+                'type': 'rooms_diff',
+                'epoch': self.epoch,
+                'from': since,
+                'version': self.version,
+                'rooms': changed,
+            }
+
+    def users_diff(self, room, since, epoch=None):
+        """users_diff комнаты с версии since или None, если нужен снимок"""
+        with self.lock:
+            version = self.room_versions.get(room)
+            log = self.room_logs.get(room, ())
+            if version is None or not self._covers(log, version, since, epoch):
+                return None
+            joined = set()
+            left = set()
+            for entry_version, entered, username in log:
+                if entry_version <= since:
+                    continue
+                if entered:
+                    if username in left:
+                        left.discard(username)
+                    else:
+                        joined.add(username)
+                elif username in joined:
+                    joined.discard(username)
+                else:
+                    left.add(username)
+            return {
+                'type': 'users_diff',
+                'room': room,
+                'epoch': self.epoch,
+                'from': since,
+                'version': version,
+                'joined': sorted(joined),
+                'left': sorted(left),
+            }
+
+    def _covers(self, log, version, since, epoch):
+        """Есть ли в журнале все изменения после since"""
+        if type(since) is not int or since < 0 or since > version:
+            return False
+        if epoch is not None and epoch != self.epoch:
+            return False
+        if since == version:
+            return True
+        return bool(log) and log[0][0] <= since + 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'version': self.version,
+                'rooms': len(self.rooms),
+                'logged': len(self.directory_log) + sum(len(log) for log in self.room_logs.values()),
+            }
+
+
+class PresenceBatcher:
+    """Изменения присутствия, собранные за окно window секунд.
+
+    Первое изменение комнаты запоминает версию до него; через window
+    секунд поток сборки вызывает flush(rooms, directory_since) с
+    {комната: версия до первого изменения} и такой же версией списка
+    комнат (None, если он не менялся). Разницу с этих версий строит
+    Presence, поэтому вход и выход за окно сокращаются.
+    """
+
+    def __init__(self, window, flush):
+        self.window = window
+        self.flush = flush
+        self.cond = threading.Condition()
+        self.rooms = {}  # {комната: версия до первого изменения в окне}
+        self.directory_since = None
+        self.running = False
+        self.thread = threading.Thread(target=self._run, name='presence', daemon=True)
+
+    def room_changed(self, room, version):
+        with self.cond:
+            if room not in self.rooms:
+                self.rooms[room] = version - 1
+                self.cond.notify()
+
+    def directory_changed(self, version):
+        with self.cond:
+            if self.directory_since is None:
+                self.directory_since = version - 1
+                self.cond.notify()
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        return self
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+        if self.thread.is_alive():
+            self.thread.join()
+
+    def drain(self):
+        """Отправка собранного сейчас, не дожидаясь конца окна"""
+        with self.cond:
+            rooms, self.rooms = self.rooms, {}
+            directory_since, self.directory_since = self.directory_since, None
+        if rooms or directory_since is not None:
+            try:
+                self.flush(rooms, directory_since)
+            except Exception as e:
+                logging.error("Ошибка рассылки присутствия: %s", e)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.running and not self.rooms and self.directory_since is None:
+                    self.cond.wait()
+                if not self.running:
+                    return
+            time.sleep(self.window)
+            self.drain()
@@ -0,0 +1,152 @@
+"""
+Формат сообщений текстового протокола.
+
+Каждое сообщение - JSON в UTF-8 с префиксом длины (4 байта, big-endian).
+Старый формат (голый JSON без разделителей) остается доступным: соединение
+начинается в нем, и клиент переключается на кадры рукопожатием
+
+    -> {"type": "hello", "framing": "length-prefixed"}
+    <- {"type": "hello", "framing": "length-prefixed"}
+
+после которого обе стороны используют только кадры.
+"""
+
+import json
+import re
+import struct
+
+FRAMING = 'length-prefixed'
+HEADER = struct.Struct('!I')
+MAX_FRAME_SIZE = 1 << 20
+RECV_BUFFER_SIZE = 64 * 1024
+
+_json_decoder = json.JSONDecoder()
+# Обрывы чисел и литералов в конце буфера: "1." "1e+" "-" "tr" "nu"
+_PARTIAL_NUMBER = re.compile(r'-|(?:\.\d*)?(?:[eE][+-]?)?')
+_LITERALS = ('true', 'false', 'null', 'NaN', 'Infinity', '-Infinity')
+
+
+class ProtocolError(ValueError):
+    """Нарушение формата протокола"""
+
+
+def _incomplete(text, error):
+    """Ошибка raw_decode из-за объекта, оборванного концом буфера"""
+    rest = text[error.pos:]
+    if not rest or error.msg.startswith('Unterminated string'):
+        return True
+    if error.msg.startswith('Invalid \\uXXXX'):
+        hex_digits = rest[1:]
+        return len(rest) <= len('uXXXX') and all(c in '0123456789abcdefABCDEF' for c in hex_digits)
+    return bool(_PARTIAL_NUMBER.fullmatch(rest)) or any(word.startswith(rest) for word in _LITERALS)
+
+
+def encode_payload(message):
+    """Сериализация сообщения в байты без заголовка"""
+    return json.dumps(message).encode('utf-8')
+
+
+def encode_frame(payload):
+    """Добавление префикса длины к готовому payload"""
+    return HEADER.pack(len(payload)) + payload
+
+
+def frame_message(message):
+    """Сериализация сообщения в кадр"""
+    return encode_frame(encode_payload(message))
+
+
+def hello_message():
+    """Сообщение рукопожатия для перехода на кадры"""
+    return {'type': 'hello', 'framing': FRAMING}
+
+
+class FrameDecoder:
+    """Потоковый разбор входящих данных.
+
+    Данные читаются в общий переиспользуемый буфер (recv_into), кадры
+    разбираются прямо из него, по нескольку за один recv. В самом
+    подключении сохраняется только незавершенный хвост, поэтому простаивающие
+    клиенты не держат собственных буферов приема.
+    """
+
+    def __init__(self, max_frame_size=MAX_FRAME_SIZE):
+        self.tail = bytearray()
+        self.needed = HEADER.size
+        self.max_frame_size = max_frame_size
+
+    def feed_frames(self, data):
+        """Извлечение всех полных кадров в виде JSON-сообщений"""
+        if self.tail:
+            self.tail += data
+            if len(self.tail) < self.needed:
+                return []
+            view = memoryview(self.tail)
+        else:
+            view = memoryview(data)
+
+        messages = []
+        pos = 0
+        end = len(view)
+        self.needed = HEADER.size
+        try:
+            while end - pos >= HEADER.size:
+                (length,) = HEADER.unpack_from(view, pos)
+                if length > self.max_frame_size:
+                    raise ProtocolError(f"Слишком большой кадр: {length} байт")
+                begin = pos + HEADER.size
+                if end - begin < length:
+                    self.needed = HEADER.size + length
+                    break
+                messages.append(json.loads(str(view[begin:begin + length], 'utf-8')))
+                pos = begin + length
+        finally:
+            view.release()
+        self._keep(data, pos)
+        return messages
+
+    def feed_legacy(self, data):
+        """Разбор старого формата: подряд идущие JSON-объекты без разделителей.
+
+        Разбор останавливается после рукопожатия hello, чтобы следующие за ним
+        байты были прочитаны уже как кадры. Объект, оборванный концом
+        данных, остается в хвосте до следующего фрагмента; ошибка в
+        середине данных - ProtocolError.
+        """
+        if self.tail:
+            self.tail += data
+            text = str(self.tail, 'utf-8', 'surrogateescape')
+        else:
+            text = str(data, 'utf-8', 'surrogateescape')
+
+        messages = []
+        pos = 0
+        while pos < len(text):
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+            if pos == len(text):
+                break
+            try:
+                message, pos = _json_decoder.raw_decode(text, pos)
+            except json.JSONDecodeError as e:
+                if not _incomplete(text, e):
+                    raise ProtocolError(f"Неверный JSON: {e}") from e
+                break
+            messages.append(message)
+            if isinstance(message, dict) and message.get('type') == 'hello':
+                break
+        self._keep(data, len(text[:pos].encode('utf-8', 'surrogateescape')))
+        if len(self.tail) > self.max_frame_size:
+            raise ProtocolError(f"Слишком длинное сообщение: {len(self.tail)} байт")
+        return messages
+
+    def _keep(self, data, used):
+        """Сохранение неразобранного хвоста.
+
+        Если хвоста не было, копируется только незавершенная часть нового
+        фрагмента; иначе разобранное начало просто отрезается.
+        """
+        if self.tail:
+            del self.tail[:used]
+        else:
+            self.tail[:] = data[used:]
@@ -1,38 +1,101 @@
 import socket
 import threading
+import functools
 import json
 import time
 import logging
 from datetime import datetime
-import sqlite3
-import hashlib
-import os
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('server.log'),
-        logging.StreamHandler()
-    ]
-)
+import argparse
+
+from auth import AuthPool, hash_password
+from chat_history import ChatHistory, parse_time
+from config import AUDIO_CONFIG, AUTH_CONFIG, LOG_CONFIG, ROOM_CONFIG, SERVER_CONFIG
+from connection import OVERFLOW, QUEUED, SEND_FLAGS, SENT, ClientConnection, OutboundWriter
+from metrics import Metrics, MetricsEndpoint, render_prometheus
+from presence import Presence, PresenceBatcher
+from protocol import FRAMING, RECV_BUFFER_SIZE, encode_frame
+from server_logging import LogPipeline
+from storage import Storage
+from text_loop import SelectorTextServer
+from traffic_capture import TrafficRecorder
+from voice_bitrate import BitrateController
+from voice_mixer import VoiceMixer
+from voice_relay import VoiceRelay
+from voice_reports import VoiceReports
+from voice_shards import ShardedVoiceRelay
+
+# Текст сообщений чата - отдельной категорией, ее можно отключить
+# (LOG_CONFIG['chat_content']); обработчики лога - server_logging.py
+chat_log = logging.getLogger('chat')
 
 class VoiceChatServer:
-    def __init__(self, host='localhost', text_port=12345, voice_port=12346):
+    def __init__(self, host='localhost', text_port=12345, voice_port=12346,
+                 engine=SERVER_CONFIG['text_engine'],
+                 voice_workers=SERVER_CONFIG['voice_workers'],
+                 voice_mode=SERVER_CONFIG['voice_mode'],
+                 auth_workers=AUTH_CONFIG['workers'],
+                 metrics_port=SERVER_CONFIG['metrics_port'],
+                 capture_file=SERVER_CONFIG['capture_file']):
         self.host = host
         self.text_port = text_port
         self.voice_port = voice_port
+        self.engine = engine  # threaded | selector
+        self.voice_workers = voice_workers  # 0 - голос в этом процессе
+        self.voice_mode = voice_mode  # forward | mix
         self.clients = {}  # {client_socket: {'username': str, 'room': str}}
-        self.voice_clients = {}  # {client_socket: {'username': str, 'room': str}}
+        self.connections = {}  # {client_socket: ClientConnection}
         self.rooms = {'general': set()}  # {room_name: set of usernames}
+        self.room_members = {'general': set()}  # {room_name: set of client_socket}
+        # Версии составов комнат и готовые снимки; self.rooms изменяется только через нее
+        self.presence = Presence(self.rooms)
+        self.presence_subscribers = set()  # клиенты, получающие rooms_diff (get_rooms subscribe)
+        # Входы и выходы за окно - одним users_diff; None - каждое отдельным сообщением
+        self.presence_batcher = None
+        if ROOM_CONFIG['presence_batch'] > 0:
+            self.presence_batcher = PresenceBatcher(ROOM_CONFIG['presence_batch'], self.flush_presence)
+        self.user_sockets = {}  # {username: client_socket}
         self.banned_users = set()
         self.muted_users = set()
         self.admins = set()
         self.running = True
+        # Время обработчиков, рассылки, байты (metrics.py); None - без замеров
+        self.metrics = Metrics() if SERVER_CONFIG['metrics'] else None
+        self.metrics_port = metrics_port  # 0 - без HTTP /metrics
+        self.metrics_endpoint = None
+        # Запись входящего трафика (traffic_capture.py); None - без записи
+        self.recorder = TrafficRecorder(capture_file) if capture_file else None
+        self.message_handlers = {
+            'hello': self.handle_hello,
+            'login': self.handle_login,
+            'register': self.handle_register,
+            'chat': self.handle_chat_message,
+            'get_history': self.handle_get_history,
+            'join_room': self.handle_join_room,
+            'create_room': self.handle_create_room,
+            'get_rooms': self.send_rooms_list,
+            'get_users': self.send_users_list,
+            'admin_command': self.handle_admin_command,
+        }
+        
+        if engine not in ('threaded', 'selector'):
+            raise ValueError(f"Неизвестный режим сервера: {engine}")
+        if voice_mode not in ('forward', 'mix'):
+            raise ValueError(f"Неизвестный режим голоса: {voice_mode}")
+        if voice_mode == 'mix' and voice_workers:
+            # Для микса все кадры комнаты должны попадать в один процесс
+            raise ValueError("Микширование голоса недоступно в многопроцессном режиме")
+        self.text_loop = SelectorTextServer(self) if engine == 'selector' else None
+        # Кто дописывает очереди отправки, если сокет не принял все сразу:
+        # цикл событий или общий поток; None - поток на подключение
+        self.outbound_writer = self.text_loop
+        if self.text_loop is None and SEND_FLAGS:
+            self.outbound_writer = OutboundWriter()
         
         # Инициализация базы данных
+        self.auth_lock = threading.RLock()  # порядок сообщений во время проверки пароля
         self.init_database()
+        # Проверка паролей в отдельных процессах
+        self.auth = AuthPool(auth_workers)
         
         # Создание сокетов
         self.text_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -41,82 +104,142 @@ class VoiceChatServer:
         # Настройка сокетов
         self.text_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.voice_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        
+        # Ретрансляция голоса между участниками комнат
+        self.voice_reports = VoiceReports()  # отчеты клиентов о качестве приема
+        # Сервер переключает клиентам профиль качества по отчетам и нагрузке
+        self.bitrate = BitrateController() if SERVER_CONFIG['voice_bitrate_control'] else None
+        speaker_policy = {
+            'max_speakers': ROOM_CONFIG['voice_max_speakers'],
+            'speaker_limits': ROOM_CONFIG['voice_room_speakers'],
+            'on_talk': self.on_voice_activity,
+            'on_report': self.voice_reports.update,
+        }
+        if voice_workers:
+            self.voice_relay = ShardedVoiceRelay(host, voice_port, voice_workers, **speaker_policy)
+        else:
+            mixer = None
+            if voice_mode == 'mix':
+                mixer = VoiceMixer(self.voice_socket)
+            self.voice_relay = VoiceRelay(self.voice_socket, mixer=mixer, **speaker_policy)
+            self.voice_relay.recorder = self.recorder
 
     def init_database(self):
         """Инициализация базы данных пользователей"""
-        if not os.path.exists('server_data'):
-            os.makedirs('server_data')
-        
-        self.conn = sqlite3.connect('server_data/users.db', check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        
-        self.cursor.execute('''
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                username TEXT UNIQUE NOT NULL,
-                password_hash TEXT NOT NULL,
-                is_admin BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
+        self.storage = Storage(SERVER_CONFIG['database_path'])
+        self.history = ChatHistory(self.storage)
         
         # Создание админа по умолчанию
-        admin_pass = hashlib.sha256('admin123'.encode()).hexdigest()
-        try:
-            self.cursor.execute(
-                'INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, ?)',
-                ('admin', admin_pass, True)
-            )
-            self.conn.commit()
-            logging.info("Создан пользователь admin с паролем admin123")
-        except sqlite3.IntegrityError:
-            pass
+        if self.storage.user_credentials('admin') is None:
+            admin_pass = hash_password('admin123')
+            if self.storage.create_user('admin', admin_pass, is_admin=True).result():
+                logging.info("Создан пользователь admin с паролем admin123")
 
-    def hash_password(self, password):
-        """Хеширование пароля"""
-        return hashlib.sha256(password.encode()).hexdigest()
+    def load_credentials(self, username):
+        """(хеш пароля, is_admin) пользователя или None"""
+        return self.storage.user_credentials(username)
 
-    def authenticate_user(self, username, password):
-        """Проверка учетных данных пользователя"""
-        password_hash = self.hash_password(password)
-        self.cursor.execute(
-            'SELECT is_admin FROM users WHERE username = ? AND password_hash = ?',
-            (username, password_hash)
-        )
-        result = self.cursor.fetchone()
-        return result
+    def user_exists(self, username):
+        return self.load_credentials(username) is not None
 
-    def register_user(self, username, password):
-        """Регистрация нового пользователя"""
-        password_hash = self.hash_password(password)
-        try:
-            self.cursor.execute(
-                'INSERT INTO users (username, password_hash) VALUES (?, ?)',
-                (username, password_hash)
-            )
-            self.conn.commit()
+    def submit_auth(self, client_socket, submit, handler, *args):
+        """Передача пароля в пул; handler получит результат в потоке сервера.
+        
+        Пока пароль проверяется, следующие сообщения клиента откладываются и
+        обрабатываются после handler в исходном порядке (например, login
+        сразу после register).
+        """
+        conn = self.connections.get(client_socket)
+        if conn is None:
             return True
-        except sqlite3.IntegrityError:
+        
+        def done(result, error):
+            if self.text_loop:
+                self.text_loop.call_soon(self.finish_auth, conn, handler, args, result, error)
+            else:
+                self.finish_auth(conn, handler, args, result, error)
+        
+        with self.auth_lock:
+            was_pending = conn.auth_pending
+            conn.auth_pending = True
+            conn.auth_checking = True
+            if submit(done):
+                return True
+            conn.auth_checking = False
+            conn.auth_pending = was_pending
             return False
 
+    def finish_auth(self, conn, handler, args, result, error):
+        """Результат пула паролей, затем отложенные сообщения клиента.
+        
+        auth_pending снимается только после разбора отложенного и под той же
+        блокировкой, поэтому новое сообщение не обгонит отложенные. Если
+        отложенное сообщение само отправило пароль на проверку, остальные
+        ждут ее результата.
+        """
+        with self.auth_lock:
+            conn.auth_checking = False
+            try:
+                if self.connections.get(conn.sock) is conn:
+                    handler(conn.sock, *args, result, error)
+            finally:
+                while conn.deferred and not conn.auth_checking:
+                    if self.connections.get(conn.sock) is not conn:
+                        conn.deferred.clear()
+                        break
+                    message = conn.deferred.pop(0)
+                    try:
+                        self.dispatch_message(conn.sock, message)
+                    except Exception as e:
+                        logging.error(f"Ошибка обработки сообщения: {e}")
+                if not conn.auth_checking:
+                    conn.auth_pending = False
+
     def start_server(self):
         """Запуск сервера"""
         try:
             # Запуск текстового сервера
             self.text_socket.bind((self.host, self.text_port))
             self.text_socket.listen(50)
-            logging.info(f"Текстовый сервер запущен на {self.host}:{self.text_port}")
+            logging.info(
+                f"Текстовый сервер запущен на {self.host}:{self.text_port} "
+                f"(режим: {self.engine})"
+            )
             
             # Запуск голосового сервера
-            self.voice_socket.bind((self.host, self.voice_port))
-            logging.info(f"Голосовой сервер запущен на {self.host}:{self.voice_port}")
+            if self.voice_workers:
+                # Порт слушают процессы-обработчики, главный процесс только управляет ими
+                self.voice_relay.start()
+                logging.info(
+                    f"Голосовой сервер запущен на {self.host}:{self.voice_port} "
+                    f"(процессов: {self.voice_workers})"
+                )
+            else:
+                self.voice_socket.bind((self.host, self.voice_port))
+                logging.info(f"Голосовой сервер запущен на {self.host}:{self.voice_port}")
             
             # Запуск потоков
-            text_thread = threading.Thread(target=self.handle_text_connections)
+            if self.text_loop:
+                text_thread = threading.Thread(target=self.text_loop.run)
+            else:
+                text_thread = threading.Thread(target=self.handle_text_connections)
             voice_thread = threading.Thread(target=self.handle_voice_connections)
             
             text_thread.start()
             voice_thread.start()
+            if self.bitrate is not None:
+                threading.Thread(target=self.adapt_voice_quality, daemon=True).start()
+            if self.presence_batcher is not None:
+                self.presence_batcher.start()
+            if self.recorder is not None:
+                self.recorder.start()
+                if self.voice_workers:
+                    logging.warning("Голосовые пакеты не записываются в многопроцессном режиме")
+            if self.metrics is not None and self.metrics_port:
+                self.metrics_endpoint = MetricsEndpoint(self.render_metrics, self.metrics_port).start()
+                logging.info(
+                    f"Метрики Prometheus: http://127.0.0.1:{self.metrics_endpoint.port}/metrics"
+                )
             
             logging.info("Сервер успешно запущен!")
             
@@ -127,6 +250,11 @@ class VoiceChatServer:
                     if cmd.lower() == 'stop':
                         self.stop_server()
                         break
+                except EOFError:
+                    # Консоль недоступна (запуск в фоне) - работаем до остановки
+                    while self.running:
+                        time.sleep(1)
+                    break
                 except KeyboardInterrupt:
                     self.stop_server()
                     break
@@ -140,6 +268,7 @@ class VoiceChatServer:
             try:
                 client_socket, address = self.text_socket.accept()
                 logging.info(f"Новое подключение: {address}")
+                self.new_connection(client_socket, address)
                 
                 client_thread = threading.Thread(
                     target=self.handle_text_client,
@@ -151,42 +280,94 @@ class VoiceChatServer:
                 if self.running:
                     logging.error(f"Ошибка при принятии соединения: {e}")
 
+    def new_connection(self, client_socket, address):
+        """Регистрация нового TCP-подключения"""
+        conn = ClientConnection(
+            client_socket, address,
+            high_water=SERVER_CONFIG['outbound_high_water'],
+            hard_limit=SERVER_CONFIG['outbound_hard_limit'],
+            slow_timeout=SERVER_CONFIG['slow_consumer_timeout'],
+            nonblocking=self.text_loop is not None
+        )
+        self.connections[client_socket] = conn
+        if self.recorder is not None:
+            self.recorder.connect(conn)
+        return conn
+
     def handle_text_client(self, client_socket, address):
         """Обработка текстового клиента"""
+        conn = self.connections.get(client_socket)
+        recv_buffer = bytearray(RECV_BUFFER_SIZE // 4)
+        recv_view = memoryview(recv_buffer)
         try:
-            while self.running:
-                data = client_socket.recv(1024).decode('utf-8')
-                if not data:
+            while self.running and conn is not None:
+                nbytes = client_socket.recv_into(recv_view)
+                if not nbytes:
                     break
                 
-                message = json.loads(data)
-                self.process_message(client_socket, message)
+                self.handle_incoming(conn, recv_view[:nbytes])
                 
         except Exception as e:
             logging.error(f"Ошибка с клиентом {address}: {e}")
         finally:
             self.disconnect_client(client_socket)
 
+    def handle_incoming(self, conn, data):
+        """Разбор полученных данных и передача сообщений обработчику"""
+        if self.metrics is not None:
+            self.metrics.received(len(data))
+        messages = conn.read_messages(data)
+        recorder = self.recorder
+        while messages:
+            was_framed = conn.framed
+            for message in messages:
+                if recorder is not None:
+                    recorder.message(conn, message)
+                self.process_message(conn.sock, message)
+            # После рукопожатия остаток буфера уже состоит из кадров
+            messages = conn.read_messages(b'') if conn.framed != was_framed else []
+
     def process_message(self, client_socket, message):
         """Обработка сообщений от клиента"""
+        conn = self.connections.get(client_socket)
+        if conn is not None and conn.auth_pending:
+            with self.auth_lock:
+                if conn.auth_pending:
+                    conn.deferred.append(message)
+                    return
+        self.dispatch_message(client_socket, message)
+
+    def dispatch_message(self, client_socket, message):
+        """Вызов обработчика сообщения с замером времени"""
         msg_type = message.get('type')
+        handler = self.message_handlers.get(msg_type)
+        metrics = self.metrics
+        if metrics is None:
+            if handler is not None:
+                handler(client_socket, message)
+            return
+        
+        # Тип из сообщения клиента в метки не попадает: только известные
+        if handler is None:
+            metrics.observe_message('unknown', 0.0)
+            return
+        failed = True
+        started = time.perf_counter()
+        try:
+            handler(client_socket, message)
+            failed = False
+        finally:
+            metrics.observe_message(msg_type, time.perf_counter() - started, failed)
+
+    def handle_hello(self, client_socket, message):
+        """Рукопожатие: переход подключения на кадры с префиксом длины"""
+        conn = self.connections.get(client_socket)
+        if conn is None or conn.framed or message.get('framing') != FRAMING:
+            return
         
-        if msg_type == 'login':
-            self.handle_login(client_socket, message)
-        elif msg_type == 'register':
-            self.handle_register(client_socket, message)
-        elif msg_type == 'chat':
-            self.handle_chat_message(client_socket, message)
-        elif msg_type == 'join_room':
-            self.handle_join_room(client_socket, message)
-        elif msg_type == 'create_room':
-            self.handle_create_room(client_socket, message)
-        elif msg_type == 'get_rooms':
-            self.send_rooms_list(client_socket)
-        elif msg_type == 'get_users':
-            self.send_users_list(client_socket)
-        elif msg_type == 'admin_command':
-            self.handle_admin_command(client_socket, message)
+        # Ответ уходит еще в старом формате, дальше - только кадры
+        self.send_message(client_socket, {'type': 'hello', 'framing': FRAMING})
+        conn.framed = True
 
     def handle_login(self, client_socket, message):
         """Обработка входа пользователя"""
@@ -200,9 +381,44 @@ class VoiceChatServer:
             })
             return
         
-        auth_result = self.authenticate_user(username, password)
-        if auth_result:
-            is_admin = auth_result[0]
+        # Хеш считается в пуле процессов, ответ - в finish_login
+        credentials = self.load_credentials(username)
+        stored = credentials[0] if credentials else None
+        submit = functools.partial(self.auth.verify, password, stored)
+        if not self.submit_auth(client_socket, submit, self.finish_login, username, credentials):
+            self.send_message(client_socket, {
+                'type': 'error',
+                'message': 'Сервер занят, повторите вход позже'
+            })
+
+    def finish_login(self, client_socket, username, credentials, result, error):
+        """Завершение входа после проверки пароля"""
+        if client_socket in self.clients:
+            # Уже вошел, пока проверялся пароль
+            self.send_message(client_socket, {
+                'type': 'error',
+                'message': 'Вы уже вошли в систему'
+            })
+            return
+        if error is not None:
+            self.send_message(client_socket, {
+                'type': 'error',
+                'message': 'Ошибка проверки пароля, повторите вход'
+            })
+            return
+        
+        ok, upgraded_hash = result
+        if ok and username in self.banned_users:
+            self.send_message(client_socket, {
+                'type': 'error',
+                'message': 'Вы заблокированы на сервере'
+            })
+            return
+        if ok:
+            if upgraded_hash:
+                self.storage.set_password_hash(username, upgraded_hash)
+                logging.info(f"Хеш пароля пользователя {username} переведен на новый формат")
+            is_admin = credentials[1]
             self.clients[client_socket] = {
                 'username': username,
                 'room': 'general',
@@ -212,20 +428,23 @@ class VoiceChatServer:
             if is_admin:
                 self.admins.add(username)
             
-            self.rooms['general'].add(username)
+            self.user_sockets[username] = client_socket
+            room_version = self.add_to_room(client_socket, username, 'general')
+            voice_token = self.voice_relay.issue_token(username, 'general')
             
             self.send_message(client_socket, {
                 'type': 'login_success',
                 'username': username,
-                'is_admin': is_admin
+                'is_admin': is_admin,
+                'voice_token': voice_token,
+                'voice_id': self.voice_relay.voice_id(username),
+                'voice_port': self.voice_port,
+                'history': self.history.recent('general'),
+                'room_version': room_version
             })
             
             # Уведомление о входе
-            self.broadcast_to_room('general', {
-                'type': 'user_joined',
-                'username': username,
-                'timestamp': datetime.now().strftime('%H:%M:%S')
-            }, exclude=client_socket)
+            self.announce_presence('general', username, True, room_version, exclude=client_socket)
             
             logging.info(f"Пользователь {username} вошел в систему")
             
@@ -240,7 +459,38 @@ class VoiceChatServer:
         username = message['username']
         password = message['password']
         
-        if self.register_user(username, password):
+        if self.user_exists(username):
+            self.send_message(client_socket, {
+                'type': 'error',
+                'message': 'Пользователь с таким именем уже существует'
+            })
+            return
+        
+        def submit(done):
+            # Хеш в пуле паролей, затем запись в поток БД; ответ - после записи
+            def hashed(password_hash, error):
+                if error is not None:
+                    done(None, error)
+                else:
+                    self.storage.create_user(username, password_hash, done)
+            return self.auth.hash(password, hashed)
+        
+        if not self.submit_auth(client_socket, submit, self.finish_register, username):
+            self.send_message(client_socket, {
+                'type': 'error',
+                'message': 'Сервер занят, повторите регистрацию позже'
+            })
+
+    def finish_register(self, client_socket, username, created, error):
+        """Завершение регистрации после хеширования и записи в базу"""
+        if error is not None:
+            self.send_message(client_socket, {
+                'type': 'error',
+                'message': 'Ошибка регистрации, повторите позже'
+            })
+            return
+        
+        if created:
             self.send_message(client_socket, {
                 'type': 'register_success',
                 'message': 'Регистрация успешна! Теперь вы можете войти.'
@@ -267,16 +517,45 @@ class VoiceChatServer:
             })
             return
         
-        chat_message = {
-            'type': 'chat_message',
-            'username': username,
-            'message': message['message'],
-            'room': room,
-            'timestamp': datetime.now().strftime('%H:%M:%S')
-        }
+        # Номер и время сообщения назначает история; запись в базу - пачками
+        chat_message = self.history.append(room, username, message['message'])
         
         self.broadcast_to_room(room, chat_message)
-        logging.info(f"[{room}] {username}: {message['message']}")
+        chat_log.info("[%s] %s: %s", room, username, chat_message['message'],
+                      extra={'room': room, 'user': username})
+
+    def handle_get_history(self, client_socket, message):
+        """Страница истории комнаты: сообщения старше before (id)"""
+        if client_socket not in self.clients:
+            return
+        
+        room = message.get('room') or self.clients[client_socket]['room']
+        if room not in self.rooms:
+            self.send_message(client_socket, {
+                'type': 'error',
+                'message': f'Комната {room} не найдена'
+            })
+            return
+        
+        try:
+            before = message.get('before')
+            before = int(before) if before is not None else None
+            limit = int(message.get('limit') or ROOM_CONFIG['history_page'])
+        except (TypeError, ValueError):
+            self.send_message(client_socket, {
+                'type': 'error',
+                'message': 'Неверные параметры запроса истории'
+            })
+            return
+        
+        limit = max(1, min(limit, ROOM_CONFIG['history_page']))
+        messages, more = self.history.page(room, before, limit)
+        self.send_message(client_socket, {
+            'type': 'history',
+            'room': room,
+            'messages': messages,
+            'more': more
+        })
 
     def handle_join_room(self, client_socket, message):
         """Обработка присоединения к комнате"""
@@ -289,41 +568,35 @@ class VoiceChatServer:
         
         # Покидаем старую комнату
         if old_room in self.rooms:
-            self.rooms[old_room].discard(username)
-            self.broadcast_to_room(old_room, {
-                'type': 'user_left',
-                'username': username,
-                'timestamp': datetime.now().strftime('%H:%M:%S')
-            })
+            old_version = self.remove_from_room(client_socket, username, old_room)
+            self.announce_presence(old_room, username, False, old_version)
         
         # Присоединяемся к новой комнате
-        if new_room not in self.rooms:
-            self.rooms[new_room] = set()
-        
-        self.rooms[new_room].add(username)
+        version = self.add_to_room(client_socket, username, new_room)
         self.clients[client_socket]['room'] = new_room
+        self.voice_relay.set_room(username, new_room)
         
         self.send_message(client_socket, {
             'type': 'room_joined',
-            'room': new_room
+            'room': new_room,
+            'history': self.history.recent(new_room),
+            'version': version
         })
         
-        self.broadcast_to_room(new_room, {
-            'type': 'user_joined',
-            'username': username,
-            'timestamp': datetime.now().strftime('%H:%M:%S')
-        }, exclude=client_socket)
+        self.announce_presence(new_room, username, True, version, exclude=client_socket)
 
     def handle_create_room(self, client_socket, message):
         """Создание новой комнаты"""
         room_name = message['room_name']
         
-        if room_name not in self.rooms:
-            self.rooms[room_name] = set()
+        directory_version = self.presence.create_room(room_name)
+        if directory_version is not None:
+            self.room_members.setdefault(room_name, set())
             self.send_message(client_socket, {
                 'type': 'room_created',
                 'room': room_name
             })
+            self.publish_room_count(room_name, directory_version, 0)
             logging.info(f"Создана новая комната: {room_name}")
         else:
             self.send_message(client_socket, {
@@ -349,6 +622,7 @@ class VoiceChatServer:
         
         if command == 'mute' and target:
             self.muted_users.add(target)
+            self.voice_relay.set_blocked(target, True)
             self.send_message(client_socket, {
                 'type': 'admin_response',
                 'message': f'Пользователь {target} заблокирован в чате'
@@ -356,6 +630,7 @@ class VoiceChatServer:
             
         elif command == 'unmute' and target:
             self.muted_users.discard(target)
+            self.voice_relay.set_blocked(target, target in self.banned_users)
             self.send_message(client_socket, {
                 'type': 'admin_response',
                 'message': f'Пользователь {target} разблокирован в чате'
@@ -363,79 +638,464 @@ class VoiceChatServer:
             
         elif command == 'ban' and target:
             self.banned_users.add(target)
+            self.voice_relay.set_blocked(target, True)
             # Отключаем забаненного пользователя
-            for sock, client_info in self.clients.items():
-                if client_info['username'] == target:
-                    self.disconnect_client(sock)
-                    break
+            target_socket = self.user_sockets.get(target)
+            if target_socket is not None:
+                self.disconnect_client(target_socket)
             
             self.send_message(client_socket, {
                 'type': 'admin_response',
                 'message': f'Пользователь {target} заблокирован на сервере'
             })
+            
+        elif command == 'queues':
+            self.send_message(client_socket, {
+                'type': 'admin_response',
+                'message': 'Очереди отправки клиентов',
+                'queues': self.outbound_queue_stats()
+            })
+            
+        elif command == 'metrics':
+            if self.metrics is None:
+                self.send_message(client_socket, {
+                    'type': 'error',
+                    'message': 'Сбор метрик отключен (SERVER_CONFIG[\'metrics\'])'
+                })
+                return
+            self.send_message(client_socket, {
+                'type': 'admin_response',
+                'message': 'Метрики сервера',
+                'metrics': self.metrics_snapshot()
+            })
+            
+        elif command == 'speakers' and target:
+            # target - комната, limit - сколько говорящих пересылать (0 - все)
+            limit = message.get('limit')
+            if limit is not None:
+                if not isinstance(limit, int) or isinstance(limit, bool) or limit < 0:
+                    self.send_message(client_socket, {
+                        'type': 'error',
+                        'message': 'Лимит говорящих должен быть неотрицательным целым'
+                    })
+                    return
+                self.voice_relay.set_speaker_limit(target, limit)
+            
+            limit = self.voice_relay.speaker_limit(target)
+            self.send_message(client_socket, {
+                'type': 'admin_response',
+                'message': f'Лимит говорящих в комнате {target}: {limit or "без ограничения"}',
+                'room': target,
+                'limit': limit,
+                'voice': self.voice_relay.stats()
+            })
+            
+        elif command == 'voice_quality':
+            # target - комната или пользователь; без target - все комнаты
+            names = self.voice_sender_names()
+            if target is None:
+                self.send_message(client_socket, {
+                    'type': 'admin_response',
+                    'message': 'Качество голоса по комнатам',
+                    'rooms': self.voice_reports.overview(names),
+                    'bitrate': self.bitrate.stats() if self.bitrate is not None else None
+                })
+            elif target in self.rooms:
+                self.send_message(client_socket, {
+                    'type': 'admin_response',
+                    'message': f'Качество голоса в комнате {target}',
+                    'quality': self.voice_reports.room_summary(target, names)
+                })
+            else:
+                summary = self.voice_reports.user_summary(target, names)
+                if summary is None:
+                    self.send_message(client_socket, {
+                        'type': 'error',
+                        'message': f'Нет свежих отчетов о голосе от {target}'
+                    })
+                    return
+                self.send_message(client_socket, {
+                    'type': 'admin_response',
+                    'message': f'Качество голоса у {target}',
+                    'quality': summary
+                })
+            
+        elif command == 'search':
+            # query - текст; room, user, since, until - фильтры; before - курсор
+            query = message.get('query') or ''
+            room = message.get('room')
+            user = message.get('user')
+            try:
+                if not all(value is None or isinstance(value, str) for value in (query, room, user)):
+                    raise TypeError("query, room и user - строки")
+                before = int(message['before']) if message.get('before') is not None else None
+                limit = int(message.get('limit') or ROOM_CONFIG['history_page'])
+            except (TypeError, ValueError):
+                self.send_message(client_socket, {
+                    'type': 'error',
+                    'message': 'Неверные параметры поиска'
+                })
+                return
+            try:
+                results, more = self.history.search(
+                    query,
+                    room=room,
+                    username=user,
+                    since=parse_time(message.get('since')),
+                    until=parse_time(message.get('until')),
+                    before=before,
+                    limit=limit
+                )
+            except ValueError as e:
+                self.send_message(client_socket, {
+                    'type': 'error',
+                    'message': str(e)
+                })
+                return
+            self.send_message(client_socket, {
+                'type': 'admin_response',
+                'message': f'Найдено сообщений: {len(results)}' + (' (есть еще)' if more else ''),
+                'results': results,
+                'more': more,
+                'before': results[-1]['id'] if more else None
+            })
+            
+        elif command == 'kick' and target:
+            target_socket = self.user_sockets.get(target)
+            if target_socket is None:
+                self.send_message(client_socket, {
+                    'type': 'error',
+                    'message': f'Пользователь {target} не в сети'
+                })
+                return
+            
+            self.disconnect_client(target_socket)
+            self.send_message(client_socket, {
+                'type': 'admin_response',
+                'message': f'Пользователь {target} отключен от сервера'
+            })
+
+    def voice_sender_names(self):
+        """voice_id -> имя для подписи потоков в отчетах"""
+        return {
+            self.voice_relay.voice_id(username): username
+            for username in list(self.user_sockets)
+        }
 
-    def send_rooms_list(self, client_socket):
-        """Отправка списка комнат"""
-        rooms_info = {}
-        for room, users in self.rooms.items():
-            rooms_info[room] = len(users)
+    def outbound_queue_stats(self):
+        """Глубина очереди отправки для каждого подключения, самые загруженные первыми"""
+        stats = []
+        for client_socket, conn in list(self.connections.items()):
+            client_info = self.clients.get(client_socket)
+            entry = conn.stats()
+            entry['username'] = client_info['username'] if client_info else None
+            entry['address'] = f'{conn.address[0]}:{conn.address[1]}'
+            stats.append(entry)
+        stats.sort(key=lambda entry: entry['queued_bytes'], reverse=True)
+        return stats
+
+    def server_counters(self):
+        """Счетчики и текущие значения других частей сервера для метрик"""
+        voice = self.voice_relay.stats()
+        storage = self.storage.stats()
+        history = self.history.stats()
+        auth = self.auth.stats()
+        counters = {
+            'voice_received_packets': voice.get('received', 0),
+            'voice_forwarded_packets': voice['forwarded'],
+            'voice_rejected_packets': voice['rejected'],
+            'storage_writes': storage['writes'],
+            'storage_commits': storage['commits'],
+            'storage_failed': storage['failed'],
+            'history_stored': history['stored'],
+            'history_dropped': history['dropped'],
+            'auth_completed': auth['completed'],
+            'auth_rejected': auth['rejected'],
+        }
+        gauges = {
+            'connections': len(self.connections),
+            'clients': len(self.clients),
+            'rooms': len(self.rooms),
+            'active_rooms': sum(1 for members in list(self.room_members.values()) if members),
+            'voice_registered': voice['registered'],
+            'voice_talking': voice['talking'],
+            'storage_queued': storage['queued'],
+            'history_pending': history['pending'],
+            'auth_pending': auth['pending'],
+            'presence_subscribers': len(self.presence_subscribers),
+        }
+        if self.recorder is not None:
+            capture = self.recorder.stats()
+            counters['capture_records'] = capture['records']
+            counters['capture_dropped'] = capture['dropped']
+        return counters, gauges
+
+    def metrics_snapshot(self):
+        """Метрики для команды metrics"""
+        snapshot = self.metrics.snapshot()
+        counters, gauges = self.server_counters()
+        snapshot.update(gauges)
+        snapshot['voice'] = {
+            'received': counters['voice_received_packets'],
+            'forwarded': counters['voice_forwarded_packets'],
+            'received_per_second': self.metrics.per_second(
+                'voice_received', counters['voice_received_packets']
+            ),
+            'forwarded_per_second': self.metrics.per_second(
+                'voice_forwarded', counters['voice_forwarded_packets']
+            ),
+        }
+        snapshot['counters'] = counters
+        return snapshot
+
+    def render_metrics(self):
+        """Метрики в текстовом формате Prometheus (GET /metrics)"""
+        counters, gauges = self.server_counters()
+        return render_prometheus(self.metrics, counters, gauges)
+
+    def send_rooms_list(self, client_socket, message=None):
+        """Список комнат: снимок или rooms_diff с версии since.
         
-        self.send_message(client_socket, {
-            'type': 'rooms_list',
-            'rooms': rooms_info
-        })
+        subscribe - дальше присылать rooms_diff при каждом изменении.
+        """
+        message = message or {}
+        if message.get('subscribe'):
+            self.presence_subscribers.add(client_socket)
+        if message.get('since') is not None:
+            diff = self.presence.rooms_diff(message['since'], message.get('epoch'))
+            if diff is not None:
+                self.send_message(client_socket, diff)
+                return
+        self.write_to_client(client_socket, self.presence.rooms_payload())
 
-    def send_users_list(self, client_socket):
-        """Отправка списка пользователей в комнате"""
+    def send_users_list(self, client_socket, message=None):
+        """Участники комнаты (по умолчанию своей): снимок или users_diff с версии since"""
         if client_socket not in self.clients:
             return
         
-        room = self.clients[client_socket]['room']
-        users = list(self.rooms.get(room, set()))
-        
-        self.send_message(client_socket, {
-            'type': 'users_list',
-            'users': users,
-            'room': room
-        })
+        message = message or {}
+        room = message.get('room') or self.clients[client_socket]['room']
+        if message.get('since') is not None:
+            diff = self.presence.users_diff(room, message['since'], message.get('epoch'))
+            if diff is not None:
+                self.send_message(client_socket, diff)
+                return
+        payload = self.presence.users_payload(room)
+        if payload is None:
+            self.send_message(client_socket, {
+                'type': 'error',
+                'message': f'Комната {room} не найдена'
+            })
+            return
+        self.write_to_client(client_socket, payload)
 
-    def handle_voice_connections(self):
-        """Обработка голосовых соединений"""
+    def on_voice_activity(self, username, room, speaking):
+        """Начало или конец речи участника (по пакетам голоса) - всей комнате"""
+        self.broadcast_to_room(room, {
+            'type': 'voice_activity',
+            'username': username,
+            'speaking': speaking
+        }, droppable=True)
+
+    def adapt_voice_quality(self):
+        """Периодический пересмотр профилей качества голоса клиентов"""
+        interval = AUDIO_CONFIG['report_interval']
         while self.running:
+            time.sleep(interval)
             try:
-                data, address = self.voice_socket.recvfrom(4096)
-                
-                # Ретрансляция голосовых данных другим клиентам в той же комнате
-                self.broadcast_voice_data(data, address)
-                
+                self.bitrate.observe_load(self.voice_relay.stats())
+                names = self.voice_sender_names()
+                health = {
+                    names[voice_id]: values
+                    for voice_id, values in self.voice_reports.sender_health().items()
+                    if voice_id in names
+                }
+                changes = self.bitrate.evaluate(list(self.user_sockets), health)
             except Exception as e:
-                if self.running:
-                    logging.error(f"Ошибка голосового соединения: {e}")
+                logging.error(f"Ошибка выбора качества голоса: {e}")
+                continue
+            for username, (quality, reason) in changes.items():
+                client_socket = self.user_sockets.get(username)
+                if client_socket is None:
+                    continue
+                self.send_message(client_socket, {
+                    'type': 'voice_quality',
+                    'quality': quality,
+                    'reason': reason
+                })
+                logging.info(f"Качество голоса {username}: {quality} ({reason})")
 
-    def broadcast_voice_data(self, voice_data, sender_address):
-        """Ретрансляция голосовых данных"""
-        # Здесь можно добавить логику для определения комнаты отправителя
-        # и отправки данных только участникам этой комнаты
-        pass
+    def handle_voice_connections(self):
+        """Обработка голосовых соединений"""
+        self.voice_relay.serve(lambda: self.running)
 
-    def broadcast_to_room(self, room, message, exclude=None):
-        """Отправка сообщения всем пользователям в комнате"""
-        if room not in self.rooms:
+    def broadcast_to_room(self, room, message, exclude=None, droppable=False):
+        """Отправка сообщения всем пользователям в комнате.
+
+        droppable - сообщение можно пропустить для клиентов с переполненной
+        очередью отправки (уведомления о присутствии).
+        """
+        self.broadcast(self.room_members.get(room), message, exclude, droppable)
+
+    def broadcast(self, members, message, exclude=None, droppable=False):
+        """Отправка сообщения (или готового payload) клиентам members, сериализация - один раз"""
+        if not members:
             return
         
-        users_in_room = self.rooms[room]
-        for client_socket, client_info in self.clients.items():
-            if (client_info['username'] in users_in_room and 
-                client_socket != exclude):
-                self.send_message(client_socket, message)
+        started = time.perf_counter()
+        recipients = 0
+        sent = 0
+        # Сериализуем один раз: все получатели разделяют одни и те же байты
+        payload = message if isinstance(message, bytes) else json.dumps(message).encode('utf-8')
+        frame = None
+        start_writer = self.outbound_writer is None
+        for client_socket in tuple(members):
+            if client_socket == exclude:
+                continue
+            conn = self.connections.get(client_socket)
+            if conn is None or conn.closed:
+                continue
+            if conn.framed:
+                if frame is None:
+                    frame = encode_frame(payload)
+                data = frame
+            else:
+                data = payload
+            try:
+                result = conn.queue(data, droppable, start_writer)
+                if result != SENT:
+                    result = self.queued(conn, result)
+                if result in (SENT, QUEUED):
+                    recipients += 1
+                    sent += len(data)
+            except Exception as e:
+                logging.error("Ошибка отправки сообщения: %s", e)
+        if self.metrics is not None:
+            self.metrics.observe_broadcast(recipients, sent, time.perf_counter() - started)
+
+    def add_to_room(self, client_socket, username, room):
+        """Добавление клиента в комнату с обновлением индекса участников.
+        
+        Возвращает версию состава комнаты после изменения.
+        """
+        change = self.presence.join(room, username)
+        self.room_members.setdefault(room, set()).add(client_socket)
+        if change is None:
+            return self.presence.room_version(room)
+        version, directory_version, count = change
+        self.publish_room_count(room, directory_version, count)
+        return version
+
+    def remove_from_room(self, client_socket, username, room):
+        """Удаление клиента из комнаты и из индекса участников; версия комнаты"""
+        change = self.presence.leave(room, username)
+        members = self.room_members.get(room)
+        if members is not None:
+            members.discard(client_socket)
+        if change is None:
+            return self.presence.room_version(room)
+        version, directory_version, count = change
+        self.publish_room_count(room, directory_version, count)
+        return version
+
+    def announce_presence(self, room, username, joined, version, exclude=None):
+        """user_joined/user_left участникам комнаты: сразу или в users_diff за окно"""
+        if self.presence_batcher is not None:
+            self.presence_batcher.room_changed(room, version)
+            return
+        self.broadcast_to_room(room, {
+            'type': 'user_joined' if joined else 'user_left',
+            'username': username,
+            'version': version,
+            'timestamp': datetime.now().strftime('%H:%M:%S')
+        }, exclude=exclude, droppable=True)
+
+    def flush_presence(self, rooms, directory_since):
+        """Рассылка собранного PresenceBatcher: users_diff комнатам, rooms_diff подписчикам.
+
+        Если журнал не покрывает окно - снимок users_list/rooms_list. Окно,
+        в котором все входы и выходы сократились, ничего не рассылает.
+        """
+        for room, since in rooms.items():
+            diff = self.presence.users_diff(room, since)
+            if diff is None:
+                self.broadcast_to_room(room, self.presence.users_payload(room), droppable=True)
+            elif diff['joined'] or diff['left']:
+                self.broadcast_to_room(room, diff, droppable=True)
+        if directory_since is not None and self.presence_subscribers:
+            diff = self.presence.rooms_diff(directory_since)
+            if diff is None:
+                self.broadcast(tuple(self.presence_subscribers), self.presence.rooms_payload(), droppable=True)
+            elif diff['rooms']:
+                self.broadcast(tuple(self.presence_subscribers), diff, droppable=True)
+
+    def publish_room_count(self, room, directory_version, count):
+        """rooms_diff подписчикам списка комнат: новое число участников комнаты"""
+        if not self.presence_subscribers:
+            return
+        if self.presence_batcher is not None:
+            self.presence_batcher.directory_changed(directory_version)
+            return
+        self.broadcast(tuple(self.presence_subscribers), {
+            'type': 'rooms_diff',
+            'epoch': self.presence.epoch,
+            'from': directory_version - 1,
+            'version': directory_version,
+            'rooms': {room: count}
+        }, droppable=True)
 
     def send_message(self, client_socket, message):
         """Отправка сообщения клиенту"""
         try:
-            data = json.dumps(message).encode('utf-8')
-            client_socket.send(data)
+            payload = json.dumps(message).encode('utf-8')
+            self.write_to_client(client_socket, payload)
         except Exception as e:
-            logging.error(f"Ошибка отправки сообщения: {e}")
+            logging.error("Ошибка отправки сообщения: %s", e)
+
+    def write_to_client(self, client_socket, payload):
+        """Передача JSON-payload клиенту в формате его подключения"""
+        conn = self.connections.get(client_socket)
+        if conn is None or conn.closed:
+            return
+        data = conn.wire_bytes(payload)
+        if self.write_wire(conn, data) in (SENT, QUEUED) and self.metrics is not None:
+            self.metrics.sent(len(data))
+
+    def write_wire(self, conn, data, droppable=False):
+        """Отправка готовых байтов подключению без блокировки.
+
+        Что не поместилось в буфер сокета, остается в очереди подключения;
+        ее разбирает цикл событий (selector) или OutboundWriter (threaded),
+        поэтому отправитель никогда не блокируется на медленном клиенте.
+        Результат - SENT, QUEUED, DROPPED или OVERFLOW.
+        """
+        result = conn.queue(data, droppable, start_writer=self.outbound_writer is None)
+        if result == SENT:
+            return result
+        return self.queued(conn, result)
+
+    def queued(self, conn, result):
+        """Продолжение write_wire, если данные не ушли сразу: остаток - на
+        дописывание, переполнение - отключение клиента"""
+        if result == OVERFLOW:
+            self.evict_slow_consumer(conn)
+        elif result == QUEUED and self.outbound_writer is not None:
+            self.outbound_writer.request_write(conn)
+        return result
+
+    def evict_slow_consumer(self, conn):
+        """Отключение клиента, который не успевает читать свою очередь"""
+        stats = conn.stats()
+        logging.warning(
+            f"Медленный клиент {conn.address} отключен: "
+            f"в очереди {stats['queued_bytes']} байт, пропущено {stats['dropped']}"
+        )
+        conn.close()
+        # Поток чтения (или цикл событий) получит EOF и вызовет disconnect_client
+        try:
+            conn.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
 
     def disconnect_client(self, client_socket):
         """Отключение клиента"""
@@ -445,24 +1105,39 @@ class VoiceChatServer:
             room = client_info['room']
             
             # Удаляем из комнаты
-            if room in self.rooms:
-                self.rooms[room].discard(username)
+            version = self.remove_from_room(client_socket, username, room)
             
             # Удаляем из админов
             self.admins.discard(username)
+            if self.user_sockets.get(username) is client_socket:
+                del self.user_sockets[username]
+                self.voice_relay.remove_user(username)
+                self.voice_reports.remove(username)
+                if self.bitrate is not None:
+                    self.bitrate.forget(username)
             
             # Удаляем из списка клиентов
             del self.clients[client_socket]
             
             # Уведомляем других пользователей
-            self.broadcast_to_room(room, {
-                'type': 'user_left',
-                'username': username,
-                'timestamp': datetime.now().strftime('%H:%M:%S')
-            })
+            self.announce_presence(room, username, False, version)
             
             logging.info(f"Пользователь {username} отключился")
         
+        self.presence_subscribers.discard(client_socket)
+        conn = self.connections.pop(client_socket, None)
+        if conn:
+            conn.close()
+            if self.recorder is not None:
+                self.recorder.disconnect(conn)
+        if self.text_loop:
+            self.text_loop.unregister(client_socket)
+        
+        try:
+            # shutdown будит поток, заблокированный в recv на этом сокете
+            client_socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
         try:
             client_socket.close()
         except:
@@ -477,17 +1152,79 @@ class VoiceChatServer:
         for client_socket in list(self.clients.keys()):
             self.disconnect_client(client_socket)
         
+        if self.voice_workers:
+            self.voice_relay.stop()
+        self.auth.shutdown()
+        self.storage.close()  # с очередью истории чата
+        if self.metrics_endpoint is not None:
+            self.metrics_endpoint.stop()
+        if self.presence_batcher is not None:
+            self.presence_batcher.stop()
+        if self.outbound_writer is not None and self.outbound_writer is not self.text_loop:
+            self.outbound_writer.stop()
+        if self.recorder is not None:
+            self.recorder.close()
+        
         try:
             self.text_socket.close()
             self.voice_socket.close()
-            self.conn.close()
         except:
             pass
         
         logging.info("Сервер остановлен")
 
+def parse_args():
+    """Разбор аргументов командной строки"""
+    parser = argparse.ArgumentParser(description='Сервер голосового чата')
+    parser.add_argument('--host', default=SERVER_CONFIG['host'])
+    parser.add_argument('--text-port', type=int, default=SERVER_CONFIG['text_port'])
+    parser.add_argument('--voice-port', type=int, default=SERVER_CONFIG['voice_port'])
+    parser.add_argument(
+        '--engine',
+        choices=('threaded', 'selector'),
+        default=SERVER_CONFIG['text_engine'],
+        help='threaded - поток на клиента, selector - один цикл событий'
+    )
+    parser.add_argument(
+        '--voice-workers',
+        type=int,
+        default=SERVER_CONFIG['voice_workers'],
+        help='число процессов ретрансляции голоса (SO_REUSEPORT), 0 - в этом процессе'
+    )
+    parser.add_argument(
+        '--voice-mode',
+        choices=('forward', 'mix'),
+        default=SERVER_CONFIG['voice_mode'],
+        help='forward - пересылка потоков, mix - серверное микширование (NumPy)'
+    )
+    parser.add_argument(
+        '--auth-workers',
+        type=int,
+        default=AUTH_CONFIG['workers'],
+        help='число процессов проверки паролей, 0 - по числу ядер'
+    )
+    parser.add_argument(
+        '--metrics-port', type=int, default=SERVER_CONFIG['metrics_port'],
+        help='порт HTTP /metrics (Prometheus) на 127.0.0.1, 0 - не открывать'
+    )
+    parser.add_argument(
+        '--capture', default=SERVER_CONFIG['capture_file'], metavar='FILE',
+        help='записывать входящий трафик в файл (benchmarks/replay.py)'
+    )
+    parser.add_argument(
+        '--no-chat-log', action='store_true',
+        help='не писать текст сообщений чата в лог'
+    )
+    return parser.parse_args()
+
 if __name__ == "__main__":
-    server = VoiceChatServer()
+    args = parse_args()
+    LogPipeline(chat_content=LOG_CONFIG['chat_content'] and not args.no_chat_log).start()
+    server = VoiceChatServer(
+        args.host, args.text_port, args.voice_port, args.engine,
+        args.voice_workers, args.voice_mode, args.auth_workers, args.metrics_port,
+        args.capture
+    )
     try:
         server.start_server()
     except KeyboardInterrupt:
@@ -0,0 +1,268 @@
+"""
+Логирование сервера без записи на диск в потоках обработки.
+
+Раньше logging.basicConfig вешал на корневой логгер FileHandler и
+StreamHandler: каждая запись форматировалась и писалась в файл и в
+консоль в том потоке, который ее сделал, - в цикле событий, потоке
+клиента, потоке голоса, с блокировкой обработчика на время записи. Здесь:
+
+    очередь     у корневого логгера только QueueHandler: запись кладется в
+                ограниченную очередь как есть, аргументы %-строки
+                подставляются уже при форматировании. Если очередь полна,
+                запись отбрасывается и учитывается в dropped
+    поток       QueueListener форматирует записи и пишет их в файл с
+                ротацией по размеру и в stderr. Запись на диск - одна на
+                все, что накопилось в очереди (не больше BATCH_RECORDS),
+                а не write и flush на каждую строку
+    категории   первая часть имени логгера (chat, voice; корневой -
+                server). Для категорий из LOG_CONFIG['rate_limits'] проходит
+                не больше заданного числа записей в секунду, лишние
+                отбрасываются еще до очереди; число пропущенных
+                дописывается к следующей прошедшей записи категории
+    формат      text - строки как раньше, json - запись JSON на строку
+                с полями extra (room, user, ...)
+
+Текст сообщений чата пишет логгер chat; LOG_CONFIG['chat_content'] (или
+--no-chat-log сервера) отключает его без изменения кода.
+
+Так как запись форматируется позже, аргументы логирования должны быть
+неизменяемыми (строки, числа) - изменившийся словарь попадет в лог уже
+измененным.
+"""
+
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+from config import LOG_CONFIG, SERVER_CONFIG
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+ROOT_CATEGORY = 'server'
+BATCH_RECORDS = 256  # строк в одной записи в файл, не больше
+
+# Поля, которые есть у любой записи: остальные пришли из extra
+_RECORD_FIELDS = set(logging.makeLogRecord({}).__dict__) | {
+    'message', 'asctime', 'category', 'suppressed', 'taskName',
+}
+
+
+def category_of(record):
+    if record.name == 'root':
+        return ROOT_CATEGORY
+    return record.name.split('.', 1)[0]
+
+
+class RateLimitFilter(logging.Filter):
+    """Не больше limits[категория] записей в секунду (маркерное ведро)"""
+
+    def __init__(self, limits):
+        super().__init__()
+        self.limits = dict(limits)
+        self.lock = threading.Lock()
+        self.buckets = {}  # {категория: [маркеры, время, пропущено подряд]}
+        self.suppressed = 0
+
+    def filter(self, record):
+        category = record.category = category_of(record)
+        record.suppressed = 0
+        rate = self.limits.get(category)
+        if not rate:
+            return True
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(category)
+            if bucket is None:
+                bucket = self.buckets[category] = [float(rate), now, 0]
+            tokens = min(float(rate), bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            if tokens < 1.0:
+                bucket[0] = tokens
+                bucket[2] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] = tokens - 1.0
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            text += f" (пропущено похожих: {suppressed})"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    """Запись JSON на строку: время, уровень, категория, текст и поля extra"""
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'category': getattr(record, 'category', None) or category_of(record),
+            'message': record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_FIELDS:
+                data[key] = value
+        if getattr(record, 'suppressed', 0):
+            data['suppressed'] = record.suppressed
+        if record.exc_info:
+            data['exception'] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler без форматирования в потоке вызова и без ожидания очереди"""
+
+    def __init__(self, records):
+        super().__init__(records)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Стандартный prepare форматирует запись здесь же - это и есть
+        # работа, которую нужно убрать из потоков обработки
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Batching:
+    """emit только форматирует строку; в поток она уходит в flush, пачкой"""
+
+    def emit(self, record):
+        try:
+            self.pending.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.pending) >= BATCH_RECORDS:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return
+            data = ''.join(self.pending)
+            self.pending = []
+            self.write_batch(data)
+
+    def write_batch(self, data):
+        self.stream.write(data)
+        self.stream.flush()
+
+
+class _BatchingStreamHandler(_Batching, logging.StreamHandler):
+    def __init__(self, stream=None):
+        super().__init__(stream)
+        self.pending = []
+
+
+class _BatchingFileHandler(_Batching, logging.handlers.RotatingFileHandler):
+    """Ротация по размеру файла, проверяется один раз на пачку"""
+
+    def __init__(self, path, max_bytes, backup_count):
+        super().__init__(path, maxBytes=max_bytes, backupCount=backup_count,
+                         encoding='utf-8', delay=True)
+        self.pending = []
+
+    def write_batch(self, data):
+        if self.stream is None:
+            self.stream = self._open()
+        size = self.stream.tell()
+        if self.maxBytes and size and size + len(data) >= self.maxBytes:
+            self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+        super().write_batch(data)
+
+    def close(self):
+        # FileHandler.close не сбрасывает строки, если файл еще не открыт
+        self.flush()
+        super().close()
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def handle(self, record):
+        super().handle(record)
+        if self.queue.empty():
+            # Очередь разобрана - строки уходят в файл одной записью
+            for handler in self.handlers:
+                handler.flush()
+
+    def enqueue_sentinel(self):
+        # Очередь может быть заполнена: ждем, пока поток ее разберет
+        self.queue.put(self._sentinel)
+
+
+class LogPipeline:
+    """Очередь записей лога и поток, который пишет их в файл и консоль"""
+
+    def __init__(self, path=SERVER_CONFIG['log_file'], config=LOG_CONFIG, chat_content=None):
+        self.config = config
+        self.chat_content = config['chat_content'] if chat_content is None else chat_content
+        formatter = JsonFormatter() if config['format'] == 'json' else TextFormatter(TEXT_FORMAT)
+        self.handlers = []
+        if path:
+            self.handlers.append(
+                _BatchingFileHandler(path, config['max_bytes'], config['backup_count'])
+            )
+        if config['console']:
+            self.handlers.append(_BatchingStreamHandler())
+        for handler in self.handlers:
+            handler.setFormatter(formatter)
+
+        self.records = queue.Queue(config['queue_size'])
+        self.handler = _QueueHandler(self.records)
+        self.limiter = RateLimitFilter(config['rate_limits'])
+        self.handler.addFilter(self.limiter)
+        self.listener = _QueueListener(self.records, *self.handlers)
+        self.started = False
+
+    def start(self):
+        """Замена обработчиков корневого логгера очередью"""
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(self.handler)
+        root.setLevel(self.config['level'])
+        # Поля записи, которые формат не использует, но LogRecord собирает
+        # при каждом вызове в потоке обработки: файл и строка вызова
+        # (разбор стека), поток, процесс
+        logging._srcfile = None
+        logging.logThreads = False
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+        logging.getLogger('chat').setLevel(logging.NOTSET if self.chat_content else logging.CRITICAL + 1)
+        self.listener.start()
+        self.started = True
+        atexit.register(self.stop)
+        return self
+
+    def stop(self):
+        """Запись оставшегося в очереди и остановка потока"""
+        if not self.started:
+            return
+        self.started = False
+        logging.getLogger().removeHandler(self.handler)
+        self.listener.stop()
+        for handler in self.handlers:
+            handler.close()
+
+    def stats(self):
+        return {
+            'queued': self.records.qsize(),
+            'dropped': self.handler.dropped,
+            'rate_limited': self.limiter.suppressed,
+        }
@@ -0,0 +1,302 @@
+"""
+Доступ к базе SQLite из многопоточного сервера.
+
+Раньше все потоки клиентов работали через одно подключение и один общий
+курсор (check_same_thread=False): параллельные входы перемешивали
+результаты запросов, а каждая регистрация ждала собственного commit с
+fsync. Здесь:
+
+    запись   один поток БД с очередью запросов. Он забирает из очереди все,
+             что накопилось (до batch_limit операций), и выполняет пачку в
+             одной транзакции: каждая операция - в своей точке сохранения,
+             ошибка одной не откатывает остальные, а commit и fsync - один
+             на всю пачку (групповая фиксация)
+    чтение   небольшой пул подключений только для чтения; в режиме WAL
+             читатели не ждут записи и не блокируют ее
+
+Запросы записаны константами модуля: sqlite3 держит скомпилированные
+выражения в кэше каждого подключения (cached_statements), поэтому
+повторные запросы не разбираются заново.
+
+Операции записи возвращают concurrent.futures.Future и, если передан
+callback(result, error), вызывают его из потока БД - так же, как
+auth.AuthPool; сервер сам переносит результат в свой поток.
+"""
+
+import concurrent.futures
+import logging
+import os
+import queue
+import sqlite3
+import threading
+
+from config import SERVER_CONFIG
+
+STATEMENT_CACHE = 64
+BUSY_TIMEOUT_MS = 5000
+
+SCHEMA = (
+    '''
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT UNIQUE NOT NULL,
+        password_hash TEXT NOT NULL,
+        is_admin BOOLEAN DEFAULT FALSE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''',
+    # История чата (chat_history.py): id назначает сервер при отправке
+    '''
+    CREATE TABLE IF NOT EXISTS messages (
+        id INTEGER PRIMARY KEY,
+        room TEXT NOT NULL,
+        username TEXT NOT NULL,
+        message TEXT NOT NULL,
+        created REAL NOT NULL
+    )
+    ''',
+    'CREATE INDEX IF NOT EXISTS messages_room ON messages (room, id)',
+    'CREATE INDEX IF NOT EXISTS messages_user ON messages (username, id)',
+    'CREATE INDEX IF NOT EXISTS messages_created ON messages (created)',
+)
+
+# Полнотекстовый индекс истории: FTS5 без собственной копии текста
+# (content=''), rowid - id сообщения. Триггеры обновляют его в той же
+# транзакции, что и запись сообщений. Индексируется текст с "ё" -> "е"
+# (unicode61 их не различает только для латиницы), запрос приводится так
+# же (chat_history.match_expression). prefix: отдельные списки для
+# начал слов из 2-4 букв, чтобы поиск "слово*" не сливал списки всех
+# подходящих слов (индекс примерно втрое больше). Индекс, созданный для
+# уже заполненной таблицы, заполняется последним выражением
+FOLD_YO = "replace(replace({0}, 'ё', 'е'), 'Ё', 'Е')"
+FULLTEXT_SCHEMA = (
+    '''
+    CREATE VIRTUAL TABLE messages_fts USING fts5(
+        message, content='', tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3 4'
+    )
+    ''',
+    f'''
+    CREATE TRIGGER messages_fts_insert AFTER INSERT ON messages BEGIN
+        INSERT INTO messages_fts (rowid, message) VALUES (new.id, {FOLD_YO.format('new.message')});
+    END
+    ''',
+    f'''
+    CREATE TRIGGER messages_fts_delete AFTER DELETE ON messages BEGIN
+        INSERT INTO messages_fts (messages_fts, rowid, message)
+        VALUES ('delete', old.id, {FOLD_YO.format('old.message')});
+    END
+    ''',
+    f"INSERT INTO messages_fts (rowid, message) SELECT id, {FOLD_YO.format('message')} FROM messages",
+)
+
+SELECT_CREDENTIALS = 'SELECT password_hash, is_admin FROM users WHERE username = ?'
+INSERT_USER = 'INSERT INTO users (username, password_hash, is_admin) VALUES (?, ?, ?)'
+UPDATE_PASSWORD = 'UPDATE users SET password_hash = ? WHERE username = ?'
+
+_STOP = object()
+
+
+def _connect(path, readonly=False):
+    # isolation_level=None: транзакциями поток БД управляет сам
+    conn = sqlite3.connect(
+        path, isolation_level=None, check_same_thread=False,
+        cached_statements=STATEMENT_CACHE,
+    )
+    conn.execute(f'PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    if readonly:
+        conn.execute('PRAGMA query_only = ON')
+        conn.execute('PRAGMA cache_size = -2000')  # ~2 МБ
+    else:
+        conn.execute('PRAGMA journal_mode = WAL')
+        # В режиме WAL NORMAL не портит базу при сбое, fsync - на checkpoint
+        conn.execute('PRAGMA synchronous = NORMAL')
+        conn.execute('PRAGMA cache_size = -8000')  # ~8 МБ
+    return conn
+
+
+class Storage:
+    """База сервера: поток записи с групповой фиксацией и пул читателей"""
+
+    def __init__(self, path=SERVER_CONFIG['database_path'],
+                 readers=SERVER_CONFIG['database_readers'],
+                 batch_limit=SERVER_CONFIG['database_batch']):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.batch_limit = batch_limit
+        self.requests = queue.Queue()
+        self.lock = threading.Lock()
+        self.writes = 0
+        self.commits = 0
+        self.failed = 0
+        self.max_batch = 0
+        self.closed = False
+
+        # Схема создается до запуска читателей и потока записи
+        writer = _connect(path)
+        for statement in SCHEMA:
+            writer.execute(statement)
+        self.fulltext = self._create_fulltext(writer)
+        self.writer = writer
+
+        self.readers = queue.LifoQueue()
+        self.reader_count = readers
+        for _ in range(readers):
+            self.readers.put(_connect(path, readonly=True))
+
+        self.thread = threading.Thread(target=self._write_loop, name='storage', daemon=True)
+        self.thread.start()
+
+    @staticmethod
+    def _create_fulltext(conn):
+        """Полнотекстовый индекс, если SQLite собран с FTS5"""
+        exists = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'messages_fts'"
+        ).fetchone()
+        if exists:
+            return True
+        try:
+            conn.execute('BEGIN')
+            for statement in FULLTEXT_SCHEMA:
+                conn.execute(statement)
+            conn.execute('COMMIT')
+        except sqlite3.OperationalError as error:
+            conn.execute('ROLLBACK')
+            logging.warning(f"Полнотекстовый поиск недоступен ({error}), поиск - перебором")
+            return False
+        return True
+
+    # Чтение
+
+    def query_one(self, sql, params=()):
+        conn = self.readers.get()
+        try:
+            return conn.execute(sql, params).fetchone()
+        finally:
+            self.readers.put(conn)
+
+    def query_all(self, sql, params=()):
+        conn = self.readers.get()
+        try:
+            return conn.execute(sql, params).fetchall()
+        finally:
+            self.readers.put(conn)
+
+    def user_credentials(self, username):
+        """(хеш пароля, is_admin) пользователя или None"""
+        return self.query_one(SELECT_CREDENTIALS, (username,))
+
+    # Запись
+
+    def submit(self, operation, callback=None):
+        """operation(connection) в потоке БД внутри общей транзакции пачки"""
+        future = concurrent.futures.Future()
+        if self.closed:
+            error = sqlite3.ProgrammingError('База данных закрыта')
+            future.set_exception(error)
+            if callback is not None:
+                callback(None, error)
+            return future
+        self.requests.put((operation, callback, future))
+        return future
+
+    def create_user(self, username, password_hash, callback=None, is_admin=False):
+        """Регистрация; результат - True или False, если имя уже занято"""
+        def insert(conn):
+            try:
+                conn.execute(INSERT_USER, (username, password_hash, is_admin))
+            except sqlite3.IntegrityError:
+                return False
+            return True
+        return self.submit(insert, callback)
+
+    def set_password_hash(self, username, password_hash, callback=None):
+        return self.submit(
+            lambda conn: conn.execute(UPDATE_PASSWORD, (password_hash, username)).rowcount,
+            callback
+        )
+
+    def flush(self, timeout=None):
+        """Ожидание фиксации всего, что поставлено в очередь до вызова"""
+        return self.submit(lambda conn: None).result(timeout)
+
+    def _write_loop(self):
+        stopping = False
+        while not stopping:
+            batch = [self.requests.get()]
+            while len(batch) < self.batch_limit:
+                try:
+                    batch.append(self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            if _STOP in batch:
+                stopping = True
+                batch = [item for item in batch if item is not _STOP]
+            if batch:
+                self._run_batch(batch)
+        self.writer.close()
+
+    def _run_batch(self, batch):
+        conn = self.writer
+        results = []
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            for operation, callback, future in batch:
+                conn.execute('SAVEPOINT operation')
+                try:
+                    result = operation(conn)
+                except Exception as error:
+                    conn.execute('ROLLBACK TO operation')
+                    results.append((callback, future, None, error))
+                else:
+                    results.append((callback, future, result, None))
+                conn.execute('RELEASE operation')
+            conn.execute('COMMIT')
+        except sqlite3.Error as error:
+            logging.error(f"Ошибка записи в базу: {error}")
+            if conn.in_transaction:
+                conn.execute('ROLLBACK')
+            results = [(callback, future, None, error) for _, callback, future in batch]
+
+        with self.lock:
+            self.writes += len(batch)
+            self.commits += 1
+            self.failed += sum(1 for *_, error in results if error is not None)
+            self.max_batch = max(self.max_batch, len(batch))
+        for callback, future, result, error in results:
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+            if callback is None:
+                continue
+            try:
+                callback(result, error)
+            except Exception:
+                logging.error("Ошибка обработчика записи в базу", exc_info=True)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'queued': self.requests.qsize(),
+                'writes': self.writes,
+                'commits': self.commits,
+                'failed': self.failed,
+                'max_batch': self.max_batch,
+                'avg_batch': round(self.writes / self.commits, 1) if self.commits else 0.0,
+            }
+
+    def close(self):
+        """Фиксация очереди и закрытие подключений"""
+        self.closed = True
+        if self.thread.is_alive():
+            self.requests.put(_STOP)
+            self.thread.join()
+        for _ in range(self.reader_count):
+            try:
+                self.readers.get(timeout=1.0).close()
+            except queue.Empty:
+                break
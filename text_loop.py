@@ -0,0 +1,183 @@
+"""
+Однопоточный цикл событий для текстового порта (selectors/epoll).
+
+Все клиенты обслуживаются одним потоком: чтение, вызов обработчиков
+VoiceChatServer и отправка ответов выполняются без отдельного потока
+на каждое подключение.
+"""
+
+import logging
+import selectors
+import socket
+import threading
+
+from protocol import RECV_BUFFER_SIZE
+
+
+class SelectorTextServer:
+    """Мультиплексирование всех текстовых клиентов в одном цикле"""
+
+    def __init__(self, server):
+        self.server = server
+        self.selector = selectors.DefaultSelector()
+        self.thread = None
+        self._pending_lock = threading.Lock()
+        self._pending_writes = set()
+        self._pending_calls = []
+        self._waker_r, self._waker_w = socket.socketpair()
+        self._waker_r.setblocking(False)
+        self._waker_w.setblocking(False)
+        # Общий буфер приема для всех подключений цикла
+        self.recv_buffer = bytearray(RECV_BUFFER_SIZE)
+        self.recv_view = memoryview(self.recv_buffer)
+
+    def on_loop_thread(self):
+        """Выполняется ли код в потоке цикла"""
+        return threading.current_thread() is self.thread
+
+    def wake(self):
+        """Пробуждение цикла из другого потока"""
+        try:
+            self._waker_w.send(b'\0')
+        except (BlockingIOError, OSError):
+            pass
+
+    def request_write(self, conn):
+        """Запрос на отправку исходящего буфера подключения"""
+        if self.on_loop_thread():
+            self._want_write(conn)
+            return
+        with self._pending_lock:
+            self._pending_writes.add(conn)
+        self.wake()
+
+    def call_soon(self, callback, *args):
+        """Выполнение функции в потоке цикла"""
+        with self._pending_lock:
+            self._pending_calls.append((callback, args))
+        self.wake()
+
+    def unregister(self, sock):
+        """Снятие сокета с наблюдения перед закрытием"""
+        try:
+            self.selector.unregister(sock)
+        except (KeyError, ValueError):
+            pass
+
+    def run(self):
+        """Основной цикл обработки событий"""
+        self.thread = threading.current_thread()
+        listener = self.server.text_socket
+        listener.setblocking(False)
+        self.selector.register(listener, selectors.EVENT_READ, None)
+        self.selector.register(self._waker_r, selectors.EVENT_READ, self._waker_r)
+
+        while self.server.running:
+            try:
+                events = self.selector.select(timeout=1.0)
+            except OSError:
+                if self.server.running:
+                    logging.error("Ошибка цикла событий", exc_info=True)
+                break
+
+            for key, mask in events:
+                if key.data is None:
+                    self._accept(listener)
+                elif key.data is self._waker_r:
+                    self._drain_waker()
+                else:
+                    conn = key.data
+                    if mask & selectors.EVENT_READ:
+                        self._read(conn)
+                    if mask & selectors.EVENT_WRITE and not conn.closed:
+                        self._write(conn)
+
+            self._run_pending()
+
+        self.selector.close()
+
+    def _accept(self, listener):
+        """Прием всех ожидающих подключений"""
+        while True:
+            try:
+                client_socket, address = listener.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                if self.server.running:
+                    logging.error(f"Ошибка при принятии соединения: {e}")
+                return
+
+            client_socket.setblocking(False)
+            conn = self.server.new_connection(client_socket, address)
+            self.selector.register(client_socket, selectors.EVENT_READ, conn)
+            logging.info(f"Новое подключение: {address}")
+
+    def _read(self, conn):
+        """Чтение данных клиента и передача их серверу"""
+        try:
+            nbytes = conn.sock.recv_into(self.recv_view)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            logging.error("Ошибка с клиентом %s: %s", conn.address, e)
+            self.server.disconnect_client(conn.sock)
+            return
+
+        if not nbytes:
+            self.server.disconnect_client(conn.sock)
+            return
+
+        try:
+            self.server.handle_incoming(conn, self.recv_view[:nbytes])
+        except Exception as e:
+            logging.error("Ошибка с клиентом %s: %s", conn.address, e)
+            self.server.disconnect_client(conn.sock)
+
+    def _write(self, conn):
+        """Отправка исходящего буфера"""
+        try:
+            done = conn.flush()
+        except OSError as e:
+            logging.error("Ошибка отправки сообщения: %s", e)
+            self.server.disconnect_client(conn.sock)
+            return
+        if done:
+            self._set_events(conn, selectors.EVENT_READ)
+
+    def _want_write(self, conn):
+        """Попытка немедленной отправки, иначе ожидание готовности сокета"""
+        if conn.closed:
+            return
+        self._write(conn)
+        if not conn.closed and conn.has_pending():
+            self._set_events(conn, selectors.EVENT_READ | selectors.EVENT_WRITE)
+
+    def _set_events(self, conn, events):
+        try:
+            if self.selector.get_key(conn.sock).events != events:
+                self.selector.modify(conn.sock, events, conn)
+        except (KeyError, ValueError):
+            pass
+
+    def _drain_waker(self):
+        try:
+            while self._waker_r.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _run_pending(self):
+        with self._pending_lock:
+            writes = self._pending_writes
+            calls = self._pending_calls
+            self._pending_writes = set()
+            self._pending_calls = []
+
+        for conn in writes:
+            self._want_write(conn)
+        for callback, args in calls:
+            try:
+                callback(*args)
+            except Exception:
+                logging.error("Ошибка отложенного вызова", exc_info=True)
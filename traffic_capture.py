@@ -0,0 +1,187 @@
+"""
+Запись входящего трафика сервера для воспроизведения (benchmarks/replay.py).
+
+Включается SERVER_CONFIG['capture_file'] или --capture: сервер пишет в
+файл открытие и закрытие подключений, каждое входящее сообщение
+текстового протокола и сведения о голосовых пакетах (тип, размер, флаги -
+без звука) с временем от начала записи. Пароли не сохраняются, текст чата
+заменяется заполнителем той же длины: для воспроизведения нужны форма и
+объем нагрузки, а не содержимое.
+
+Формат файла: FILE_HEADER (сигнатура, версия, время начала записи по
+часам системы), затем записи - RECORD_HEADER
+
+    вид (1) | время от начала, мкс (8) | номер подключения (4) | длина (4)
+
+и длина байт данных:
+
+    CONNECT     нет
+    MESSAGE     JSON сообщения (UTF-8)
+    VOICE       VOICE_INFO: тип пакета (1) | размер (2) | флаги VOICE (1)
+    DISCONNECT  нет
+
+Голосовой пакет относится к подключению, с которого автор последним
+отправлял login или register. Потоки обработки только дописывают запись в
+буфер под блокировкой, в файл буфер пишет отдельный поток раз в
+FLUSH_INTERVAL. Если диск не успевает и в буфере больше max_buffer байт,
+записи отбрасываются (dropped).
+"""
+
+import json
+import logging
+import struct
+import threading
+import time
+
+MAGIC = b'VCAP'
+VERSION = 1
+FILE_HEADER = struct.Struct('!4sBd')
+RECORD_HEADER = struct.Struct('!BQII')
+VOICE_INFO = struct.Struct('!BHB')
+
+# Виды записей
+CONNECT = 1
+MESSAGE = 2
+VOICE = 3
+DISCONNECT = 4
+
+FLUSH_INTERVAL = 0.5  # секунд между записями буфера в файл
+MAX_BUFFER = 16 * 1024 * 1024
+
+
+def scrub(message):
+    """Сообщение для записи: без пароля, текст чата - заполнитель той же длины"""
+    if 'password' not in message and message.get('type') != 'chat':
+        return message
+    message = dict(message)
+    if 'password' in message:
+        message['password'] = ''
+    if message.get('type') == 'chat' and isinstance(message.get('message'), str):
+        message['message'] = 'x' * len(message['message'])
+    return message
+
+
+class TrafficRecorder:
+    """Запись входящего трафика в файл в отдельном потоке"""
+
+    def __init__(self, path, max_buffer=MAX_BUFFER):
+        self.path = path
+        self.max_buffer = max_buffer
+        self.file = open(path, 'wb')
+        self.file.write(FILE_HEADER.pack(MAGIC, VERSION, time.time()))
+        self.started = time.monotonic()
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.buffer = bytearray()
+        self.connections = {}  # {ClientConnection: номер подключения}
+        self.user_connections = {}  # {username: номер подключения}
+        self.last_id = 0
+        self.records = 0
+        self.dropped = 0
+        self.running = False
+        self.thread = threading.Thread(target=self._write_loop, name='capture', daemon=True)
+
+    def start(self):
+        self.running = True
+        self.thread.start()
+        logging.info("Запись трафика в %s", self.path)
+        return self
+
+    def connect(self, conn):
+        with self.lock:
+            self.last_id += 1
+            self.connections[conn] = self.last_id
+            self._append(CONNECT, self.last_id, b'')
+
+    def message(self, conn, message):
+        if not isinstance(message, dict):
+            return
+        data = json.dumps(scrub(message), ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        with self.lock:
+            conn_id = self.connections.get(conn)
+            if conn_id is None:
+                return
+            if message.get('type') in ('login', 'register') and isinstance(message.get('username'), str):
+                self.user_connections[message['username']] = conn_id
+            self._append(MESSAGE, conn_id, data)
+
+    def voice(self, username, kind, size, flags):
+        with self.lock:
+            conn_id = self.user_connections.get(username)
+            if conn_id is not None:
+                self._append(VOICE, conn_id, VOICE_INFO.pack(kind, min(size, 0xFFFF), flags))
+
+    def disconnect(self, conn):
+        with self.lock:
+            conn_id = self.connections.pop(conn, None)
+            if conn_id is not None:
+                self._append(DISCONNECT, conn_id, b'')
+
+    def _append(self, kind, conn_id, data):
+        """Запись в буфер; вызывается под self.lock"""
+        if len(self.buffer) >= self.max_buffer:
+            self.dropped += 1
+            return
+        micros = int((time.monotonic() - self.started) * 1e6)
+        self.buffer += RECORD_HEADER.pack(kind, micros, conn_id, len(data))
+        self.buffer += data
+        self.records += 1
+
+    def flush(self):
+        with self.write_lock:
+            with self.lock:
+                data, self.buffer = self.buffer, bytearray()
+            if data and not self.file.closed:
+                self.file.write(data)
+                self.file.flush()
+
+    def _write_loop(self):
+        while self.running:
+            time.sleep(FLUSH_INTERVAL)
+            try:
+                self.flush()
+            except OSError as e:
+                logging.error("Ошибка записи трафика: %s", e)
+
+    def close(self):
+        """Запись остатка буфера и закрытие файла"""
+        if self.running:
+            self.running = False
+            self.thread.join()
+        self.flush()
+        self.file.close()
+
+    def stats(self):
+        with self.lock:
+            return {'records': self.records, 'dropped': self.dropped, 'buffered': len(self.buffer)}
+
+
+def read_capture(path):
+    """Записи файла по порядку: (вид, секунды от начала, номер подключения, данные).
+
+    Данные MESSAGE - словарь сообщения, VOICE - (тип пакета, размер,
+    флаги), остальных - None. Недописанная последняя запись (сервер
+    остановлен аварийно) пропускается.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            raise ValueError(f"{path}: не файл записи трафика")
+        magic, version, _ = FILE_HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path}: не файл записи трафика версии {VERSION}")
+        while True:
+            head = f.read(RECORD_HEADER.size)
+            if len(head) < RECORD_HEADER.size:
+                return
+            kind, micros, conn_id, length = RECORD_HEADER.unpack(head)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            if kind == MESSAGE:
+                payload = json.loads(data)
+            elif kind == VOICE:
+                payload = VOICE_INFO.unpack(data)
+            else:
+                payload = None
+            yield kind, micros / 1e6, conn_id, payload
@@ -0,0 +1,131 @@
+"""
+Адаптивное качество голоса: сервер переключает клиентов между профилями
+VOICE_QUALITY (low / medium / high).
+
+Раз в AUDIO_CONFIG['report_interval'] секунд BitrateController получает:
+
+    состояние каналов   потери и джиттер потока каждого отправителя,
+                        усредненные по слушателям (VoiceReports.sender_health)
+    нагрузку ретранслятора  долю времени, занятую обработкой пакетов, и
+                        ошибки sendto (переполнен буфер отправки сокета)
+
+Уровень отправителя по каналу снижается сразу, как только потери или
+джиттер выше порога, а повышается только после RAISE_AFTER интервалов
+подряд с чистым каналом - так качество не скачет. Перегрузка ретранслятора
+опускает общий потолок (cap) на ступень за интервал, спокойная работа
+поднимает его обратно тоже через RAISE_AFTER интервалов. Клиент получает
+min(уровень канала, потолок), поэтому при насыщении сервер продолжает
+пересылать всех говорящих, но меньшими пакетами, вместо того чтобы терять
+пакеты у всех подряд.
+
+Переключение на клиенте - VoiceCapture.set_quality: кодер меняет профиль
+на границе кадра без сброса состояния (VoiceEncoder.switch_quality).
+"""
+
+import time
+
+from config import AUDIO_CONFIG, VOICE_QUALITY
+
+LOSS_DOWN_PCT = 5.0  # потери, при которых качество снижается
+JITTER_DOWN_MS = 40.0
+LOSS_UP_PCT = 1.0  # канал считается чистым ниже этих значений
+JITTER_UP_MS = 20.0
+LOAD_HIGH = 0.7  # доля занятого времени ретранслятора - перегрузка
+LOAD_LOW = 0.4  # нагрузка, при которой потолок можно поднимать
+RAISE_AFTER = 3  # интервалов подряд без проблем перед повышением
+
+
+class BitrateController:
+    """Выбор профиля качества для каждого отправителя"""
+
+    def __init__(self, default=AUDIO_CONFIG['voice_quality']):
+        self.levels = list(VOICE_QUALITY)  # от худшего к лучшему
+        self.default = self.levels.index(default)
+        self.cap = len(self.levels) - 1
+        self.cap_calm = 0
+        self.link = {}  # {username: уровень по каналу}
+        self.clean = {}  # {username: интервалов подряд с чистым каналом}
+        self.applied = {}  # {username: уровень, отправленный клиенту}
+        self.previous_load = None  # (время, занято секунд, ошибок sendto)
+        self.load = 0.0
+        self.send_errors = 0
+
+    def observe_load(self, stats, now=None):
+        """Загрузка ретранслятора по счетчикам stats() с прошлого вызова"""
+        if now is None:
+            now = time.monotonic()
+        busy = stats.get('busy', 0.0)
+        errors = stats.get('send_errors', 0)
+        previous = self.previous_load
+        self.previous_load = (now, busy, errors)
+        if previous is None or now <= previous[0]:
+            return self.load
+        workers = stats.get('workers') or 1
+        self.load = max(0.0, (busy - previous[1]) / (now - previous[0]) / workers)
+        self.send_errors = max(0, errors - previous[2])
+        return self.load
+
+    def evaluate(self, users, health):
+        """Новые профили после интервала: {username: (качество, причина)}.
+
+        users - пользователи с голосом, health - {username: (потери %, джиттер мс)}
+        для тех, чей поток слышали за интервал.
+        """
+        overloaded = self.load >= LOAD_HIGH or self.send_errors > 0
+        if overloaded:
+            self.cap = max(0, self.cap - 1)
+            self.cap_calm = 0
+        elif self.load < LOAD_LOW:
+            self.cap_calm += 1
+            if self.cap_calm >= RAISE_AFTER and self.cap < len(self.levels) - 1:
+                self.cap += 1
+                self.cap_calm = 0
+
+        changes = {}
+        for username in users:
+            link = self.link.get(username, self.default)
+            reason = 'load'
+            if username in health:
+                loss, jitter = health[username]
+                if loss >= LOSS_DOWN_PCT or jitter >= JITTER_DOWN_MS:
+                    if link > 0:
+                        link -= 1
+                        reason = 'link'
+                    self.clean[username] = 0
+                elif loss <= LOSS_UP_PCT and jitter <= JITTER_UP_MS:
+                    clean = self.clean.get(username, 0) + 1
+                    if clean >= RAISE_AFTER and link < len(self.levels) - 1:
+                        link += 1
+                        reason = 'link'
+                        clean = 0
+                    self.clean[username] = clean
+                else:
+                    self.clean[username] = 0
+            self.link[username] = link
+
+            level = min(link, self.cap)
+            if level != self.applied.get(username, self.default):
+                self.applied[username] = level
+                changes[username] = (self.levels[level], reason)
+        return changes
+
+    def quality(self, username):
+        """Текущий профиль пользователя"""
+        return self.levels[self.applied.get(username, self.default)]
+
+    def forget(self, username):
+        self.link.pop(username, None)
+        self.clean.pop(username, None)
+        self.applied.pop(username, None)
+
+    def stats(self):
+        """Потолок, нагрузка и число пользователей на каждом профиле"""
+        counts = dict.fromkeys(self.levels, 0)
+        for level in self.applied.values():
+            counts[self.levels[level]] += 1
+        return {
+            'cap': self.levels[self.cap],
+            'load': round(self.load, 3),
+            'send_errors': self.send_errors,
+            'users': counts,
+        }
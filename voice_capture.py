@@ -0,0 +1,269 @@
+"""
+Захват, кодирование и отправка голоса клиентом.
+
+    микрофон -> колбэк PyAudio -> SampleRing -> поток отправки:
+                передискретизация, кодирование (voice_codec) -> UDP
+
+Колбэк звуковой карты только копирует отсчеты в кольцо и сразу
+возвращается; все остальное делает поток отправки. Кадры без речи
+(voice_vad) не отправляются: в конце фразы уходит один пакет комфортного
+шума с FLAG_CN, и передача молчит до следующей фразы. Источником вместо
+микрофона может быть SyntheticSource - тот же колбэк вызывается из
+обычного потока, поэтому конвейер работает и замеряется без звуковой карты.
+"""
+
+import logging
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+from audio_ring import SampleRing
+from config import AUDIO_CONFIG
+from voice_codec import VoiceEncoder, frame_level, quality_profile
+from voice_relay import FLAG_CN, FLAG_START, PACKET_VOICE, VOICE_HEADER
+from voice_vad import SILENCE, VoiceActivityDetector
+
+# Значение paContinue из PyAudio: продолжать поток после колбэка
+PA_CONTINUE = pyaudio.paContinue if pyaudio else 0
+RING_SECONDS = 1.0  # запас кольца захвата
+
+
+class VoiceCapture:
+    """Конвейер передачи голоса: колбэк захвата, кольцо и поток отправки"""
+
+    def __init__(self, sock, server_address, quality=AUDIO_CONFIG['voice_quality'],
+                 input_rate=AUDIO_CONFIG['rate'], chunk=AUDIO_CONFIG['chunk'],
+                 vad=AUDIO_CONFIG['vad']):
+        self.sock = sock
+        self.server_address = server_address
+        self.input_rate = input_rate
+        self.chunk = chunk
+        self.ring = SampleRing(int(input_rate * RING_SECONDS))
+        self.encoder = VoiceEncoder(quality, input_rate)
+        self.vad = VoiceActivityDetector(self.encoder.frame_ms) if vad else None
+        self.requested_quality = None  # смена профиля по команде сервера
+        # Кодер и состояние передачи меняют поток отправки (pump) и поток
+        # интерфейса (set_transmitting)
+        self.lock = threading.Lock()
+        self.quality_switches = 0
+        self.stream = None
+        self.source = None
+        self.thread = None
+        self.running = False
+        self.transmitting = False
+        self.epoch = time.monotonic()
+        self.sequence = 0  # номер следующего кадра, по модулю 2**16
+        self.timestamp = 0  # время захвата следующего кадра, мс от epoch
+        self.spurt_start = False
+        self.talking = False  # идет фраза: последний отправленный кадр - речь
+        self.frames_sent = 0
+        self.frames_suppressed = 0
+        self.bytes_sent = 0
+
+    def callback(self, in_data, frame_count, time_info, status):
+        """Колбэк PyAudio: только копирование отсчетов в кольцо"""
+        self.ring.write(np.frombuffer(in_data, dtype=np.int16))
+        return None, PA_CONTINUE
+
+    def open(self, audio):
+        """Открытие потока микрофона в режиме колбэка (пока остановлен)"""
+        self.stream = audio.open(
+            format=pyaudio.paInt16,
+            channels=AUDIO_CONFIG['channels'],
+            rate=self.input_rate,
+            input=True,
+            frames_per_buffer=self.chunk,
+            stream_callback=self.callback,
+            start=False
+        )
+        self.start()
+
+    def attach(self, source):
+        """Синтетический источник вместо микрофона"""
+        self.source = source
+        self.start()
+
+    def start(self):
+        """Запуск потока отправки"""
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._send_loop, name='voice-send', daemon=True)
+        self.thread.start()
+
+    def set_transmitting(self, transmitting):
+        """Начало или конец передачи (кнопка "нажми и говори")"""
+        with self.lock:
+            if transmitting == self.transmitting:
+                return
+            if transmitting:
+                # Новая фраза начинается с чистого состояния кодера
+                self.encoder.set_quality(self.encoder.quality)
+                self.timestamp = int((time.monotonic() - self.epoch) * 1000)
+                self.spurt_start = True
+            self.transmitting = transmitting
+        if self.stream is not None:
+            if transmitting:
+                self.stream.start_stream()
+            else:
+                self.stream.stop_stream()
+        elif self.source is not None:
+            if transmitting:
+                self.source.start(self.callback)
+            else:
+                self.source.stop()
+
+    def set_quality(self, quality):
+        """Смена профиля качества; применяется потоком отправки на границе кадра"""
+        quality_profile(quality)
+        self.requested_quality = quality
+
+    def close(self):
+        """Остановка захвата и потока отправки"""
+        self.set_transmitting(False)
+        self.running = False
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+
+    def stats(self):
+        """Счетчики передачи"""
+        return {
+            'quality': self.encoder.quality,
+            'frames_sent': self.frames_sent,
+            'frames_suppressed': self.frames_suppressed,
+            'quality_switches': self.quality_switches,
+            'bytes_sent': self.bytes_sent,
+            'overruns': self.ring.overruns,
+        }
+
+    def pump(self):
+        """Кодирование и отправка накопленного в кольце. False - кольцо пусто"""
+        with self.lock:
+            return self._pump()
+
+    def _pump(self):
+        quality = self.requested_quality
+        if quality is not None:
+            self.requested_quality = None
+            if quality != self.encoder.quality:
+                # Посреди фразы - без сброса кодера, номера и время идут дальше
+                self.encoder.switch_quality(quality)
+                self.quality_switches += 1
+        try:
+            if self.talking and not self.transmitting:
+                # Кнопку отпустили посреди фразы
+                self._end_spurt()
+            samples = self.ring.read()
+            if samples is None:
+                return False
+            if not self.transmitting:
+                return True
+            for frame in self.encoder.split(samples):
+                if self.vad is not None and self.vad.process(frame) == SILENCE:
+                    if self.talking:
+                        self._end_spurt()
+                    else:
+                        self.frames_suppressed += 1
+                else:
+                    if not self.talking:
+                        self.talking = True
+                        self.spurt_start = True
+                    self._send(
+                        frame_level(frame), self.encoder.encode_frame(frame),
+                        FLAG_START if self.spurt_start else 0
+                    )
+                    self.spurt_start = False
+                # Время идет и в паузах: получатель видит их по отметкам времени
+                self.timestamp += self.encoder.frame_ms
+        except OSError as e:
+            logging.error(f"Ошибка отправки голоса: {e}")
+        return True
+
+    def _send(self, level, payload, flags):
+        packet = VOICE_HEADER.pack(
+            PACKET_VOICE, level, 0, self.sequence, self.timestamp & 0xFFFFFFFF, flags
+        ) + payload
+        self.sequence = (self.sequence + 1) & 0xFFFF
+        self.sock.sendto(packet, self.server_address)
+        self.frames_sent += 1
+        self.bytes_sent += len(packet)
+
+    def _end_spurt(self):
+        """Пакет комфортного шума с уровнем фона: конец фразы"""
+        self.talking = False
+        level = self.vad.comfort_level() if self.vad is not None else 0
+        self._send(level, bytes((level,)), FLAG_CN)
+
+    def _send_loop(self):
+        """Поток отправки: ждет данных в кольце, не блокируя колбэк"""
+        poll = self.encoder.frame_ms / 2000
+        while self.running:
+            if not self.pump():
+                time.sleep(poll)
+
+
+class SyntheticSource:
+    """Тестовый сигнал вместо микрофона: тон с шумом блоками по chunk.
+
+    realtime=False - блоки выдаются без пауз, для замеров производительности.
+    """
+
+    def __init__(self, rate=AUDIO_CONFIG['rate'], chunk=AUDIO_CONFIG['chunk'],
+                 frequency=440.0, amplitude=8000, noise=300, realtime=True, seed=0):
+        self.rate = rate
+        self.chunk = chunk
+        self.frequency = frequency
+        self.amplitude = amplitude
+        self.noise = noise
+        self.realtime = realtime
+        self.rng = np.random.default_rng(seed)
+        self.position = 0
+        self.thread = None
+        self.active = False
+
+    def block(self):
+        """Следующий блок отсчетов int16"""
+        t = (self.position + np.arange(self.chunk)) / self.rate
+        self.position += self.chunk
+        signal = self.amplitude * np.sin(2 * np.pi * self.frequency * t)
+        signal += self.noise * self.rng.standard_normal(self.chunk)
+        return np.clip(signal, -32768, 32767).astype(np.int16)
+
+    def start(self, callback):
+        """Вызов callback блоками, как это делает PyAudio"""
+        self.active = True
+        self.thread = threading.Thread(target=self._run, args=(callback,), daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.active = False
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+
+    def run_blocks(self, callback, count):
+        """Синхронная выдача count блоков (без потока)"""
+        for _ in range(count):
+            callback(self.block().tobytes(), self.chunk, None, 0)
+
+    def _run(self, callback):
+        period = self.chunk / self.rate
+        next_block = time.monotonic()
+        while self.active:
+            callback(self.block().tobytes(), self.chunk, None, 0)
+            if self.realtime:
+                next_block += period
+                delay = next_block - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
@@ -0,0 +1,364 @@
+"""
+Сжатие голоса для передачи по UDP.
+
+Звук захватывается с частотой AUDIO_CONFIG['rate'], передискретизируется
+до частоты профиля качества (VOICE_QUALITY) и кодируется:
+
+    mulaw   G.711 mu-law, 8 бит на отсчет (таблица на все значения int16)
+    adpcm   IMA ADPCM, 4 бита на отсчет; каждый пакет несет состояние
+            предсказателя в заголовке и декодируется независимо от
+            предыдущих, поэтому потеря пакета не сбивает декодер
+
+Формат кодированного кадра: кодек (1 байт), частота (2 байта, big-endian),
+данные кодека. Требуется NumPy.
+"""
+
+import bisect
+import math
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from config import AUDIO_CONFIG, VOICE_QUALITY
+
+CODEC_PCM16 = 0
+CODEC_MULAW = 1
+CODEC_ADPCM = 2
+
+CODECS = {'pcm16': CODEC_PCM16, 'mulaw': CODEC_MULAW, 'adpcm': CODEC_ADPCM}
+
+FRAME_HEADER = struct.Struct('!BH')
+ADPCM_HEADER = struct.Struct('<hB')  # предсказатель и индекс шага
+
+# Уровень кадра в дБ относительно одного отсчета int16 (как в voice_speakers)
+MAX_LEVEL = 127
+
+_ADPCM_STEPS = (
+    7, 8, 9, 10, 11, 12, 13, 14, 16, 17, 19, 21, 23, 25, 28, 31, 34, 37, 41, 45,
+    50, 55, 60, 66, 73, 80, 88, 97, 107, 118, 130, 143, 157, 173, 190, 209, 230,
+    253, 279, 307, 337, 371, 408, 449, 494, 544, 598, 658, 724, 796, 876, 963,
+    1060, 1166, 1282, 1411, 1552, 1707, 1878, 2066, 2272, 2499, 2749, 3024, 3327,
+    3660, 4026, 4428, 4871, 5358, 5894, 6484, 7132, 7845, 8630, 9493, 10442,
+    11487, 12635, 13899, 15289, 16818, 18500, 20350, 22385, 24623, 27086, 29794,
+    32767
+)
+_ADPCM_INDEX_SHIFT = (-1, -1, -1, -1, 2, 4, 6, 8)
+
+
+def _adpcm_tables():
+    """Приращение предсказателя и следующий индекс шага для (индекс, полубайт)"""
+    deltas = []
+    next_index = []
+    for index, step in enumerate(_ADPCM_STEPS):
+        row_delta = []
+        row_index = []
+        for nibble in range(16):
+            delta = step >> 3
+            if nibble & 4:
+                delta += step
+            if nibble & 2:
+                delta += step >> 1
+            if nibble & 1:
+                delta += step >> 2
+            row_delta.append(-delta if nibble & 8 else delta)
+            row_index.append(min(88, max(0, index + _ADPCM_INDEX_SHIFT[nibble & 7])))
+        deltas.append(tuple(row_delta))
+        next_index.append(tuple(row_index))
+    return tuple(deltas), tuple(next_index)
+
+
+_ADPCM_DELTAS, _ADPCM_NEXT_INDEX = _adpcm_tables()
+
+
+def _mulaw_tables():
+    """Таблица кодирования на все 65536 значений int16 и таблица декодирования"""
+    samples = np.arange(-32768, 32768, dtype=np.int32)
+    sign = np.where(samples < 0, 0x80, 0)
+    magnitude = np.minimum(np.abs(samples), 32635) + 0x84
+    exponent = np.floor(np.log2(magnitude)).astype(np.int32) - 7
+    mantissa = (magnitude >> (exponent + 3)) & 0x0F
+    encoded = (~(sign | (exponent << 4) | mantissa) & 0xFF).astype(np.uint8)
+    # Индекс таблицы - отсчет, прочитанный как uint16
+    encode = np.empty(65536, dtype=np.uint8)
+    encode[samples.astype(np.uint16)] = encoded
+
+    codes = ~np.arange(256, dtype=np.int32) & 0xFF
+    exponent = (codes >> 4) & 0x07
+    mantissa = codes & 0x0F
+    magnitude = (((mantissa << 3) + 0x84) << exponent) - 0x84
+    decode = np.where(codes & 0x80, -magnitude, magnitude).astype(np.int16)
+    return encode, decode
+
+
+if np is not None:
+    _MULAW_ENCODE, _MULAW_DECODE = _mulaw_tables()
+
+
+def quality_profile(quality):
+    """Частота, кодек и битрейт (без заголовков) для low/medium/high"""
+    if quality not in VOICE_QUALITY:
+        raise ValueError(f"Неизвестное качество голоса: {quality}")
+    profile = dict(VOICE_QUALITY[quality])
+    bits = {'pcm16': 16, 'mulaw': 8, 'adpcm': 4}[profile['codec']]
+    profile['bitrate'] = profile['rate'] * bits
+    return profile
+
+
+def frame_level(samples):
+    """Уровень кадра int16 в дБ: 0 - тишина, около 90 - полная шкала"""
+    if not len(samples):
+        return 0
+    mean = float(np.abs(samples.astype(np.int32)).mean())
+    if mean < 1:
+        return 0
+    return min(MAX_LEVEL, int(20 * math.log10(mean)))
+
+
+def mulaw_encode(samples):
+    return _MULAW_ENCODE[samples.view(np.uint16)].tobytes()
+
+
+def mulaw_decode(data):
+    return _MULAW_DECODE[np.frombuffer(data, dtype=np.uint8)]
+
+
+def adpcm_encode(samples, state):
+    """Кодирование кадра IMA ADPCM.
+
+    state - [предсказатель, индекс шага], продолжается от кадра к кадру;
+    его значение на начало кадра записывается в заголовок.
+    """
+    predictor, index = state
+    header = ADPCM_HEADER.pack(predictor, index)
+    deltas = _ADPCM_DELTAS
+    next_index = _ADPCM_NEXT_INDEX
+    steps = _ADPCM_STEPS
+    nibbles = []
+    for sample in samples.tolist():
+        diff = sample - predictor
+        if diff < 0:
+            magnitude = (-diff << 2) // steps[index]
+            nibble = (magnitude if magnitude < 7 else 7) | 8
+        else:
+            magnitude = (diff << 2) // steps[index]
+            nibble = magnitude if magnitude < 7 else 7
+        predictor += deltas[index][nibble]
+        if predictor > 32767:
+            predictor = 32767
+        elif predictor < -32768:
+            predictor = -32768
+        index = next_index[index][nibble]
+        nibbles.append(nibble)
+    state[0] = predictor
+    state[1] = index
+
+    if len(nibbles) & 1:
+        nibbles.append(0)
+    packed = bytes(
+        low | (high << 4) for low, high in zip(nibbles[0::2], nibbles[1::2])
+    )
+    return header + packed
+
+
+def adpcm_decode(data):
+    """Декодирование кадра IMA ADPCM с состоянием из заголовка"""
+    predictor, index = ADPCM_HEADER.unpack_from(data)
+    deltas = _ADPCM_DELTAS
+    next_index = _ADPCM_NEXT_INDEX
+    samples = []
+    for byte in data[ADPCM_HEADER.size:]:
+        for nibble in (byte & 0x0F, byte >> 4):
+            predictor += deltas[index][nibble]
+            if predictor > 32767:
+                predictor = 32767
+            elif predictor < -32768:
+                predictor = -32768
+            index = next_index[index][nibble]
+            samples.append(predictor)
+    return np.array(samples, dtype=np.int16)
+
+
+def decode_frame(data):
+    """Кодированный кадр -> (отсчеты int16, частота)"""
+    codec, rate = FRAME_HEADER.unpack_from(data)
+    body = bytes(data[FRAME_HEADER.size:])
+    if codec == CODEC_MULAW:
+        return mulaw_decode(body), rate
+    if codec == CODEC_ADPCM:
+        return adpcm_decode(body), rate
+    if codec == CODEC_PCM16:
+        return np.frombuffer(body, dtype='<i2').astype(np.int16), rate
+    raise ValueError(f"Неизвестный кодек голоса: {codec}")
+
+
+class Resampler:
+    """Потоковая передискретизация линейной интерполяцией.
+
+    При понижении частоты сигнал сначала сглаживается скользящим средним
+    по отношению частот, чтобы ослабить наложение спектров. Состояние
+    (хвост входа и дробная позиция) переносится между блоками, поэтому
+    стыки блоков не дают щелчков.
+    """
+
+    def __init__(self, src_rate, dst_rate):
+        self.src_rate = src_rate
+        self.dst_rate = dst_rate
+        self.step = src_rate / dst_rate
+        taps = int(self.step) if self.step > 1 else 1
+        self.kernel = np.full(taps, 1.0 / taps, dtype=np.float32) if taps > 1 else None
+        self.tail = np.zeros(taps - 1, dtype=np.float32)
+        self.previous = 0.0
+        self.position = 1.0  # позиция следующего выходного отсчета; 0 - previous
+
+    def retarget(self, dst_rate, lag=1.0):
+        """Тот же поток с другой выходной частотой, без сброса истории входа.
+
+        lag - на сколько старых выходных шагов до следующего отсчета
+        отстоит последний выданный; новый отсчет будет через новый шаг после него.
+        """
+        resampler = Resampler(self.src_rate, dst_rate)
+        taps = len(resampler.tail)
+        if taps:
+            # Хвост фильтра - последние входные отсчеты; если их меньше,
+            # недостающие повторяют самый ранний, а не нули
+            history = self.tail if len(self.tail) else np.full(1, self.previous, np.float32)
+            if len(history) >= taps:
+                resampler.tail = history[len(history) - taps:].copy()
+            else:
+                resampler.tail = np.concatenate(
+                    (np.full(taps - len(history), history[0], np.float32), history)
+                )
+        resampler.previous = self.previous
+        resampler.position = self.position - lag * self.step + resampler.step
+        return resampler
+
+    def resource(self, src_rate):
+        """Продолжение потока, у которого сменилась входная частота.
+
+        Следующий выходной отсчет остается на том же расстоянии во времени
+        от последнего входного, поэтому стык не дает ни щелчка, ни недостачи.
+        """
+        resampler = Resampler(src_rate, self.dst_rate)
+        resampler.previous = self.previous
+        resampler.position = self.position * src_rate / self.src_rate
+        if len(resampler.tail):
+            resampler.tail[:] = self.previous
+        return resampler
+
+    def process(self, samples):
+        """Блок int16 на src_rate -> блок int16 на dst_rate"""
+        if self.src_rate == self.dst_rate:
+            return samples
+        data = samples.astype(np.float32)
+        if self.kernel is not None:
+            data = np.concatenate((self.tail, data))
+            self.tail = data[len(data) - len(self.tail):]
+            data = np.convolve(data, self.kernel, 'valid')
+
+        count = len(data)
+        if self.position > count:
+            self.position -= count
+            if count:
+                self.previous = float(data[-1])
+            return np.zeros(0, dtype=np.int16)
+        block = np.empty(count + 1, dtype=np.float32)
+        block[0] = self.previous
+        block[1:] = data
+        outputs = int((count - self.position) // self.step) + 1
+        positions = self.position + self.step * np.arange(outputs)
+        result = np.interp(positions, np.arange(count + 1), block)
+        self.position = positions[-1] + self.step - count
+        self.previous = float(block[-1])
+        return np.clip(np.rint(result), -32768, 32767).astype(np.int16)
+
+
+class VoiceEncoder:
+    """Захваченный звук -> кодированные кадры по AUDIO_CONFIG['frame_ms']"""
+
+    def __init__(self, quality=AUDIO_CONFIG['voice_quality'], input_rate=AUDIO_CONFIG['rate'],
+                 frame_ms=AUDIO_CONFIG['frame_ms']):
+        if np is None:
+            raise RuntimeError("Для кодирования голоса требуется NumPy")
+        self.input_rate = input_rate
+        self.frame_ms = frame_ms
+        self.set_quality(quality)
+
+    def set_quality(self, quality):
+        """Смена профиля качества; накопленный звук пересчитывается заново"""
+        profile = quality_profile(quality)
+        self.quality = quality
+        self.profile = profile
+        self.rate = profile['rate']
+        self.codec = CODECS[profile['codec']]
+        self.frame_samples = self.rate * self.frame_ms // 1000
+        self.header = FRAME_HEADER.pack(self.codec, self.rate)
+        self.resampler = Resampler(self.input_rate, self.rate)
+        self.pending = np.zeros(0, dtype=np.int16)
+        self.adpcm_state = [0, 0]
+        self.last_frame = None  # последний кадр - для продолжения при смене профиля
+
+    def switch_quality(self, quality):
+        """Смена профиля посреди фразы без щелчка.
+
+        В отличие от set_quality состояние не сбрасывается: передискретизатор
+        сохраняет историю входа, недокодированный остаток пересчитывается на
+        новую частоту, предсказатель ADPCM продолжает с последнего отсчета.
+        Номера и время кадров не меняются - кадр по-прежнему frame_ms.
+        """
+        if quality == self.quality:
+            return
+        old_rate = self.rate
+        old_codec = self.codec
+        resampler = self.resampler
+        pending = self.pending
+        last = self.last_frame
+        adpcm_state = self.adpcm_state
+        self.set_quality(quality)
+
+        # Остаток пересчитывается на сетку новой частоты, продолжающую
+        # последний закодированный отсчет (время -1 в отсчетах старой частоты)
+        lag = 1.0
+        if len(pending):
+            ratio = old_rate / self.rate
+            before = float(last[-1]) if last is not None and len(last) else float(pending[0])
+            times = np.arange(-1 + ratio, len(pending) - 1 + 1e-9, ratio)
+            self.pending = np.rint(np.interp(
+                times, np.arange(-1, len(pending)), np.concatenate(([before], pending))
+            )).astype(np.int16)
+            lag = len(pending) - times[-1] if len(times) else len(pending) + 1
+        self.resampler = resampler.retarget(self.rate, lag)
+        if last is not None and len(last):
+            if old_codec == CODEC_ADPCM and self.codec == CODEC_ADPCM:
+                self.adpcm_state = adpcm_state
+            else:
+                # Предсказатель с последнего отсчета, шаг - по размаху кадра
+                diff = float(np.abs(np.diff(last.astype(np.int32))).mean()) if len(last) > 1 else 0
+                index = min(88, bisect.bisect_left(_ADPCM_STEPS, diff))
+                self.adpcm_state = [int(last[-1]), index]
+            self.last_frame = last
+
+    def split(self, samples):
+        """Блок int16 с частотой захвата -> полные кадры на частоте профиля"""
+        resampled = self.resampler.process(samples)
+        if len(self.pending):
+            resampled = np.concatenate((self.pending, resampled))
+        size = self.frame_samples
+        full = len(resampled) - len(resampled) % size
+        self.pending = resampled[full:].copy()
+        return [resampled[start:start + size] for start in range(0, full, size)]
+
+    def encode(self, samples):
+        """Блок int16 с частотой захвата -> список (уровень, кодированный кадр)"""
+        return [(frame_level(frame), self.encode_frame(frame)) for frame in self.split(samples)]
+
+    def encode_frame(self, frame):
+        """Кодирование одного кадра частоты профиля"""
+        self.last_frame = frame
+        if self.codec == CODEC_MULAW:
+            return self.header + mulaw_encode(frame)
+        if self.codec == CODEC_ADPCM:
+            return self.header + adpcm_encode(frame, self.adpcm_state)
+        return self.header + frame.astype('<i2').tobytes()
@@ -0,0 +1,208 @@
+"""
+Серверное микширование голоса (режим MCU).
+
+Вместо пересылки каждого потока каждому слушателю сервер раз в
+AUDIO_CONFIG['frame_ms'] складывает последние кадры всех говорящих комнаты
+и отправляет каждому слушателю один поток. Говорящий получает микс без
+собственного голоса.
+
+Принимаются пакеты VOICE: кадр декодируется (voice_codec.decode_frame) и
+приводится к частоте микширования. Микс уходит тоже пакетом VOICE,
+закодированным mu-law, от отправителя MIX_SENDER - клиент воспроизводит
+его как обычный поток. Номер и время пакетов у комнаты свои; первый кадр
+после тишины помечен FLAG_START, конец речи в комнате - комфортным шумом
+(FLAG_CN). Требуется NumPy.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from config import AUDIO_CONFIG, VOICE_QUALITY
+from voice_codec import FRAME_HEADER, CODEC_MULAW, decode_frame, frame_level, mulaw_encode
+from voice_relay import FLAG_CN, FLAG_START, PACKET_VOICE, VOICE_HEADER, VOICE_FLAGS_OFFSET
+
+# Сколько кадров говорящего держим про запас на случай неровного прихода
+MAX_QUEUED_FRAMES = 3
+# Номер отправителя микса: voice_id участников начинаются с 1
+MIX_SENDER = 0
+
+voice_log = logging.getLogger('voice')
+
+
+class _RoomStream:
+    """Номер и время пакетов микса комнаты; номер продолжается между фразами"""
+
+    def __init__(self):
+        self.sequence = 0
+        self.timestamp = 0
+        self.talking = False
+
+
+class VoiceMixer:
+    """Микшер комнат с фиксированным шагом"""
+
+    def __init__(self, sock, rate=VOICE_QUALITY['high']['rate'], frame_ms=AUDIO_CONFIG['frame_ms']):
+        if np is None:
+            raise RuntimeError("Для микширования голоса требуется NumPy")
+        self.sock = sock
+        self.rate = rate
+        self.frame_ms = frame_ms
+        self.frame_samples = rate * frame_ms // 1000
+        self.period = frame_ms / 1000
+        self.codec_header = FRAME_HEADER.pack(CODEC_MULAW, rate)
+        self.epoch = time.monotonic()
+        self.lock = threading.Lock()
+        self.pending = {}  # {room: {address: deque of int16 frames}}
+        self.streams = {}  # {room: _RoomStream}
+        self.mixed = 0
+        self.rejected = 0
+        self.late_ticks = 0
+
+    def push(self, room, address, packet):
+        """Пакет VOICE говорящего для ближайшего такта"""
+        if len(packet) <= VOICE_HEADER.size or packet[0] != PACKET_VOICE:
+            self.rejected += 1
+            return
+        if packet[VOICE_FLAGS_OFFSET] & FLAG_CN:
+            # Конец фразы: кадров больше не будет, такт уберет говорящего сам
+            return
+        try:
+            samples, rate = decode_frame(packet[VOICE_HEADER.size:])
+        except Exception:
+            self.rejected += 1
+            return
+        frame = self._to_mix_rate(samples, rate)
+        if frame is None:
+            self.rejected += 1
+            return
+        with self.lock:
+            speakers = self.pending.setdefault(room, {})
+            frames = speakers.get(address)
+            if frames is None:
+                frames = speakers[address] = deque(maxlen=MAX_QUEUED_FRAMES)
+            frames.append(frame)
+
+    def _to_mix_rate(self, samples, rate):
+        """Кадр кодека -> frame_samples отсчетов частоты микширования или None"""
+        if not rate or len(samples) != rate * self.frame_ms // 1000:
+            return None
+        if rate == self.rate:
+            return samples.astype(np.int32)
+        # Кадр короткий (frame_ms), линейной интерполяции внутри кадра хватает
+        positions = np.arange(self.frame_samples) * (rate / self.rate)
+        return np.interp(positions, np.arange(len(samples)), samples).astype(np.int32)
+
+    def run(self, is_running, room_targets):
+        """Планировщик тактов: шаг привязан к часам, а не ко времени обработки"""
+        next_tick = time.monotonic() + self.period
+        while is_running():
+            delay = next_tick - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            elif delay < -self.period:
+                # Отстали больше чем на такт - пропускаем, а не догоняем пачкой
+                self.late_ticks += 1
+                next_tick = time.monotonic()
+            next_tick += self.period
+
+            try:
+                self.tick(room_targets)
+            except Exception as e:
+                voice_log.error("Ошибка микширования голоса: %s", e)
+
+    def tick(self, room_targets):
+        """Один такт: по кадру от каждого активного говорящего каждой комнаты"""
+        with self.lock:
+            batch = {}
+            for room, speakers in self.pending.items():
+                frames = {
+                    address: queue.popleft()
+                    for address, queue in speakers.items() if queue
+                }
+                if frames:
+                    batch[room] = frames
+            # Говорящие без кадров больше не активны
+            for speakers in self.pending.values():
+                for address in [a for a, queue in speakers.items() if not queue]:
+                    del speakers[address]
+
+        for room, stream in self.streams.items():
+            if stream.talking and room not in batch:
+                # В комнате замолчали: слушатели закрывают фразу
+                self.end_room(stream, room_targets.get(room, ()))
+        for room, frames in batch.items():
+            stream = self.streams.get(room)
+            if stream is None:
+                stream = self.streams[room] = _RoomStream()
+            self.mix_room(stream, frames, room_targets.get(room, ()))
+
+    def _now_ms(self):
+        return int((time.monotonic() - self.epoch) * 1000)
+
+    def _packet(self, stream, samples, flags):
+        return VOICE_HEADER.pack(
+            PACKET_VOICE, frame_level(samples), MIX_SENDER, stream.sequence,
+            stream.timestamp & 0xFFFFFFFF, flags
+        ) + self.codec_header + mulaw_encode(samples)
+
+    def mix_room(self, stream, frames, listeners):
+        """Микширование кадров комнаты и рассылка слушателям"""
+        flags = 0
+        if not stream.talking:
+            # Время новой фразы - по часам: пауза видна получателю
+            flags = FLAG_START
+            stream.talking = True
+            stream.timestamp = max(stream.timestamp, self._now_ms())
+        speakers = list(frames)
+        stack = np.stack([frames[address] for address in speakers])
+        total = stack.sum(axis=0)
+        sendto = self.sock.sendto
+
+        # Общий микс для всех, кто сейчас не говорит
+        common = self._packet(stream, np.clip(total, -32768, 32767).astype(np.int16), flags)
+        speaker_rows = {address: i for i, address in enumerate(speakers)}
+
+        lone_speaker = len(speakers) == 1
+        for address in listeners:
+            row = speaker_rows.get(address)
+            if row is None:
+                data = common
+            elif lone_speaker:
+                # Единственному говорящему слушать нечего
+                continue
+            else:
+                # Сумма без собственного кадра
+                own = np.clip(total - stack[row], -32768, 32767).astype(np.int16)
+                data = self._packet(stream, own, flags)
+            try:
+                sendto(data, address)
+                self.mixed += 1
+            except OSError:
+                self.rejected += 1
+        stream.sequence = (stream.sequence + 1) & 0xFFFF
+        stream.timestamp += self.frame_ms
+
+    def end_room(self, stream, listeners):
+        """Комфортный шум - конец фразы микса комнаты"""
+        data = VOICE_HEADER.pack(
+            PACKET_VOICE, 0, MIX_SENDER, stream.sequence, stream.timestamp & 0xFFFFFFFF, FLAG_CN
+        ) + bytes([0])
+        stream.talking = False
+        stream.sequence = (stream.sequence + 1) & 0xFFFF
+        stream.timestamp += self.frame_ms
+        for address in listeners:
+            try:
+                self.sock.sendto(data, address)
+            except OSError:
+                self.rejected += 1
+
+    def stats(self):
+        """Счетчики микшера"""
+        return {'mixed': self.mixed, 'mix_rejected': self.rejected, 'late_ticks': self.late_ticks}
@@ -0,0 +1,456 @@
+"""
+Прием и воспроизведение голоса клиентом.
+
+    UDP -> JitterBuffer отправителя -> поток воспроизведения: декодирование,
+           маскировка потерь, передискретизация, сведение отправителей ->
+           SampleRing -> колбэк вывода PyAudio
+
+JitterBuffer упорядочивает кадры по номеру, маскирует пропуски и подбирает
+глубину (сколько кадров держать в запасе) по измеренному джиттеру: чем
+ровнее приходят пакеты, тем меньше задержка от рта до уха. Он не зависит ни
+от звука, ни от часов - время передается явно, поэтому его поведение
+проверяется на записанных или сгенерированных трассах (см.
+benchmarks/bench_jitter_buffer.py).
+
+Фраза заканчивается пакетом комфортного шума (FLAG_CN): буфер сразу
+завершает воспроизведение, не дожидаясь HANGUP_TICKS, а до следующей фразы
+вместо полной тишины звучит шум с уровнем фона отправителя.
+
+Раз в AUDIO_CONFIG['report_interval'] секунд клиент отправляет серверу
+отчет о приеме (report): по каждому отправителю принято, потеряно, джиттер,
+а также RTT, измеренный по эхо предыдущего отчета (on_echo).
+
+Поток воспроизведения выдает по кадру (AUDIO_CONFIG['frame_ms']), когда в
+кольце вывода остается меньше PLAYOUT_AHEAD кадров, то есть его шаг задают
+часы звуковой карты.
+"""
+
+import logging
+import math
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import pyaudio
+except ImportError:
+    pyaudio = None
+
+from audio_ring import SampleRing
+from config import AUDIO_CONFIG
+from voice_codec import Resampler, decode_frame
+from voice_relay import (
+    FLAG_CN, FLAG_START, PACKET_REPORT_ECHO, PACKET_VOICE, REPORT_ECHO, VOICE_HEADER,
+    encode_report
+)
+
+PA_CONTINUE = pyaudio.paContinue if pyaudio else 0
+
+# Кадр пропал - его место занимает маскировка
+LOST = object()
+
+MIN_DEPTH = 1  # кадров в запасе перед началом воспроизведения
+MAX_DEPTH = 12
+JITTER_DEPTH_FACTOR = 2.0  # запас в единицах оценки джиттера
+PENALTY_DECAY_TICKS = 500  # тактов без опустошения, после которых запас уменьшается
+SHRINK_TICKS = 25  # тактов подряд с лишними кадрами до сброса одного из них
+HANGUP_TICKS = 5  # тактов без кадров, после которых фраза считается законченной
+CONCEAL_GAIN = 0.5  # ослабление повторяемого кадра при каждой потере подряд
+PLAYOUT_AHEAD = 2  # кадров в кольце вывода
+STREAM_IDLE_TICKS = 1500  # тактов тишины, после которых отправитель забывается
+
+
+class ComfortNoise:
+    """Кадр комфортного шума: уровень фона отправителя в дБ"""
+
+    __slots__ = ('level',)
+
+    def __init__(self, level):
+        self.level = level
+
+
+class JitterBuffer:
+    """Буфер одного отправителя: порядок, маскировка потерь, адаптивная глубина.
+
+    put() вызывается при приеме пакета, get() - раз в длительность кадра.
+    Время - в миллисекундах по часам получателя; метка времени пакета - по
+    часам отправителя, смещение часов не важно, учитываются только его
+    колебания (джиттер по RFC 3550).
+    """
+
+    def __init__(self, frame_ms=AUDIO_CONFIG['frame_ms'], min_depth=MIN_DEPTH,
+                 max_depth=MAX_DEPTH):
+        self.frame_ms = frame_ms
+        self.min_depth = min_depth
+        self.max_depth = max_depth
+        self.frames = {}  # {расширенный номер: кадр}
+        self.base = None  # первый принятый номер - для подсчета потерь
+        self.ends = set()  # номера кадров, завершающих фразу (FLAG_CN)
+        self.highest = None
+        self.next_seq = None
+        self.playing = False
+        self.waiting = 0  # тактов ожидания набора глубины
+        self.stalled = 0  # тактов подряд без очередного кадра
+        self.hold = 0  # тактов паузы воспроизведения для роста запаса
+        self.over_depth = 0
+        self.calm_ticks = 0
+        self.penalty = 0
+        self.jitter = 0.0
+        self.last_transit = None
+        self.depth = min_depth
+        # Счетчики
+        self.received = 0
+        self.late = 0
+        self.duplicates = 0
+        self.concealed = 0
+        self.underruns = 0
+        self.dropped = 0
+
+    def put(self, seq, timestamp, payload, now_ms, flags=0):
+        """Прием кадра с номером seq (по модулю 2**16)"""
+        ext = self._extend(seq)
+        transit = now_ms - timestamp
+        if self.last_transit is not None and not flags & FLAG_START:
+            self.jitter += (abs(transit - self.last_transit) - self.jitter) / 16
+        self.last_transit = transit
+
+        if self.next_seq is not None and ext < self.next_seq:
+            # Опоздал: его место уже занято маскировкой, запаса не хватило
+            self.late += 1
+            if self.playing and self.next_seq - ext <= self.max_depth:
+                self.underruns += 1
+                self._grow()
+            return
+        if ext in self.frames:
+            self.duplicates += 1
+            return
+        self.frames[ext] = payload
+        if flags & FLAG_CN:
+            self.ends.add(ext)
+        self.received += 1
+        self.stalled = 0
+        self._update_depth()
+
+    def get(self):
+        """Кадр очередного такта: данные кадра, LOST (маскировать) или None (тишина)"""
+        if not self.playing:
+            if not self.frames:
+                return None
+            self.waiting += 1
+            if len(self.frames) < self.depth and self.waiting < self.depth:
+                return None
+            self.playing = True
+            self.waiting = 0
+            start = min(self.frames)
+            if self.next_seq is None or start > self.next_seq:
+                self.next_seq = start
+
+        if self.hold:
+            # Запас увеличен: воспроизведение отстает на такт
+            self.hold -= 1
+            self.concealed += 1
+            return LOST
+
+        self._calm_down()
+        payload = self.frames.pop(self.next_seq, None)
+        # График воспроизведения не ждет опоздавших: кадр, пришедший
+        # после своего такта, будет отброшен и увеличит запас
+        self.next_seq += 1
+        if payload is not None:
+            if self.ends and self.next_seq - 1 in self.ends:
+                # Отправитель закончил фразу - следующая наберет запас заново
+                self.ends.discard(self.next_seq - 1)
+                self.playing = False
+                self.stalled = 0
+                return payload
+            self._shrink()
+            return payload
+
+        if not self.frames:
+            # Кадров нет: пауза в сети или конец фразы
+            self.stalled += 1
+            if self.stalled >= HANGUP_TICKS:
+                self.playing = False
+                return None
+        self.concealed += 1
+        return LOST
+
+    def lost(self):
+        """Потеряно пакетов с начала приема: ожидалось по номерам минус принятые"""
+        if self.base is None:
+            return 0
+        expected = self.highest - self.base + 1
+        return max(0, expected - self.received - self.late)
+
+    def stats(self):
+        """Счетчики и текущая глубина"""
+        return {
+            'depth': self.depth,
+            'buffered': len(self.frames),
+            'jitter_ms': round(self.jitter, 1),
+            'received': self.received,
+            'late': self.late,
+            'duplicates': self.duplicates,
+            'concealed': self.concealed,
+            'underruns': self.underruns,
+            'dropped': self.dropped,
+        }
+
+    def _extend(self, seq):
+        """Номер по модулю 2**16 -> монотонный номер"""
+        if self.highest is None:
+            self.highest = self.base = seq
+            return seq
+        delta = (seq - self.highest) & 0xFFFF
+        if delta >= 0x8000:
+            delta -= 0x10000
+        ext = self.highest + delta
+        if ext > self.highest:
+            self.highest = ext
+        elif ext < self.base:
+            # Опоздавший пакет из начала потока
+            self.base = ext
+        return ext
+
+    def _update_depth(self):
+        jitter_frames = math.ceil(JITTER_DEPTH_FACTOR * self.jitter / self.frame_ms)
+        depth = self.min_depth + jitter_frames + self.penalty
+        self.depth = max(self.min_depth, min(self.max_depth, depth))
+
+    def _grow(self):
+        if self.depth < self.max_depth:
+            self.hold += 1
+        self.penalty += 1
+        self.calm_ticks = 0
+        self._update_depth()
+
+    def _calm_down(self):
+        """Постепенное уменьшение запаса после долгой работы без опустошений"""
+        if not self.penalty:
+            return
+        self.calm_ticks += 1
+        if self.calm_ticks >= PENALTY_DECAY_TICKS:
+            self.calm_ticks = 0
+            self.penalty -= 1
+            self._update_depth()
+
+    def _shrink(self):
+        """Сброс лишнего кадра, если запас долго больше нужного"""
+        if len(self.frames) > self.depth:
+            self.over_depth += 1
+            if (self.over_depth >= SHRINK_TICKS and self.next_seq in self.frames
+                    and self.next_seq not in self.ends):
+                del self.frames[self.next_seq]
+                self.next_seq += 1
+                self.dropped += 1
+                self.over_depth = 0
+        else:
+            self.over_depth = 0
+
+
+class VoicePlayback:
+    """Воспроизведение голоса всех отправителей комнаты"""
+
+    def __init__(self, output_rate=AUDIO_CONFIG['rate'], frame_ms=AUDIO_CONFIG['frame_ms']):
+        if np is None:
+            raise RuntimeError("Для воспроизведения голоса требуется NumPy")
+        self.output_rate = output_rate
+        self.frame_ms = frame_ms
+        self.frame_samples = output_rate * frame_ms // 1000
+        self.ring = SampleRing(self.frame_samples * (PLAYOUT_AHEAD + 4))
+        self.lock = threading.Lock()  # streams: поток приема и поток воспроизведения
+        self.streams = {}  # {sender: _Stream}
+        self.epoch = time.monotonic()
+        self.stream = None
+        self.thread = None
+        self.running = False
+        self.output_underruns = 0
+        self.rtt_ms = None  # по эхо последнего отчета
+
+    def now_ms(self):
+        return (time.monotonic() - self.epoch) * 1000
+
+    def receive(self, data):
+        """Разбор пакета VOICE и постановка кадра в буфер отправителя"""
+        if data and data[0] == PACKET_REPORT_ECHO:
+            return self.on_echo(data)
+        if len(data) <= VOICE_HEADER.size or data[0] != PACKET_VOICE:
+            return False
+        _, level, sender, seq, timestamp, flags = VOICE_HEADER.unpack_from(data)
+        if flags & FLAG_CN:
+            payload = ComfortNoise(data[VOICE_HEADER.size])
+        else:
+            payload = bytes(data[VOICE_HEADER.size:])
+        with self.lock:
+            stream = self.streams.get(sender)
+            if stream is None:
+                stream = self.streams[sender] = _Stream(self.frame_ms)
+            stream.buffer.put(seq, timestamp, payload, self.now_ms(), flags)
+        return True
+
+    def report(self):
+        """Пакет REPORT с состоянием приема всех отправителей"""
+        with self.lock:
+            blocks = [
+                (sender, stream.buffer.received + stream.buffer.late,
+                 stream.buffer.lost(), stream.buffer.jitter)
+                for sender, stream in self.streams.items()
+            ]
+        return encode_report(int(self.now_ms()), self.rtt_ms, blocks)
+
+    def on_echo(self, data):
+        """Эхо отчета: RTT до ретранслятора"""
+        if len(data) < REPORT_ECHO.size:
+            return False
+        _, sent_ms = REPORT_ECHO.unpack_from(data)
+        self.rtt_ms = (int(self.now_ms()) - sent_ms) & 0xFFFFFFFF
+        return True
+
+    def callback(self, in_data, frame_count, time_info, status):
+        """Колбэк вывода PyAudio: только чтение из кольца"""
+        samples = self.ring.read(frame_count)
+        if samples is None or len(samples) < frame_count:
+            self.output_underruns += 1
+            padded = np.zeros(frame_count, dtype=np.int16)
+            if samples is not None:
+                padded[:len(samples)] = samples
+            samples = padded
+        return samples.tobytes(), PA_CONTINUE
+
+    def open(self, audio):
+        """Открытие потока вывода в режиме колбэка и запуск воспроизведения"""
+        self.stream = audio.open(
+            format=pyaudio.paInt16,
+            channels=AUDIO_CONFIG['channels'],
+            rate=self.output_rate,
+            output=True,
+            frames_per_buffer=self.frame_samples,
+            stream_callback=self.callback
+        )
+        self.start()
+
+    def start(self):
+        if self.running:
+            return
+        self.running = True
+        self.thread = threading.Thread(target=self._playout_loop, name='voice-playout', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.running = False
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        if self.thread is not None:
+            self.thread.join(timeout=1)
+
+    def tick(self):
+        """Один кадр вывода: сведение всех отправителей"""
+        with self.lock:
+            frames = [stream.buffer.get() for stream in self.streams.values()]
+            streams = list(self.streams.values())
+            idle = [
+                sender for sender, stream in self.streams.items()
+                if stream.idle > STREAM_IDLE_TICKS
+            ]
+            for sender in idle:
+                del self.streams[sender]
+        mix = None
+        for stream, frame in zip(streams, frames):
+            samples = stream.render(frame, self.output_rate, self.frame_samples)
+            if samples is None:
+                continue
+            if mix is None:
+                mix = samples.astype(np.int32)
+            else:
+                mix += samples
+        if mix is None:
+            return np.zeros(self.frame_samples, dtype=np.int16)
+        return np.clip(mix, -32768, 32767).astype(np.int16)
+
+    def stats(self):
+        """Состояние буферов всех отправителей"""
+        with self.lock:
+            streams = {sender: stream.buffer.stats() for sender, stream in self.streams.items()}
+        return {'streams': streams, 'output_underruns': self.output_underruns,
+                'rtt_ms': self.rtt_ms}
+
+    def _playout_loop(self):
+        ahead = self.frame_samples * PLAYOUT_AHEAD
+        poll = self.frame_ms / 4000
+        while self.running:
+            try:
+                while len(self.ring) < ahead:
+                    self.ring.write(self.tick())
+            except Exception as e:
+                logging.error(f"Ошибка воспроизведения голоса: {e}")
+            time.sleep(poll)
+
+
+class _Stream:
+    """Буфер и состояние декодера одного отправителя"""
+
+    def __init__(self, frame_ms):
+        self.buffer = JitterBuffer(frame_ms)
+        self.resampler = None
+        self.last = None  # последний декодированный кадр для маскировки
+        self.lost_run = 0
+        self.pending = np.zeros(0, dtype=np.int16)
+        self.idle = 0  # тактов подряд без звука
+        self.comfort = None  # уровень комфортного шума после конца фразы, дБ
+        self.rng = None
+
+    def render(self, frame, output_rate, size):
+        """Кадр отправителя на частоте вывода, ровно size отсчетов, или None"""
+        if frame is None or isinstance(frame, ComfortNoise):
+            self.idle += 1
+            self.last = None
+            self.lost_run = 0
+            self.pending = np.zeros(0, dtype=np.int16)
+            if frame is not None:
+                self.comfort = frame.level
+            if self.comfort is None:
+                return None
+            return self._comfort_noise(size)
+
+        if frame is LOST:
+            if self.last is None:
+                return None
+            # Повтор последнего кадра с затуханием
+            self.lost_run += 1
+            samples = (self.last * CONCEAL_GAIN ** self.lost_run).astype(np.int16)
+            rate = self.resampler.src_rate
+        else:
+            samples, rate = decode_frame(frame)
+            self.last = samples
+            self.lost_run = 0
+            self.comfort = None
+        self.idle = 0
+
+        if self.resampler is None:
+            self.resampler = Resampler(rate, output_rate)
+        elif self.resampler.src_rate != rate:
+            # Отправитель сменил профиль посреди фразы
+            self.resampler = self.resampler.resource(rate)
+        output = self.resampler.process(samples)
+        if len(self.pending):
+            output = np.concatenate((self.pending, output))
+        if len(output) < size:
+            # Недостача в пару отсчетов бывает на стыке смены частоты:
+            # повтор последнего отсчета вместо нулей, чтобы не было щелчка
+            fill = output[-1] if len(output) else 0
+            output = np.concatenate((output, np.full(size - len(output), fill, dtype=np.int16)))
+        self.pending = output[size:]
+        return output[:size]
+
+    def _comfort_noise(self, size):
+        """Белый шум с RMS, соответствующим уровню фона отправителя"""
+        if self.rng is None:
+            self.rng = np.random.default_rng()
+        rms = 10 ** (self.comfort / 20)
+        noise = self.rng.standard_normal(size) * rms
+        return np.clip(noise, -32768, 32767).astype(np.int16)
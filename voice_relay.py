@@ -0,0 +1,488 @@
+"""
+Ретрансляция голосовых UDP-пакетов между участниками комнаты.
+
+Формат датаграмм: первый байт - тип пакета, дальше данные.
+
+    REGISTER    0x01 + токен (ASCII)   клиент -> сервер, привязка адреса
+    REGISTERED  0x02                   сервер -> клиент, подтверждение
+    AUDIO       0x10 + аудиоданные     пересылается участникам комнаты
+    AUDIO_LEVEL 0x11 + уровень + аудио  то же, уровень громкости (1 байт, дБ)
+                                       посчитан клиентом
+    VOICE       0x12 + заголовок + кадр кодека (voice_codec), основной формат
+    REPORT      0x20 + отчет получателя  клиент -> сервер, качество приема
+    REPORT_ECHO 0x21 + время отчета (4)  сервер -> клиент, для измерения RTT
+
+Заголовок VOICE (VOICE_HEADER, big-endian):
+
+    тип (1) | уровень (1) | отправитель (2) | номер (2) | время, мс (4) | флаги (1)
+
+Номер пакета растет на 1 с каждым кадром (по модулю 2**16), время - момент
+захвата кадра по часам отправителя. Поле отправителя клиент оставляет
+нулевым: ретранслятор вписывает в него voice_id автора прямо в буфере
+приема, поэтому подделать его нельзя и копирования пакета не требуется.
+
+Флаги: FLAG_START - первый кадр фразы; FLAG_CN - комфортный шум, которым
+отправитель заканчивает фразу (данные - 1 байт уровня фона, дБ). По ним
+ретранслятор отслеживает, кто говорит, и сообщает о начале и конце речи
+через on_talk; фраза без FLAG_CN завершается по TALK_TIMEOUT.
+
+Отчет получателя (в духе RTCP receiver report) клиент шлет раз в
+AUDIO_CONFIG['report_interval'] секунд: REPORT_HEADER - время отправки по
+часам клиента, RTT по эхо предыдущего отчета (RTT_UNKNOWN - еще нет) и
+число блоков; затем REPORT_BLOCK на каждого слышимого отправителя -
+voice_id, принято и потеряно пакетов с начала приема, джиттер в 0.1 мс.
+Ретранслятор сразу возвращает время отчета в REPORT_ECHO и передает отчет
+в on_report (сводка - voice_reports.py).
+
+Токен выдается по текстовому каналу при входе (login_success), поэтому
+UDP-адрес всегда связан с аутентифицированной сессией.
+
+Если для комнаты задан лимит говорящих, пересылаются только пакеты самых
+громких из них (см. voice_speakers.py).
+"""
+
+import logging
+import secrets
+import select
+import socket
+import struct
+import threading
+import time
+
+from voice_speakers import DominantSpeakers, pcm_level
+
+PACKET_REGISTER = 0x01
+PACKET_REGISTERED = 0x02
+PACKET_AUDIO = 0x10
+PACKET_AUDIO_LEVEL = 0x11
+PACKET_VOICE = 0x12
+PACKET_REPORT = 0x20
+PACKET_REPORT_ECHO = 0x21
+
+VOICE_HEADER = struct.Struct('!BBHHIB')
+VOICE_SENDER = struct.Struct('!H')
+VOICE_SENDER_OFFSET = 2
+VOICE_FLAGS_OFFSET = VOICE_HEADER.size - 1
+# Флаги заголовка VOICE
+FLAG_START = 0x01  # первый кадр фразы
+FLAG_CN = 0x02  # комфортный шум: конец фразы
+
+TALK_TIMEOUT = 1.0  # секунд без пакетов, после которых фраза считается законченной
+TALK_SWEEP = 0.5  # период проверки зависших фраз
+
+REPORT_HEADER = struct.Struct('!BIHB')
+REPORT_BLOCK = struct.Struct('!HIIH')
+REPORT_ECHO = struct.Struct('!BI')
+RTT_UNKNOWN = 0xFFFF
+MAX_REPORT_BLOCKS = 255
+
+REGISTERED_REPLY = bytes([PACKET_REGISTERED])
+
+MAX_DATAGRAM = 4096
+RECV_BATCH = 32
+# Неблокирующее чтение без переключения режима сокета (нет в Windows)
+MSG_DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+
+# Ошибки голоса могут идти на каждый пакет: у категории voice лимит
+# записей в секунду (LOG_CONFIG['rate_limits'])
+voice_log = logging.getLogger('voice')
+
+
+class VoiceRelay:
+    """Пересылка голоса участникам комнаты отправителя.
+
+    Изменения состояния (вход, смена комнаты, блокировки) редки и идут
+    под блокировкой; горячий путь handle_packet читает только готовые
+    кортежи адресов, которые пересобираются при каждом изменении.
+    """
+
+    # Команды, которыми состояние передается в процессы-обработчики
+    COMMANDS = (
+        'add_token', 'set_room', 'remove_user', 'set_blocked', 'register_address',
+        'set_speaker_limit',
+    )
+
+    def __init__(self, sock, batch=RECV_BATCH, on_register=None, mixer=None,
+                 max_speakers=0, speaker_limits=None, on_talk=None, on_report=None):
+        self.sock = sock
+        self.on_register = on_register  # вызывается после привязки адреса
+        self.on_talk = on_talk  # on_talk(username, room, speaking) - начало и конец речи
+        self.on_report = on_report  # on_report(username, room, rtt_ms, blocks) - отчет получателя
+        self.mixer = mixer  # VoiceMixer для режима микширования
+        self.recorder = None  # TrafficRecorder: запись сведений о пакетах (traffic_capture.py)
+        # Кольцо заранее выделенных буферов: пакеты пачки принимаются
+        # через recvfrom_into без создания новых объектов bytes
+        self.batch = batch if MSG_DONTWAIT else 1
+        self.buffers = [bytearray(MAX_DATAGRAM) for _ in range(self.batch)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.lock = threading.Lock()
+        self.tokens = {}  # {token: username}
+        self.voice_ids = {}  # {username: voice_id} - номер отправителя в пакетах VOICE
+        self.last_voice_id = 0
+        self.user_tokens = {}  # {username: token}
+        self.user_rooms = {}  # {username: room}
+        self.user_addresses = {}  # {username: address}
+        self.addresses = {}  # {address: username}
+        self.address_rooms = {}  # {address: room}
+        self.room_addresses = {}  # {room: set of addresses}
+        self.room_targets = {}  # {room: tuple of addresses} - снимок для горячего пути
+        self.blocked = set()  # пользователи без права голоса (mute/ban)
+        self.talking = {}  # {address: время последнего пакета речи}
+        # Лимит одновременно пересылаемых говорящих, 0 - без ограничения
+        self.max_speakers = max_speakers
+        self.speaker_limits = dict(speaker_limits or {})  # {room: N}
+        self.speakers = {}  # {room: DominantSpeakers} - только для комнат с лимитом
+        self.received = 0  # пакетов принято
+        self.forwarded = 0
+        self.rejected = 0
+        self.reports = 0
+        self.send_errors = 0  # sendto не прошел: переполнен буфер отправки сокета
+        self.busy = 0.0  # секунд обработки пакетов (без ожидания приема)
+        self.speaker_dropped = 0  # пакеты, отброшенные выбором говорящих
+        self.speaker_dropped_forwards = 0  # несостоявшиеся пересылки этих пакетов
+
+    def issue_token(self, username, room):
+        """Выдача токена для привязки UDP-адреса к сессии пользователя"""
+        token = secrets.token_hex(16)
+        voice_id = self.voice_ids.get(username)
+        if not voice_id:
+            voice_id = self.last_voice_id = allocate_voice_id(self.voice_ids, self.last_voice_id)
+        self.add_token(token, username, room, voice_id)
+        return token
+
+    def add_token(self, token, username, room, voice_id=0):
+        """Регистрация выданного токена"""
+        with self.lock:
+            old_token = self.user_tokens.pop(username, None)
+            self.tokens.pop(old_token, None)
+            self.tokens[token] = username
+            self.user_tokens[username] = token
+            self.user_rooms[username] = room
+            self.voice_ids[username] = voice_id
+
+    def voice_id(self, username):
+        """Номер отправителя пользователя в пакетах VOICE"""
+        return self.voice_ids.get(username, 0)
+
+    def set_room(self, username, room):
+        """Перенос зарегистрированного адреса пользователя в другую комнату"""
+        with self.lock:
+            self.user_rooms[username] = room
+            address = self.user_addresses.get(username)
+            if address is not None:
+                self._move(address, self.address_rooms.get(address), room)
+
+    def remove_user(self, username):
+        """Удаление пользователя: токен, адрес и членство в комнате"""
+        with self.lock:
+            token = self.user_tokens.pop(username, None)
+            self.tokens.pop(token, None)
+            self.user_rooms.pop(username, None)
+            self.voice_ids.pop(username, None)
+            address = self.user_addresses.pop(username, None)
+            if address is not None:
+                self.addresses.pop(address, None)
+                self._move(address, self.address_rooms.get(address), None)
+
+    def set_blocked(self, username, blocked):
+        """Запрет или разрешение голоса для пользователя"""
+        if blocked:
+            self.blocked.add(username)
+        else:
+            self.blocked.discard(username)
+
+    def set_speaker_limit(self, room, limit):
+        """Лимит говорящих для комнаты; None - вернуть общий max_speakers"""
+        if limit is None:
+            self.speaker_limits.pop(room, None)
+        else:
+            self.speaker_limits[room] = limit
+        # Выбор начнется заново при следующем пакете комнаты
+        self.speakers.pop(room, None)
+
+    def speaker_limit(self, room):
+        """Действующий лимит говорящих комнаты"""
+        return self.speaker_limits.get(room, self.max_speakers)
+
+    def apply(self, command):
+        """Применение команды вида (имя, аргументы...)"""
+        name = command[0]
+        if name not in self.COMMANDS:
+            raise ValueError(f"Неизвестная команда ретранслятора: {name}")
+        getattr(self, name)(*command[1:])
+
+    def register_address(self, token, address):
+        """Привязка UDP-адреса по токену. Возвращает имя пользователя или None"""
+        with self.lock:
+            username = self.tokens.get(token)
+            if username is None:
+                return None
+            old_address = self.user_addresses.get(username)
+            if old_address is not None and old_address != address:
+                self.addresses.pop(old_address, None)
+                self._move(old_address, self.address_rooms.get(old_address), None)
+            self.user_addresses[username] = address
+            self.addresses[address] = username
+            self._move(address, self.address_rooms.get(address), self.user_rooms.get(username))
+        return username
+
+    def handle_packet(self, data, address):
+        """Обработка одной датаграммы"""
+        if not data:
+            return
+        kind = data[0]
+
+        if kind == PACKET_VOICE or kind == PACKET_AUDIO or kind == PACKET_AUDIO_LEVEL:
+            room = self.address_rooms.get(address)
+            username = self.addresses.get(address)
+            if room is None or username in self.blocked:
+                self.rejected += 1
+                return
+            if kind == PACKET_VOICE:
+                if len(data) <= VOICE_HEADER.size:
+                    self.rejected += 1
+                    return
+                if type(data) is bytes:
+                    data = bytearray(data)
+                VOICE_SENDER.pack_into(
+                    data, VOICE_SENDER_OFFSET, self.voice_ids.get(username, 0)
+                )
+                payload = data[VOICE_HEADER.size:]
+                if data[VOICE_FLAGS_OFFSET] & FLAG_CN:
+                    if self.talking.pop(address, None) is not None and self.on_talk:
+                        self.on_talk(username, room, False)
+                else:
+                    if address not in self.talking and self.on_talk:
+                        self.on_talk(username, room, True)
+                    self.talking[address] = time.monotonic()
+            elif kind == PACKET_AUDIO:
+                payload = data[1:]
+            elif len(data) > 1:
+                payload = data[2:]
+            else:
+                self.rejected += 1
+                return
+
+            if self.recorder is not None:
+                flags = data[VOICE_FLAGS_OFFSET] if kind == PACKET_VOICE else 0
+                self.recorder.voice(username, kind, len(data), flags)
+
+            targets = self.room_targets.get(room, ())
+            speakers = self.speakers.get(room)
+            if speakers is None:
+                limit = self.speaker_limit(room)
+                if limit:
+                    speakers = self.speakers[room] = DominantSpeakers(limit)
+            if speakers is not None:
+                level = pcm_level(payload) if kind == PACKET_AUDIO else data[1]
+                if not speakers.admit(address, level, time.monotonic()):
+                    self.speaker_dropped += 1
+                    self.speaker_dropped_forwards += max(len(targets) - 1, 0)
+                    return
+
+            if self.mixer is not None:
+                self.mixer.push(room, address, data)
+                return
+            sendto = self.sock.sendto
+            for target in targets:
+                if target != address:
+                    try:
+                        sendto(data, target)
+                        self.forwarded += 1
+                    except OSError:
+                        self.rejected += 1
+                        self.send_errors += 1
+
+        elif kind == PACKET_REPORT:
+            username = self.addresses.get(address)
+            if username is None or len(data) < REPORT_HEADER.size:
+                self.rejected += 1
+                return
+            _, sent_ms, _, _ = REPORT_HEADER.unpack_from(data)
+            try:
+                self.sock.sendto(REPORT_ECHO.pack(PACKET_REPORT_ECHO, sent_ms), address)
+            except OSError:
+                pass
+            self.reports += 1
+            if self.on_report:
+                rtt_ms, blocks = decode_report(data)
+                self.on_report(username, self.address_rooms.get(address), rtt_ms, blocks)
+
+        elif kind == PACKET_REGISTER:
+            try:
+                token = bytes(data[1:]).decode('ascii')
+            except UnicodeDecodeError:
+                token = None
+            username = self.register_address(token, address) if token else None
+            if username is None:
+                self.rejected += 1
+                return
+            if self.on_register:
+                self.on_register(token, address)
+            self.sock.sendto(REGISTERED_REPLY, address)
+            voice_log.info("Голосовой адрес %s привязан к %s", address, username)
+
+        else:
+            self.rejected += 1
+
+    def serve(self, is_running):
+        """Цикл приема и пересылки.
+
+        Первый пакет пачки ждем в блокирующем recvfrom_into, остальные
+        забираем без ожидания (MSG_DONTWAIT), пока очередь сокета не опустеет
+        или не заполнится кольцо. Затем пачка пересылается: sendto получает
+        memoryview на тот же буфер, данные пакета не копируются.
+        """
+        sock = self.sock
+        views = self.views
+        batch = self.batch
+        recvfrom_into = sock.recvfrom_into
+        perf_counter = time.perf_counter
+        handle_packet = self.handle_packet
+        sizes = [0] * batch
+        addresses = [None] * batch
+        next_sweep = 0.0
+
+        if self.mixer is not None:
+            threading.Thread(
+                target=self.mixer.run,
+                args=(is_running, self.room_targets),
+                name='voice-mixer',
+                daemon=True
+            ).start()
+
+        while is_running():
+            if self.talking:
+                # Пока кто-то говорит, прием не блокируется дольше TALK_SWEEP,
+                # чтобы вовремя закрыть фразы пропавших отправителей
+                now = time.monotonic()
+                if now >= next_sweep:
+                    self.expire_talkers(now)
+                    next_sweep = now + TALK_SWEEP
+                if self.talking and not select.select([sock], [], [], TALK_SWEEP)[0]:
+                    continue
+            try:
+                sizes[0], addresses[0] = recvfrom_into(views[0])
+                count = 1
+                while count < batch:
+                    try:
+                        sizes[count], addresses[count] = recvfrom_into(
+                            views[count], 0, MSG_DONTWAIT
+                        )
+                    except (BlockingIOError, InterruptedError):
+                        break
+                    count += 1
+            except socket.timeout:
+                continue
+            except OSError as e:
+                if is_running():
+                    voice_log.error("Ошибка голосового соединения: %s", e)
+                continue
+
+            self.received += count
+            started = perf_counter()
+            for i in range(count):
+                try:
+                    handle_packet(views[i][:sizes[i]], addresses[i])
+                except Exception as e:
+                    voice_log.error("Ошибка голосового соединения: %s", e)
+            self.busy += perf_counter() - started
+
+    def expire_talkers(self, now):
+        """Завершение фраз, от которых давно нет пакетов"""
+        expired = [
+            address for address, seen in self.talking.items()
+            if now - seen > TALK_TIMEOUT
+        ]
+        for address in expired:
+            del self.talking[address]
+            username = self.addresses.get(address)
+            room = self.address_rooms.get(address)
+            if self.on_talk and username is not None and room is not None:
+                self.on_talk(username, room, False)
+
+    def stats(self):
+        """Счетчики ретранслятора"""
+        stats = {
+            'registered': len(self.addresses),
+            'rooms': len(self.room_targets),
+            'talking': len(self.talking),
+            'reports': self.reports,
+            'send_errors': self.send_errors,
+            'busy': self.busy,
+            'received': self.received,
+            'forwarded': self.forwarded,
+            'rejected': self.rejected,
+            'speaker_dropped': self.speaker_dropped,
+            'speaker_dropped_forwards': self.speaker_dropped_forwards,
+        }
+        if self.mixer is not None:
+            stats.update(self.mixer.stats())
+        return stats
+
+    def _move(self, address, old_room, new_room):
+        """Перенос адреса между комнатами; вызывается под self.lock"""
+        # Незаконченная фраза в прежней комнате закрывается без события:
+        # участники и так получают user_left
+        self.talking.pop(address, None)
+        if old_room is not None:
+            members = self.room_addresses.get(old_room)
+            if members is not None:
+                members.discard(address)
+                self._publish(old_room)
+        if new_room is None:
+            self.address_rooms.pop(address, None)
+            return
+        self.address_rooms[address] = new_room
+        self.room_addresses.setdefault(new_room, set()).add(address)
+        self._publish(new_room)
+
+    def _publish(self, room):
+        """Обновление снимка адресов комнаты для горячего пути"""
+        members = self.room_addresses.get(room)
+        if members:
+            self.room_targets[room] = tuple(members)
+        else:
+            self.room_addresses.pop(room, None)
+            self.room_targets.pop(room, None)
+            self.speakers.pop(room, None)
+
+
+def allocate_voice_id(voice_ids, last_voice_id):
+    """Следующий после last_voice_id незанятый номер отправителя (1..65535)"""
+    used = set(voice_ids.values())
+    voice_id = last_voice_id
+    for _ in range(0xFFFF):
+        voice_id = voice_id % 0xFFFF + 1
+        if voice_id not in used:
+            return voice_id
+    raise RuntimeError("Закончились номера отправителей голоса")
+
+
+def encode_report(sent_ms, rtt_ms, blocks):
+    """Пакет REPORT: blocks - [(voice_id, принято, потеряно, джиттер в мс)]"""
+    blocks = blocks[:MAX_REPORT_BLOCKS]
+    rtt = RTT_UNKNOWN if rtt_ms is None else min(int(rtt_ms), RTT_UNKNOWN - 1)
+    parts = [REPORT_HEADER.pack(PACKET_REPORT, sent_ms & 0xFFFFFFFF, rtt, len(blocks))]
+    for sender, received, lost, jitter_ms in blocks:
+        parts.append(REPORT_BLOCK.pack(
+            sender, received & 0xFFFFFFFF, lost & 0xFFFFFFFF,
+            min(int(jitter_ms * 10), 0xFFFF)
+        ))
+    return b''.join(parts)
+
+
+def decode_report(data):
+    """Пакет REPORT -> (RTT в мс или None, [(voice_id, принято, потеряно, джиттер в мс)]).
+
+    Блоки, не поместившиеся в датаграмму, отбрасываются.
+    """
+    _, _, rtt, count = REPORT_HEADER.unpack_from(data)
+    count = min(count, (len(data) - REPORT_HEADER.size) // REPORT_BLOCK.size)
+    blocks = []
+    for index in range(count):
+        sender, received, lost, jitter = REPORT_BLOCK.unpack_from(
+            data, REPORT_HEADER.size + index * REPORT_BLOCK.size
+        )
+        blocks.append((sender, received, lost, jitter / 10))
+    return (None if rtt == RTT_UNKNOWN else rtt), blocks
@@ -0,0 +1,249 @@
+"""
+Сводка отчетов получателей о качестве голоса.
+
+Клиент раз в AUDIO_CONFIG['report_interval'] секунд сообщает по каждому
+слышимому отправителю накопительные счетчики принятых и потерянных
+пакетов и джиттер, а также RTT до ретранслятора (формат - voice_relay.py).
+Здесь накопительные счетчики превращаются в долю потерь за последний
+интервал, и отчеты сводятся:
+
+    по слушателю     потери и джиттер всего, что он принимает, и его RTT
+    по отправителю   потери его потока, усредненные по всем слушателям
+    по комнате       средние и худшие значения участников
+
+Потери у одного слушателя - плохой канал у него; поток отправителя
+теряется у всех - плохой канал у отправителя; плохо у большинства
+комнаты - перегружен ретранслятор или сама комната (overloaded).
+
+Все состояние в памяти; отчеты старше REPORT_TTL в сводку не попадают.
+"""
+
+import threading
+import time
+
+LOSS_WARN_PCT = 5.0
+JITTER_WARN_MS = 40.0
+RTT_WARN_MS = 300.0
+REPORT_TTL = 30.0  # секунд, после которых отчет считается устаревшим
+
+
+class VoiceReports:
+    """Последние отчеты получателей; потокобезопасно"""
+
+    def __init__(self, ttl=REPORT_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.listeners = {}  # {username: _Listener}
+        self.received = 0
+
+    def update(self, username, room, rtt_ms, blocks, now=None):
+        """Отчет получателя: blocks - [(voice_id, принято, потеряно, джиттер в мс)]"""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            listener = self.listeners.get(username)
+            if listener is None:
+                listener = self.listeners[username] = _Listener()
+            listener.update(room, rtt_ms, blocks, now)
+            self.received += 1
+
+    def remove(self, username):
+        with self.lock:
+            self.listeners.pop(username, None)
+
+    def user_summary(self, username, names=None, now=None):
+        """Качество приема пользователя и потоков, которые он слышит, или None"""
+        if now is None:
+            now = time.monotonic()
+        names = names or {}
+        with self.lock:
+            listener = self.listeners.get(username)
+            if listener is None or now - listener.updated > self.ttl:
+                return None
+            summary = listener.summary(username, now)
+            summary['streams'] = [
+                {
+                    'sender': names.get(sender, sender),
+                    'loss_pct': stream.loss_pct,
+                    'jitter_ms': stream.jitter_ms,
+                    'received': stream.received,
+                    'lost': stream.lost,
+                }
+                for sender, stream in listener.streams.items()
+            ]
+        return summary
+
+    def room_summary(self, room, names=None, now=None):
+        """Сводка комнаты: слушатели (худшие первыми), отправители, признак перегрузки"""
+        if now is None:
+            now = time.monotonic()
+        names = names or {}
+        with self.lock:
+            listeners = [
+                listener.summary(username, now)
+                for username, listener in self.listeners.items()
+                if listener.room == room and now - listener.updated <= self.ttl
+            ]
+            senders = {}
+            for listener in self.listeners.values():
+                if listener.room != room or now - listener.updated > self.ttl:
+                    continue
+                for sender, stream in listener.streams.items():
+                    senders.setdefault(sender, []).append(stream.loss_pct)
+        return _room_entry(room, listeners, senders, names)
+
+    def sender_health(self, now=None):
+        """Потоки, слышные за последний интервал: {voice_id: (потери %, джиттер мс)}.
+
+        Значения усреднены по слушателям, поэтому один плохой канал
+        слушателя не выдается за проблему отправителя.
+        """
+        if now is None:
+            now = time.monotonic()
+        samples = {}
+        with self.lock:
+            for listener in self.listeners.values():
+                if now - listener.updated > self.ttl:
+                    continue
+                for sender, stream in listener.streams.items():
+                    if stream.active:
+                        samples.setdefault(sender, []).append((stream.loss_pct, stream.jitter_ms))
+        return {
+            sender: (
+                sum(loss for loss, _ in values) / len(values),
+                sum(jitter for _, jitter in values) / len(values),
+            )
+            for sender, values in samples.items()
+        }
+
+    def overview(self, names=None, now=None):
+        """Сводки всех комнат с отчетами, худшие первыми (без списков участников)"""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            rooms = {
+                listener.room for listener in self.listeners.values()
+                if now - listener.updated <= self.ttl
+            }
+        summaries = [self.room_summary(room, names, now) for room in rooms]
+        for summary in summaries:
+            summary['listeners'] = len(summary['listeners'])
+            summary['senders'] = len(summary['senders'])
+        summaries.sort(key=lambda summary: summary['loss_pct'], reverse=True)
+        return summaries
+
+
+class _Stream:
+    """Поток одного отправителя у одного слушателя"""
+
+    __slots__ = ('received', 'lost', 'loss_pct', 'jitter_ms', 'updated', 'active')
+
+    def __init__(self):
+        self.received = 0
+        self.lost = 0
+        self.loss_pct = 0.0
+        self.jitter_ms = 0.0
+        self.updated = 0.0
+        self.active = False  # за последний интервал были пакеты
+
+    def update(self, received, lost, jitter_ms, now):
+        """Накопительные счетчики отчета -> потери за интервал; пакеты за интервал"""
+        delta_received = received - self.received
+        delta_lost = lost - self.lost
+        if delta_received < 0 or delta_lost < 0:
+            # Клиент начал прием заново (переподключение, новый поток)
+            delta_received = received
+            delta_lost = lost
+        expected = delta_received + delta_lost
+        self.active = expected > 0
+        if expected:
+            self.loss_pct = round(delta_lost * 100 / expected, 1)
+        self.received = received
+        self.lost = lost
+        self.jitter_ms = jitter_ms
+        self.updated = now
+        return delta_received, delta_lost
+
+
+class _Listener:
+    """Последний отчет одного пользователя"""
+
+    def __init__(self):
+        self.room = None
+        self.rtt_ms = None
+        self.updated = 0.0
+        self.streams = {}  # {voice_id отправителя: _Stream}
+        self.loss_pct = 0.0
+        self.jitter_ms = 0.0
+
+    def update(self, room, rtt_ms, blocks, now):
+        if room != self.room:
+            self.streams.clear()
+        self.room = room
+        if rtt_ms is not None:
+            self.rtt_ms = rtt_ms
+        self.updated = now
+        total_received = total_lost = 0
+        jitter_ms = 0.0
+        for sender, received, lost, stream_jitter in blocks:
+            stream = self.streams.get(sender)
+            if stream is None:
+                stream = self.streams[sender] = _Stream()
+            delta_received, delta_lost = stream.update(received, lost, stream_jitter, now)
+            total_received += delta_received
+            total_lost += delta_lost
+            jitter_ms = max(jitter_ms, stream_jitter)
+        if total_received + total_lost:
+            self.loss_pct = round(total_lost * 100 / (total_received + total_lost), 1)
+        self.jitter_ms = jitter_ms
+        # Отправители, которых слушатель больше не слышит
+        for sender in [s for s, stream in self.streams.items() if stream.updated != now]:
+            del self.streams[sender]
+
+    def summary(self, username, now):
+        warnings = []
+        if self.loss_pct >= LOSS_WARN_PCT:
+            warnings.append('loss')
+        if self.jitter_ms >= JITTER_WARN_MS:
+            warnings.append('jitter')
+        if self.rtt_ms is not None and self.rtt_ms >= RTT_WARN_MS:
+            warnings.append('rtt')
+        return {
+            'username': username,
+            'room': self.room,
+            'loss_pct': self.loss_pct,
+            'jitter_ms': self.jitter_ms,
+            'rtt_ms': self.rtt_ms,
+            'streams': len(self.streams),
+            'age': round(now - self.updated, 1),
+            'warnings': warnings,
+        }
+
+
+def _room_entry(room, listeners, senders, names):
+    listeners.sort(key=lambda entry: entry['loss_pct'], reverse=True)
+    rtts = [entry['rtt_ms'] for entry in listeners if entry['rtt_ms'] is not None]
+    lossy = sum(1 for entry in listeners if 'loss' in entry['warnings'])
+    sender_entries = [
+        {
+            'username': names.get(sender, sender),
+            'loss_pct': round(sum(losses) / len(losses), 1),
+            'listeners': len(losses),
+        }
+        for sender, losses in senders.items()
+    ]
+    sender_entries.sort(key=lambda entry: entry['loss_pct'], reverse=True)
+    return {
+        'room': room,
+        'loss_pct': round(
+            sum(entry['loss_pct'] for entry in listeners) / len(listeners), 1
+        ) if listeners else 0.0,
+        'worst_loss_pct': listeners[0]['loss_pct'] if listeners else 0.0,
+        'jitter_ms': max((entry['jitter_ms'] for entry in listeners), default=0.0),
+        'rtt_ms': round(sum(rtts) / len(rtts)) if rtts else None,
+        'max_rtt_ms': max(rtts) if rtts else None,
+        # Потери у большинства слушателей - проблема не отдельных каналов
+        'overloaded': len(listeners) >= 2 and lossy * 2 > len(listeners),
+        'listeners': listeners,
+        'senders': sender_entries,
+    }
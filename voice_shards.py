@@ -0,0 +1,201 @@
+"""
+Многопроцессная ретрансляция голоса.
+
+N процессов-обработчиков слушают один voice_port с SO_REUSEPORT, и ядро
+распределяет датаграммы между ними по адресу отправителя. Главный процесс
+VoiceChatServer рассылает всем обработчикам каждое изменение состояния
+(токены, комнаты, блокировки), поэтому любой обработчик знает все комнаты
+и может переслать пакет сам. Привязку UDP-адреса видит только обработчик,
+получивший REGISTER; он сообщает о ней главному процессу, а тот
+пересылает ее остальным. События ретранслятора (on_talk, on_report)
+обработчики передают главному процессу по каналу событий.
+
+Требует Linux (SO_REUSEPORT с распределением нагрузки).
+"""
+
+import logging
+import multiprocessing
+import multiprocessing.connection
+import secrets
+import socket
+import threading
+
+from voice_relay import VoiceRelay, allocate_voice_id
+
+STATS_INTERVAL = 1.0
+# Колбэки VoiceRelay, которые вызываются в главном процессе
+CALLBACKS = ('on_talk', 'on_report')
+
+
+def relay_worker(index, host, port, commands, events, max_speakers=0, speaker_limits=None,
+                 callbacks=()):
+    """Процесс-обработчик: собственный сокет на общем порту и копия состояния"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+
+    events_lock = threading.Lock()
+
+    def send_event(event):
+        with events_lock:
+            events.send(event)
+
+    relay = VoiceRelay(
+        sock,
+        on_register=lambda token, address: send_event(('registered', index, token, address)),
+        max_speakers=max_speakers,
+        speaker_limits=speaker_limits,
+        **{
+            name: (lambda *args, name=name: send_event((name,) + args))
+            for name in callbacks
+        }
+    )
+
+    def read_commands():
+        while True:
+            try:
+                if commands.poll(STATS_INTERVAL):
+                    relay.apply(commands.recv())
+                else:
+                    send_event(('stats', index, relay.stats()))
+            except (EOFError, OSError):
+                # Главный процесс завершился
+                sock.close()
+                return
+
+    threading.Thread(target=read_commands, daemon=True).start()
+    relay.serve(lambda: True)
+
+
+class ShardedVoiceRelay:
+    """Интерфейс VoiceRelay поверх нескольких процессов-обработчиков"""
+
+    def __init__(self, host, port, workers, max_speakers=0, speaker_limits=None, on_talk=None,
+                 on_report=None):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            raise RuntimeError("Многопроцессный режим голоса требует SO_REUSEPORT (Linux)")
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.max_speakers = max_speakers
+        self.speaker_limits = dict(speaker_limits or {})
+        self.on_talk = on_talk
+        self.on_report = on_report
+        self.processes = []
+        self.command_pipes = []
+        self.event_pipes = []
+        self.lock = threading.Lock()
+        self.worker_stats = {}
+        self.voice_ids = {}  # {username: voice_id}
+        self.last_voice_id = 0
+
+    def start(self):
+        """Запуск процессов-обработчиков"""
+        context = multiprocessing.get_context('spawn')
+        for index in range(self.workers):
+            command_r, command_w = context.Pipe(duplex=False)
+            event_r, event_w = context.Pipe(duplex=False)
+            process = context.Process(
+                target=relay_worker,
+                args=(
+                    index, self.host, self.port, command_r, event_w,
+                    self.max_speakers, self.speaker_limits,
+                    tuple(name for name in CALLBACKS if getattr(self, name) is not None)
+                ),
+                name=f'voice-relay-{index}',
+                daemon=True
+            )
+            process.start()
+            command_r.close()
+            event_w.close()
+            self.processes.append(process)
+            self.command_pipes.append(command_w)
+            self.event_pipes.append(event_r)
+
+    def stop(self):
+        """Остановка процессов-обработчиков"""
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.join(timeout=2)
+
+    def issue_token(self, username, room):
+        """Выдача токена и рассылка его всем обработчикам"""
+        token = secrets.token_hex(16)
+        voice_id = self.voice_ids.get(username)
+        if not voice_id:
+            voice_id = self.last_voice_id = allocate_voice_id(self.voice_ids, self.last_voice_id)
+            self.voice_ids[username] = voice_id
+        self._broadcast(('add_token', token, username, room, voice_id))
+        return token
+
+    def voice_id(self, username):
+        return self.voice_ids.get(username, 0)
+
+    def set_room(self, username, room):
+        self._broadcast(('set_room', username, room))
+
+    def remove_user(self, username):
+        self.voice_ids.pop(username, None)
+        self._broadcast(('remove_user', username))
+
+    def set_blocked(self, username, blocked):
+        self._broadcast(('set_blocked', username, blocked))
+
+    def set_speaker_limit(self, room, limit):
+        if limit is None:
+            self.speaker_limits.pop(room, None)
+        else:
+            self.speaker_limits[room] = limit
+        self._broadcast(('set_speaker_limit', room, limit))
+
+    def speaker_limit(self, room):
+        return self.speaker_limits.get(room, self.max_speakers)
+
+    def serve(self, is_running):
+        """Прием событий от обработчиков (вместо приема датаграмм)"""
+        while is_running():
+            for pipe in multiprocessing.connection.wait(self.event_pipes, timeout=1.0):
+                try:
+                    event = pipe.recv()
+                except (EOFError, OSError):
+                    if is_running():
+                        logging.error("Процесс ретрансляции голоса завершился")
+                    self.event_pipes.remove(pipe)
+                    continue
+
+                if event[0] == 'registered':
+                    _, index, token, address = event
+                    self._broadcast(('register_address', token, address), skip=index)
+                elif event[0] in CALLBACKS:
+                    getattr(self, event[0])(*event[1:])
+                elif event[0] == 'stats':
+                    _, index, stats = event
+                    self.worker_stats[index] = stats
+
+    def stats(self):
+        """Суммарные счетчики всех обработчиков"""
+        counters = (
+            'received', 'forwarded', 'rejected', 'speaker_dropped', 'speaker_dropped_forwards', 'talking',
+            'reports', 'send_errors', 'busy',
+        )
+        total = {'workers': self.workers}
+        total.update((name, 0) for name in counters)
+        registered = 0
+        for stats in self.worker_stats.values():
+            for name in counters:
+                total[name] += stats[name]
+            registered = max(registered, stats['registered'])
+        total['registered'] = registered
+        return total
+
+    def _broadcast(self, command, skip=None):
+        """Отправка команды всем обработчикам, кроме skip"""
+        with self.lock:
+            for index, pipe in enumerate(self.command_pipes):
+                if index == skip:
+                    continue
+                try:
+                    pipe.send(command)
+                except OSError:
+                    pass
@@ -0,0 +1,100 @@
+"""
+Выбор активных говорящих (dominant speaker) в комнате.
+
+Когда в большой комнате открыто много микрофонов, ретранслятор пересылает
+пакеты только N самых громких говорящих, остальные отбрасываются. Уровень
+берется из заголовка пакета AUDIO_LEVEL или грубо оценивается по PCM-данным.
+
+Чтобы говорящие не мигали на границе отбора, действует гистерезис: новый
+говорящий вытесняет самого тихого из активных, только если громче его на
+SWITCH_MARGIN дБ, а выбранный говорящий удерживает место не меньше MIN_HOLD
+секунд. Замолчавший (без пакетов дольше SILENCE_TIMEOUT) освобождает место сразу.
+
+Состояние комнаты меняется только в потоке приема голоса, без блокировок.
+"""
+
+import math
+
+# Уровень - дБ относительно одного отсчета 16-битного PCM:
+# 0 - тишина, около 90 - полная шкала
+MAX_LEVEL = 127
+LEVEL_SMOOTHING = 0.3  # вес нового пакета в сглаженном уровне
+SWITCH_MARGIN = 6  # дБ превышения для вытеснения активного говорящего
+MIN_HOLD = 0.5  # секунд удержания места после выбора
+SILENCE_TIMEOUT = 0.3  # секунд без пакетов, после которых место свободно
+FORGET_TIMEOUT = 30.0  # секунд без пакетов до удаления сведений о говорящем
+LEVEL_STRIDE = 8  # при оценке уровня берется каждый LEVEL_STRIDE-й отсчет
+
+
+def pcm_level(payload):
+    """Оценка уровня кадра PCM int16 по среднему модулю части отсчетов"""
+    usable = len(payload) & ~1
+    if not usable:
+        return 0
+    samples = memoryview(payload)[:usable].cast('h')[::LEVEL_STRIDE]
+    mean = sum(map(abs, samples)) / len(samples)
+    if mean < 1:
+        return 0
+    return min(MAX_LEVEL, int(20 * math.log10(mean)))
+
+
+class DominantSpeakers:
+    """Не более limit одновременно пересылаемых говорящих одной комнаты"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.levels = {}  # {address: сглаженный уровень}
+        self.last_seen = {}  # {address: время последнего пакета}
+        self.active = {}  # {address: время выбора}
+
+    def admit(self, address, level, now):
+        """Учет пакета говорящего. Возвращает True, если пакет нужно переслать"""
+        previous = self.levels.get(address)
+        if previous is None:
+            self._forget_stale(now)
+            smoothed = level
+        else:
+            smoothed = previous + (level - previous) * LEVEL_SMOOTHING
+        self.levels[address] = smoothed
+        self.last_seen[address] = now
+
+        active = self.active
+        if address in active:
+            return True
+        if len(active) < self.limit:
+            active[address] = now
+            return True
+
+        # Кандидат на вытеснение: замолчавший или самый тихий из отслуживших MIN_HOLD
+        weakest = None
+        weakest_level = None
+        for candidate, since in active.items():
+            if now - self.last_seen[candidate] > SILENCE_TIMEOUT:
+                weakest = candidate
+                weakest_level = None
+                break
+            if now - since < MIN_HOLD:
+                continue
+            candidate_level = self.levels[candidate]
+            if weakest is None or candidate_level < weakest_level:
+                weakest = candidate
+                weakest_level = candidate_level
+
+        if weakest is None:
+            return False
+        if weakest_level is not None and smoothed < weakest_level + SWITCH_MARGIN:
+            return False
+        del active[weakest]
+        active[address] = now
+        return True
+
+    def _forget_stale(self, now):
+        """Удаление давно молчащих адресов (ушедших из комнаты)"""
+        stale = [
+            address for address, seen in self.last_seen.items()
+            if now - seen > FORGET_TIMEOUT
+        ]
+        for address in stale:
+            del self.last_seen[address]
+            del self.levels[address]
+            self.active.pop(address, None)
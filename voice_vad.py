@@ -0,0 +1,103 @@
+"""
+Определение речи (VAD) на стороне отправителя.
+
+Каждый кадр (AUDIO_CONFIG['frame_ms']) оценивается по двум признакам,
+посчитанным векторно в NumPy: энергии и доле переходов через ноль (ZCR).
+Речь - кадр заметно громче оценки фонового шума; шумоподобный кадр
+(высокая ZCR: шипение, щелчки клавиатуры) считается речью, только если он
+намного громче фона. Фон отслеживается по кадрам без речи: вниз - сразу,
+вверх - медленно. Кроме того, раз в MIN_WINDOW_MS фон поднимается до
+минимума энергии за два последних окна: в настоящей речи между слогами
+всегда есть провалы до фона, поэтому громкий новый фон (включился
+вентилятор) не принимается за бесконечную речь дольше пары окон.
+
+После последнего кадра речи передача продолжается еще HANGOVER_MS
+(окончания слов тихие), затем отправитель шлет один пакет комфортного
+шума с уровнем фона и замолкает до следующей фразы.
+"""
+
+import math
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+SPEECH_MARGIN_DB = 9.0  # превышение фона, с которого кадр считается речью
+NOISE_MARGIN_DB = 18.0  # то же для шумоподобных кадров с высокой ZCR
+NOISY_ZCR = 0.45  # доля переходов через ноль, выше которой кадр похож на шум
+HANGOVER_MS = 300
+NOISE_RISE = 0.05  # скорость подстройки фона вверх в паузах
+MIN_WINDOW_MS = 800  # окно поиска минимума энергии
+MIN_NOISE_DB = 10.0
+INITIAL_NOISE_DB = 30.0
+
+SPEECH = 'speech'
+HANGOVER = 'hangover'
+SILENCE = 'silence'
+
+
+def frame_features(frame):
+    """Энергия кадра в дБ (20 * log10 RMS) и доля переходов через ноль"""
+    samples = frame.astype(np.float32)
+    energy = float(np.dot(samples, samples)) / max(len(samples), 1)
+    energy_db = 10 * math.log10(energy) if energy >= 1 else 0.0
+    crossings = np.count_nonzero(np.signbit(frame[1:]) != np.signbit(frame[:-1]))
+    zcr = crossings / max(len(frame) - 1, 1)
+    return energy_db, zcr
+
+
+class VoiceActivityDetector:
+    """Речь / хвост фразы / тишина для последовательных кадров одного микрофона"""
+
+    def __init__(self, frame_ms, hangover_ms=HANGOVER_MS):
+        if np is None:
+            raise RuntimeError("Для определения речи требуется NumPy")
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        self.window_frames = max(1, MIN_WINDOW_MS // frame_ms)
+        self.noise_db = INITIAL_NOISE_DB
+        self.window_min = None  # минимум энергии в текущем окне
+        self.previous_min = None  # и в предыдущем
+        self.window_count = 0
+        self.remaining = 0  # кадров хвоста после последней речи
+        self.speech_frames = 0
+        self.silence_frames = 0
+
+    def process(self, frame):
+        """Классификация кадра: SPEECH, HANGOVER или SILENCE"""
+        energy_db, zcr = frame_features(frame)
+        self._track_minimum(energy_db)
+        margin = NOISE_MARGIN_DB if zcr > NOISY_ZCR else SPEECH_MARGIN_DB
+        if energy_db > self.noise_db + margin:
+            self.remaining = self.hangover_frames
+            self.speech_frames += 1
+            return SPEECH
+
+        if energy_db < self.noise_db:
+            self.noise_db = max(MIN_NOISE_DB, energy_db)
+        else:
+            self.noise_db += (energy_db - self.noise_db) * NOISE_RISE
+        if self.remaining:
+            self.remaining -= 1
+            return HANGOVER
+        self.silence_frames += 1
+        return SILENCE
+
+    def _track_minimum(self, energy_db):
+        if self.window_min is None or energy_db < self.window_min:
+            self.window_min = energy_db
+        self.window_count += 1
+        if self.window_count < self.window_frames:
+            return
+        floor = self.window_min
+        if self.previous_min is not None and self.previous_min < floor:
+            floor = self.previous_min
+        if floor > self.noise_db:
+            self.noise_db = floor
+        self.previous_min = self.window_min
+        self.window_min = None
+        self.window_count = 0
+
+    def comfort_level(self):
+        """Уровень фона для пакета комфортного шума, дБ"""
+        return min(127, int(round(self.noise_db)))